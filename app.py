@@ -3,14 +3,39 @@
 import os
 import re
 import fitz
-import docx
 import sqlite3
+import io
+import csv
+import json
+import zipfile
+import hashlib
+import time
+import resource
+import signal
+import threading
 import click
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash
+import multiprocessing
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import Flask, g, render_template, request, redirect, url_for, send_file, flash, jsonify, Response, stream_with_context, abort
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from markupsafe import Markup
 import locale
+from docx_templates import CacheDeTemplates, compilar_template
+from docx_pdf import salvar_pdf
+from armazenamento import ArmazemPorConteudo, ArquivoGrandeDemais, HashesDeArquivos
+import docx
+import extrator
+from metricas import metricas, configurar_logs
+import ocr
 # Esta linha descobre o caminho absoluto para o diretório onde app.py está
 basedir = os.path.abspath(os.path.dirname(__file__))
 locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
@@ -21,7 +46,7 @@ app.secret_key = os.environ.get('SECRET_KEY', 'chave-local-para-nao-quebrar-o-te
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
 GENERATED_FOLDER = os.path.join(basedir, 'generated')
 TEMPLATE_FOLDER = os.path.join(basedir, 'templates_docx')
-DATABASE = os.path.join(basedir, 'database.db')
+DATABASE = os.environ.get('DATABASE', os.path.join(basedir, 'database.db'))
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login' 
@@ -30,155 +55,1099 @@ login_manager.login_message_category = 'info'
 app.config.update(
     UPLOAD_FOLDER=UPLOAD_FOLDER,
     GENERATED_FOLDER=GENERATED_FOLDER,
-    TEMPLATE_FOLDER=TEMPLATE_FOLDER
+    TEMPLATE_FOLDER=TEMPLATE_FOLDER,
+    # Limite de memória (em bytes) para os templates .docx mantidos em cache
+    TEMPLATE_CACHE_MAX_BYTES=int(os.environ.get('TEMPLATE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    # Pool usado para gerar os pareceres em paralelo: 'thread' ou 'process'
+    GERACAO_POOL=os.environ.get('GERACAO_POOL', 'thread'),
+    GERACAO_WORKERS=int(os.environ.get('GERACAO_WORKERS', 4)),
+    # Com TAREFAS_ASSINCRONAS=1, /upload e /gerar só enfileiram a tarefa e
+    # quem executa é o 'flask worker' (rodando em outro processo).
+    TAREFAS_ASSINCRONAS=os.environ.get('TAREFAS_ASSINCRONAS', '0') == '1',
+    TAREFAS_INTERVALO_POLL=float(os.environ.get('TAREFAS_INTERVALO_POLL', 1.0)),
+    # O worker renova 'atualizado_em' enquanto executa a tarefa; uma tarefa
+    # 'executando' sem renovação há mais de N segundos (worker morto no meio)
+    # é dada como erro em vez de deixar a página de espera consultando para sempre.
+    TAREFAS_LEASE_S=float(os.environ.get('TAREFAS_LEASE_S', 120)),
+    # Tarefas concluídas ou com erro são apagadas pelo worker depois de N dias
+    TAREFAS_RETENCAO_DIAS=float(os.environ.get('TAREFAS_RETENCAO_DIAS', 7)),
+    # Extração em streaming: lê no máximo N páginas procurando os campos e para
+    # assim que todos aparecem (0 = sempre ler o PDF inteiro). Se faltar algum
+    # campo depois dessas páginas, EXTRACAO_FALLBACK_COMPLETO=1 continua até o fim.
+    EXTRACAO_PAGINAS_STREAMING=int(os.environ.get('EXTRACAO_PAGINAS_STREAMING', 10)),
+    EXTRACAO_FALLBACK_COMPLETO=os.environ.get('EXTRACAO_FALLBACK_COMPLETO', '1') == '1',
+    # Processos usados no processamento em lote (/lote e 'flask batch-generate')
+    LOTE_WORKERS=int(os.environ.get('LOTE_WORKERS', os.cpu_count() or 2)),
+    # OCR das páginas escaneadas (com menos de OCR_MIN_CARACTERES letras na
+    # camada de texto), só nas primeiras OCR_MAX_PAGINAS páginas, onde ficam os
+    # campos. Precisa do Tesseract com o idioma OCR_IDIOMA (TESSDATA_PREFIX);
+    # sem ele, a extração usa só o texto do PDF. OCR_WORKERS = páginas em paralelo.
+    # Com EXTRACAO_ISOLADA=1 o pool do OCR é criado dentro do processo da
+    # extração e fica sob os mesmos limites (memória somada, CPU por processo).
+    OCR_HABILITADO=os.environ.get('OCR_HABILITADO', '1') == '1',
+    OCR_MAX_PAGINAS=int(os.environ.get('OCR_MAX_PAGINAS', 3)),
+    OCR_MIN_CARACTERES=int(os.environ.get('OCR_MIN_CARACTERES', 50)),
+    OCR_IDIOMA=os.environ.get('OCR_IDIOMA', 'por'),
+    OCR_DPI=int(os.environ.get('OCR_DPI', 300)),
+    OCR_WORKERS=int(os.environ.get('OCR_WORKERS', os.cpu_count() or 2)),
+    # Extração isolada: cada PDF é lido num processo filho, com limite de memória
+    # residente (MB), de tempo de CPU (s) e de páginas (0 = sem limite). O PDF
+    # que passa de algum limite é recusado como "grande demais" e o worker que
+    # atende as requisições não cresce junto.
+    EXTRACAO_ISOLADA=os.environ.get('EXTRACAO_ISOLADA', '1') == '1',
+    EXTRACAO_MAX_MEMORIA_MB=int(os.environ.get('EXTRACAO_MAX_MEMORIA_MB', 512)),
+    EXTRACAO_MAX_CPU_S=int(os.environ.get('EXTRACAO_MAX_CPU_S', 120)),
+    EXTRACAO_MAX_PAGINAS=int(os.environ.get('EXTRACAO_MAX_PAGINAS', 2000)),
+    # SQLite: espera por locks (s), cache de páginas (KiB) e cache de statements por conexão
+    DB_BUSY_TIMEOUT=float(os.environ.get('DB_BUSY_TIMEOUT', 5.0)),
+    DB_CACHE_KIB=int(os.environ.get('DB_CACHE_KIB', 16 * 1024)),
+    DB_CACHED_STATEMENTS=int(os.environ.get('DB_CACHED_STATEMENTS', 256)),
+    # Itens do histórico por página na tela inicial (e limite máximo da API de busca)
+    HISTORICO_POR_PAGINA=int(os.environ.get('HISTORICO_POR_PAGINA', 50)),
+    HISTORICO_LIMITE_API=int(os.environ.get('HISTORICO_LIMITE_API', 200)),
+    # Páginas do histórico já renderizadas mantidas em memória por worker (0 = sem cache)
+    HISTORICO_CACHE_MAX=int(os.environ.get('HISTORICO_CACHE_MAX', 256)),
+    # GERAR_PDF=1 gera sempre um PDF ao lado de cada .docx (sem isso, só quando
+    # o formulário marca 'gerar_pdf'). O PDF é diagramado pelo PyMuPDF, sem Office.
+    GERAR_PDF=os.environ.get('GERAR_PDF', '0') == '1',
+    # Tamanho máximo de uma requisição (upload de PDF) e do .zip do lote, em MB.
+    # Acima disso a requisição é recusada (413) antes de o corpo ser lido.
+    MAX_CONTENT_LENGTH=int(os.environ.get('MAX_UPLOAD_MB', 50)) * 1024 * 1024,
+    LOTE_MAX_CONTENT_LENGTH=int(os.environ.get('LOTE_MAX_UPLOAD_MB', 500)) * 1024 * 1024,
+    # PDFs enviados que nenhum parecer referencia são apagados pelo
+    # 'flask limpar-uploads' depois de N dias sem uso
+    UPLOADS_RETENCAO_DIAS=float(os.environ.get('UPLOADS_RETENCAO_DIAS', 7)),
+    # Logs: nível e formato (LOG_JSON=1 grava uma linha JSON por evento; com
+    # LOG_LEVEL=DEBUG, também o tempo de cada trecho medido). EXTRACAO_DEBUG=1
+    # grava o texto limpo de cada PDF e os dados extraídos - só para
+    # depuração, é muito volume.
+    LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    LOG_JSON=os.environ.get('LOG_JSON', '0') == '1',
+    EXTRACAO_DEBUG=os.environ.get('EXTRACAO_DEBUG', '0') == '1',
+    # /metrics (formato Prometheus). Com METRICAS_TOKEN, o scrape precisa
+    # mandar 'Authorization: Bearer <token>'. Sem ele, só responde a conexões
+    # da própria máquina que não passaram por proxy (sem X-Forwarded-For); atrás
+    # de um proxy reverso que não manda esse cabeçalho, configure o token.
+    METRICAS_TOKEN=os.environ.get('METRICAS_TOKEN', ''),
+    # Usuários da sessão mantidos em memória (sem o hash da senha) por até
+    # USUARIOS_CACHE_TTL segundos. Qualquer alteração na tabela 'user' (mesmo
+    # pelo CLI) muda 'versao_usuarios' e esvazia o cache de todos os workers.
+    USUARIOS_CACHE_TTL=float(os.environ.get('USUARIOS_CACHE_TTL', 60)),
+    USUARIOS_CACHE_MAX=int(os.environ.get('USUARIOS_CACHE_MAX', 256)),
+    # Aquecimento de cada worker do gunicorn logo depois do fork (ver
+    # gunicorn.conf.py): carrega templates, elenco e locale em segundo plano.
+    AQUECER_NA_INICIALIZACAO=os.environ.get('AQUECER_NA_INICIALIZACAO', '1') == '1'
 )
+logger = configurar_logs(app.config['LOG_LEVEL'], app.config['LOG_JSON'])
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
 os.makedirs(TEMPLATE_FOLDER, exist_ok=True)
 
+# PDFs enviados, gravados uma vez só pelo sha256 do conteúdo (uploads/blobs/)
+armazem_pdfs = ArmazemPorConteudo(UPLOAD_FOLDER)
+
+# sha256 dos pareceres gerados, usado como ETag nos downloads
+hashes_gerados = HashesDeArquivos()
+
+# Templates .docx já abertos e compilados, compartilhados pelas requisições do worker
+cache_templates = CacheDeTemplates(max_bytes=app.config['TEMPLATE_CACHE_MAX_BYTES'])
+
 # --- BANCO DE DADOS ---
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+# Tabelas criadas depois da versão inicial. Como usam IF NOT EXISTS, bancos
+# antigos ganham as tabelas novas sem precisar rodar o 'init-db' (que apaga tudo).
+TABELAS_EXTRAS = [
+    '''
+    CREATE TABLE IF NOT EXISTS tarefas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pendente',
+        progresso INTEGER NOT NULL DEFAULT 0,
+        mensagem TEXT,
+        entrada TEXT NOT NULL,
+        resultado TEXT,
+        criado_em TEXT NOT NULL,
+        atualizado_em TEXT NOT NULL
+    );
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_tarefas_status ON tarefas (status, id);',
+    '''
+    CREATE TABLE IF NOT EXISTS cache_extracao (
+        sha256 TEXT NOT NULL,
+        versao_extrator TEXT NOT NULL,
+        dados TEXT NOT NULL,
+        texto TEXT NOT NULL,
+        criado_em TEXT NOT NULL,
+        PRIMARY KEY (sha256, versao_extrator)
+    );
+    ''',
+    # Texto reconhecido pelo OCR, por página (hash do conteúdo da página)
+    '''
+    CREATE TABLE IF NOT EXISTS cache_ocr (
+        hash_pagina TEXT NOT NULL,
+        idioma TEXT NOT NULL,
+        dpi INTEGER NOT NULL,
+        texto TEXT NOT NULL,
+        criado_em TEXT NOT NULL,
+        PRIMARY KEY (hash_pagina, idioma, dpi)
+    ) WITHOUT ROWID;
+    ''',
+    # Contadores globais (versão do elenco das comissões, ver obter_elenco, e
+    # do histórico, ver cache_historico)
+    '''
+    CREATE TABLE IF NOT EXISTS meta (
+        chave TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    ''',
+    "INSERT OR IGNORE INTO meta (chave, valor) VALUES ('versao_elenco', 0);",
+    "INSERT OR IGNORE INTO meta (chave, valor) VALUES ('versao_historico', 0);",
+    "INSERT OR IGNORE INTO meta (chave, valor) VALUES ('versao_usuarios', 0);",
+]
+
+# Qualquer alteração em comissões ou membros incrementa 'versao_elenco', o que
+# invalida o snapshot em memória de todos os workers.
+TRIGGERS_ELENCO = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {tabela}_versao_{evento.lower()} AFTER {evento} ON {tabela} BEGIN
+        UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_elenco';
+    END;
+    '''
+    for tabela in ('comissoes', 'membros')
+    for evento in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Qualquer alteração em 'pareceres' (gerar, atualizar no lugar, converter em
+# PDF, deletar, limpar) incrementa 'versao_historico', o que invalida as
+# páginas do histórico em cache em todos os workers.
+TRIGGERS_HISTORICO = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS pareceres_versao_{evento.lower()} AFTER {evento} ON pareceres BEGIN
+        UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_historico';
+    END;
+    '''
+    for evento in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Qualquer alteração em 'user' (inclusive pelo CLI, em outro processo)
+# incrementa 'versao_usuarios', o que esvazia o cache de usuários dos workers.
+TRIGGERS_USUARIOS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS user_versao_{evento.lower()} AFTER {evento} ON user BEGIN
+        UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_usuarios';
+    END;
+    '''
+    for evento in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Colunas que a tabela 'comissoes' ganhou depois da versão inicial.
+# 'template' é o nome do .docx em templates_docx (NULL = template_<sigla>.docx).
+COLUNAS_COMISSOES = [
+    ('template', 'TEXT'),
+]
+
+# Colunas que a tabela 'pareceres' ganhou depois da versão inicial.
+# 'gerado_em' guarda a data em ISO 8601 (AAAA-MM-DDTHH:MM:SS), que ordena e
+# filtra por intervalo; 'data_geracao' continua sendo o texto exibido na tela.
+COLUNAS_PARECERES = [
+    ('gerado_em', 'TEXT'),
+    ('tipo_projeto', 'TEXT'),
+    ('ementa', 'TEXT'),
+    ('comissao', 'TEXT'),
+    ('arquivo_pdf', 'TEXT'),
+    ('pdf_sha256', 'TEXT'),  # PDF de origem no armazém (uploads/blobs/)
+    ('chave_render', 'TEXT'),  # hash do template + contexto (ver chave_de_render)
+    ('contexto', 'TEXT'),  # JSON do contexto resolvido (ver campos_alterados)
+]
+
+INDICES_PARECERES = [
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_numero ON pareceres (numero_projeto);',
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_pdf ON pareceres (pdf_name);',
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_gerado_em ON pareceres (gerado_em);',
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_comissao ON pareceres (comissao);',
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_pdf_sha256 ON pareceres (pdf_sha256);',
+    'CREATE INDEX IF NOT EXISTS idx_pareceres_docx ON pareceres (docx_name);',
+]
+
+# Busca textual (FTS5) na ementa e no tipo do projeto. A tabela virtual só
+# guarda o índice ('content=pareceres'); os triggers a mantêm em dia.
+FTS_PARECERES = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS pareceres_fts USING fts5(
+        ementa, tipo_projeto, content='pareceres', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS pareceres_fts_ai AFTER INSERT ON pareceres BEGIN
+        INSERT INTO pareceres_fts (rowid, ementa, tipo_projeto) VALUES (new.id, new.ementa, new.tipo_projeto);
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS pareceres_fts_ad AFTER DELETE ON pareceres BEGIN
+        INSERT INTO pareceres_fts (pareceres_fts, rowid, ementa, tipo_projeto)
+        VALUES ('delete', old.id, old.ementa, old.tipo_projeto);
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS pareceres_fts_au AFTER UPDATE OF ementa, tipo_projeto ON pareceres BEGIN
+        INSERT INTO pareceres_fts (pareceres_fts, rowid, ementa, tipo_projeto)
+        VALUES ('delete', old.id, old.ementa, old.tipo_projeto);
+        INSERT INTO pareceres_fts (rowid, ementa, tipo_projeto) VALUES (new.id, new.ementa, new.tipo_projeto);
+    END;
+    ''',
+]
+
+_db_migrado = False
+_fts_disponivel = None
+
+def migrar_db(db):
+    """Cria as tabelas e índices que ainda não existem no banco."""
+    for sql in TABELAS_EXTRAS:
+        db.execute(sql)
+    migrar_pareceres(db)
+    if db.execute("SELECT count(*) FROM sqlite_master WHERE name IN ('comissoes', 'membros')").fetchone()[0] == 2:
+        colunas = {linha[1] for linha in db.execute('PRAGMA table_info(comissoes)')}
+        for nome, tipo in COLUNAS_COMISSOES:
+            if nome not in colunas:
+                db.execute(f'ALTER TABLE comissoes ADD COLUMN {nome} {tipo}')
+        for sql in TRIGGERS_ELENCO:
+            db.execute(sql)
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'user'").fetchone():
+        for sql in TRIGGERS_USUARIOS:
+            db.execute(sql)
+    db.commit()
+
+def migrar_pareceres(db):
+    """Acrescenta as colunas novas de 'pareceres', preenche as linhas antigas e cria índices e FTS."""
+    global _fts_disponivel
+    colunas = {linha[1] for linha in db.execute('PRAGMA table_info(pareceres)')}
+    if not colunas:
+        return  # Banco novo: a tabela é criada pelo 'init-db'
+    for nome, tipo in COLUNAS_PARECERES:
+        if nome not in colunas:
+            db.execute(f'ALTER TABLE pareceres ADD COLUMN {nome} {tipo}')
+
+    # Linhas antigas: 'dd/mm/AAAA HH:MM:SS' -> 'AAAA-MM-DDTHH:MM:SS'
+    db.execute('''
+        UPDATE pareceres
+        SET gerado_em = substr(data_geracao, 7, 4) || '-' || substr(data_geracao, 4, 2) || '-'
+                        || substr(data_geracao, 1, 2) || 'T' || substr(data_geracao, 12, 8)
+        WHERE gerado_em IS NULL AND data_geracao GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9] *'
+    ''')
+    # A sigla da comissão é a última palavra do nome do arquivo ("PLOC 45_2025 CJR.docx")
+    sem_comissao = db.execute('SELECT id, docx_name FROM pareceres WHERE comissao IS NULL').fetchall()
+    if sem_comissao:
+        db.executemany('UPDATE pareceres SET comissao = ? WHERE id = ?', [
+            (os.path.splitext(docx_name)[0].rsplit(' ', 1)[-1] if ' ' in docx_name else '', id_)
+            for id_, docx_name in sem_comissao
+        ])
+
+    for sql in INDICES_PARECERES:
+        db.execute(sql)
+    for sql in TRIGGERS_HISTORICO:
+        db.execute(sql)
+
+    existia = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'pareceres_fts'").fetchone()
+    try:
+        for sql in FTS_PARECERES:
+            db.execute(sql)
+    except sqlite3.OperationalError as e:
+        # SQLite compilado sem FTS5: a busca cai para LIKE (mais lenta, mas funciona)
+        logger.warning("FTS5 indisponível (%s). A busca no histórico usará LIKE.", e)
+        _fts_disponivel = False
+        return
+    if not existia:
+        # Indexa as linhas que já estavam no banco
+        db.execute("INSERT INTO pareceres_fts (pareceres_fts) VALUES ('rebuild')")
+    _fts_disponivel = True
+
+def conectar_db():
+    """Abre uma conexão nova já com os PRAGMAs de desempenho aplicados."""
+    global _db_migrado
+    conn = sqlite3.connect(DATABASE, timeout=app.config['DB_BUSY_TIMEOUT'],
+                           cached_statements=app.config['DB_CACHED_STATEMENTS'])
     conn.row_factory = sqlite3.Row
+    # WAL: leituras não bloqueiam a escrita (e vice-versa) entre os workers do gunicorn.
+    # synchronous=NORMAL é seguro com WAL e evita um fsync a cada commit.
+    conn.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT'] * 1000)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{app.config['DB_CACHE_KIB']}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if not _db_migrado:
+        # O modo WAL fica gravado no arquivo; basta ligar uma vez por processo
+        conn.execute("PRAGMA journal_mode = WAL")
+        migrar_db(conn)
+        _db_migrado = True
     return conn
 
+def get_db():
+    """Conexão única por requisição (ou contexto da aplicação), fechada no teardown."""
+    if 'db' not in g:
+        g.db = conectar_db()
+    return g.db
+
+@app.teardown_appcontext
+def fechar_db(exception=None):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+class CacheDeUsuarios:
+    """
+    Cache LRU com validade (TTL) dos usuários da sessão: id -> (username, expira_em).
+    Só guarda o necessário para a sessão; o hash da senha nunca fica em memória.
+    Quando 'versao_usuarios' muda (tabela meta), o cache inteiro é descartado.
+    """
+
+    def __init__(self, ttl, max_itens):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._versao = None
+        self._lock = threading.Lock()
+
+    def obter(self, versao, user_id):
+        with self._lock:
+            if versao != self._versao:
+                self._itens.clear()
+                self._versao = versao
+                return None
+            item = self._itens.get(user_id)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                del self._itens[user_id]
+                return None
+            self._itens.move_to_end(user_id)
+            return item[0]
+
+    def guardar(self, versao, user_id, username):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if versao != self._versao:
+                return  # lido com uma versão que já mudou
+            self._itens[user_id] = (username, time.monotonic() + self.ttl)
+            self._itens.move_to_end(user_id)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+cache_usuarios = CacheDeUsuarios(app.config['USUARIOS_CACHE_TTL'], app.config['USUARIOS_CACHE_MAX'])
+
 @login_manager.user_loader
 def load_user(user_id):
     """Função obrigatória do Flask-Login para carregar o usuário da sessão."""
     db = get_db()
-    user_data = db.execute('SELECT * FROM user WHERE id = ?', (user_id,)).fetchone()
-    db.close()
+    # A versão é lida ANTES do usuário, como no elenco e no histórico
+    linha = db.execute("SELECT valor FROM meta WHERE chave = 'versao_usuarios'").fetchone()
+    versao = linha[0] if linha else 0
+    username = cache_usuarios.obter(versao, user_id)
+    if username is not None:
+        metricas.contar('cache', cache='usuarios', resultado='hit')
+        return User(user_id, username)
+    metricas.contar('cache', cache='usuarios', resultado='miss')
+    user_data = db.execute('SELECT id, username FROM user WHERE id = ?', (user_id,)).fetchone()
     if user_data:
-        return User(user_data['id'], user_data['username'], user_data['password_hash'])
+        cache_usuarios.guardar(versao, user_id, user_data['username'])
+        return User(user_data['id'], user_data['username'])
     return None
 
-# --- LÓGICA DE SUBSTITUIÇÃO DE TEXTO (para manter a formatação) ---
-def replace_text_in_paragraph(paragraph, key, value):
-    """
-    Substitui um placeholder em um parágrafo, mantendo a formatação.
-    Esta versão robusta lida com placeholders quebrados em múltiplos 'runs'.
-    """
-    if key not in paragraph.text:
-        return
-
-    full_text = "".join(run.text for run in paragraph.runs)
-    if key not in full_text:
-        return
-
-    run_texts = [run.text for run in paragraph.runs]
-    found = False
-    for i in range(len(run_texts)):
-        if key in run_texts[i]:
-            run_texts[i] = run_texts[i].replace(key, value)
-            found = True
-            break
-        
-        combined_text = "".join(run_texts[i:])
-        if combined_text.startswith(key):
-            temp_text = ""
-            j = i
-            while len(temp_text) < len(key) and j < len(run_texts):
-                temp_text += run_texts[j]
-                j += 1
-            
-            run_texts[i] = temp_text.replace(key, value, 1)
-            for k in range(i + 1, j):
-                run_texts[k] = ""
-            found = True
-            break
-
-    if found:
-        for i in range(len(paragraph.runs)):
-            paragraph.runs[i].text = run_texts[i]
-
 # --- MODELO DE USUÁRIO PARA O LOGIN ---
 class User(UserMixin):
     # UserMixin é uma classe especial do Flask-Login
     # que já nos dá funções como is_authenticated, etc.
-    def __init__(self, id, username, password_hash):
+    # O hash da senha só é lido no login; o usuário da sessão não o carrega
+    def __init__(self, id, username):
         self.id = id
         self.username = username
-        self.password_hash = password_hash
 
     # Esta função é necessária para o Flask-Login
     def get_id(self):
         return str(self.id)
 
+# --- ELENCO DAS COMISSÕES ---
+# Comissões e membros mudam raramente, mas são lidos em quase toda tela. Cada
+# worker guarda um snapshot imutável, carregado numa única consulta, e só o
+# recarrega quando 'versao_elenco' (tabela meta) muda.
+Comissao = namedtuple('Comissao', 'id nome sigla template membros')
+Membro = namedtuple('Membro', 'id comissao_id nome cargo')
+
+class ElencoComissoes:
+    """Snapshot imutável das comissões (ordem de id) e dos seus membros (ordem de id)."""
+
+    def __init__(self, versao, comissoes):
+        self.versao = versao
+        self.comissoes = tuple(comissoes)
+        self.comissoes_por_nome = tuple(sorted(self.comissoes, key=lambda c: c.nome))
+        self.membros = tuple(sorted((m for c in self.comissoes for m in c.membros), key=lambda m: m.id))
+        self._por_sigla = {c.sigla: c for c in self.comissoes}
+        self._por_id = {c.id: c for c in self.comissoes}
+        self._membros_por_id = {m.id: m for m in self.membros}
+
+    def por_sigla(self, sigla):
+        return self._por_sigla.get(sigla)
+
+    def por_id(self, comissao_id):
+        return self._por_id.get(comissao_id)
+
+    def membro(self, membro_id):
+        try:
+            return self._membros_por_id.get(int(membro_id))
+        except (TypeError, ValueError):
+            return None
+
+    def membros_por_nome(self, comissao):
+        return sorted(comissao.membros, key=lambda m: m.nome)
+
+def carregar_elenco(db, versao):
+    """Lê comissões e membros numa única consulta e monta o snapshot."""
+    linhas = db.execute('''
+        SELECT c.id AS c_id, c.nome AS c_nome, c.sigla, c.template, m.id AS m_id, m.nome AS m_nome, m.cargo
+        FROM comissoes c LEFT JOIN membros m ON m.comissao_id = c.id
+        ORDER BY c.id, m.id
+    ''').fetchall()
+    comissoes = []
+    for linha in linhas:
+        if not comissoes or comissoes[-1][0] != linha['c_id']:
+            comissoes.append((linha['c_id'], linha['c_nome'], linha['sigla'], linha['template'], []))
+        if linha['m_id'] is not None:
+            comissoes[-1][4].append(Membro(linha['m_id'], linha['c_id'], linha['m_nome'], linha['cargo']))
+    return ElencoComissoes(versao, (Comissao(id_, nome, sigla, template, tuple(membros))
+                                    for id_, nome, sigla, template, membros in comissoes))
+
+_elenco = None
+
+def obter_elenco():
+    """Snapshot atual do elenco; confere a versão no banco uma vez por requisição."""
+    global _elenco
+    if 'elenco' not in g:
+        db = get_db()
+        linha = db.execute("SELECT valor FROM meta WHERE chave = 'versao_elenco'").fetchone()
+        versao = linha[0] if linha else 0
+        # A versão é lida ANTES dos dados: se alguém alterar o elenco no meio,
+        # o snapshot fica com a versão antiga e é recarregado na próxima vez.
+        if _elenco is None or _elenco.versao != versao:
+            _elenco = carregar_elenco(db, versao)
+        g.elenco = _elenco
+    return g.elenco
+
 # --- LÓGICA PRINCIPAL ---
-def processar_pdf(pdf_path):
-    try:
-        texto_extraido = ""
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                texto_extraido += page.get_text() + " "
 
-        texto_limpo = re.sub(r'\s+', ' ', texto_extraido.replace('\n', ' '))
+# As regras de extração (regex, correções de OCR, prioridades) ficam no
+# módulo 'extrator'. A versão do extrator muda sozinha quando qualquer regra
+# ou o modo de leitura muda, invalidando o cache de extração.
+def versao_extrator():
+    return hashlib.sha256(json.dumps([
+        extrator.versao(),
+        app.config['EXTRACAO_PAGINAS_STREAMING'],
+        app.config['EXTRACAO_FALLBACK_COMPLETO'],
+        # Com OCR os resultados mudam: instalar o Tesseract invalida o cache
+        app.config['OCR_HABILITADO'] and ocr.tesseract_disponivel(app.config['OCR_IDIOMA']),
+        app.config['OCR_MAX_PAGINAS'],
+        app.config['OCR_MIN_CARACTERES'],
+    ]).encode('utf-8')).hexdigest()[:16]
+
+class PDFGrandeDemais(Exception):
+    """O PDF passou de um limite da extração ('motivo': paginas, memoria, cpu ou tempo)."""
+
+    def __init__(self, mensagem, motivo):
+        # Os dois vão em 'args' para a exceção sobreviver ao pickle (pool do lote)
+        super().__init__(mensagem, motivo)
+        self.mensagem = mensagem
+        self.motivo = motivo
+
+    def __str__(self):
+        return self.mensagem
+
+# Campos que, uma vez encontrados, permitem parar de ler o PDF
+CAMPOS_OBRIGATORIOS = ("TIPO_PROJETO", "NUMERO_PROJETO", "DATA_PROJETO", "EMENTA")
+
+padrao_espacos = re.compile(r'\s+')
+
+def hash_arquivo(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def limpar_texto(texto):
+    return padrao_espacos.sub(' ', texto).strip()
+
+# --- OCR DAS PÁGINAS ESCANEADAS ---
+_pool_ocr = None
+
+def get_pool_ocr():
+    """Pool de processos do OCR (o Tesseract usa um núcleo por página)."""
+    global _pool_ocr
+    if _pool_ocr is None:
+        _pool_ocr = ProcessPoolExecutor(max_workers=app.config['OCR_WORKERS'])
+    return _pool_ocr
+
+def descartar_pool_ocr(pool):
+    """
+    Se um processo do OCR morre (falta de memória, crash do Tesseract), o pool
+    fica quebrado para sempre: descarta-o para que o próximo PDF crie outro.
+    """
+    global _pool_ocr
+    if _pool_ocr is pool:
+        _pool_ocr = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def buscar_cache_ocr(db, hashes):
+    """{hash_pagina: texto} das páginas que já passaram pelo OCR com o mesmo idioma e dpi."""
+    if not hashes:
+        return {}
+    linhas = db.execute(
+        f"SELECT hash_pagina, texto FROM cache_ocr WHERE idioma = ? AND dpi = ? "
+        f"AND hash_pagina IN ({','.join('?' * len(hashes))})",
+        (app.config['OCR_IDIOMA'], app.config['OCR_DPI'], *hashes)).fetchall()
+    return {linha['hash_pagina']: linha['texto'] for linha in linhas}
+
+def gravar_cache_ocr(db, textos):
+    agora = datetime.now().isoformat(timespec='seconds')
+    with db:
+        db.executemany('INSERT OR REPLACE INTO cache_ocr (hash_pagina, idioma, dpi, texto, criado_em) '
+                       'VALUES (?, ?, ?, ?, ?)',
+                       [(hash_pagina, app.config['OCR_IDIOMA'], app.config['OCR_DPI'], texto, agora)
+                        for hash_pagina, texto in textos.items()])
+
+def reconhecer_paginas_escaneadas(pdf_path, escaneadas):
+    """
+    OCR de {indice: hash_pagina}. Devolve {indice: texto_limpo} só das páginas
+    em que o OCR leu algo. Cada página reconhecida fica em cache_ocr, então o
+    mesmo escaneamento (mesmo que em outro PDF) nunca passa duas vezes pelo OCR.
+    """
+    db = get_db()
+    em_cache = buscar_cache_ocr(db, list(set(escaneadas.values())))
+    textos = {indice: em_cache[h] for indice, h in escaneadas.items() if h in em_cache}
+    metricas.contar('paginas_ocr', len(textos), resultado='cache')
+
+    pendentes = [indice for indice in escaneadas if indice not in textos]
+    idioma, dpi = app.config['OCR_IDIOMA'], app.config['OCR_DPI']
+    if pendentes:
+        with metricas.medir('extracao.ocr', paginas=len(pendentes)):
+            pool = None
+            if len(pendentes) == 1 or app.config['OCR_WORKERS'] <= 1:
+                futuros = [(indice, None) for indice in pendentes]
+            else:
+                pool = get_pool_ocr()
+                try:
+                    futuros = [(indice, pool.submit(ocr.reconhecer_pagina, pdf_path, indice, idioma, dpi))
+                               for indice in pendentes]
+                except BrokenProcessPool:
+                    # Quebrado por outro PDF; este faz o OCR aqui mesmo
+                    descartar_pool_ocr(pool)
+                    futuros = [(indice, None) for indice in pendentes]
+            novos = {}
+            for indice, futuro in futuros:
+                try:
+                    texto = futuro.result() if futuro else ocr.reconhecer_pagina(pdf_path, indice, idioma, dpi)
+                except BrokenProcessPool as e:
+                    if pool is not None:
+                        descartar_pool_ocr(pool)
+                    metricas.contar('paginas_ocr', resultado='falha')
+                    logger.warning("OCR falhou na página %d de %s (processo do OCR morreu): %s",
+                                   indice + 1, pdf_path, e)
+                    continue
+                except Exception as e:
+                    metricas.contar('paginas_ocr', resultado='falha')
+                    logger.warning("OCR falhou na página %d de %s: %s", indice + 1, pdf_path, e)
+                    continue
+                metricas.contar('paginas_ocr', resultado='reconhecida')
+                novos[escaneadas[indice]] = textos[indice] = limpar_texto(texto)
+        if novos:
+            gravar_cache_ocr(db, novos)
+    return {indice: texto for indice, texto in textos.items() if texto}
+
+def ler_paginas_iniciais(pdf_path, doc):
+    """
+    Texto das primeiras OCR_MAX_PAGINAS páginas: {indice: (texto_limpo, fonte)},
+    com fonte 'texto' (camada de texto do PDF) ou 'ocr'. As páginas com pouca
+    camada de texto passam pelo OCR, todas de uma vez (em paralelo).
+    """
+    paginas = {}
+    escaneadas = {}
+    for indice in range(min(app.config['OCR_MAX_PAGINAS'], doc.page_count)):
+        page = doc[indice]
+        with metricas.medir('extracao.pagina'):
+            paginas[indice] = (limpar_texto(page.get_text()), 'texto')
+        if ocr.precisa_ocr(page, paginas[indice][0], app.config['OCR_MIN_CARACTERES']):
+            escaneadas[indice] = ocr.hash_pagina(doc, page)
+
+    if escaneadas:
+        if not ocr.tesseract_disponivel(app.config['OCR_IDIOMA']):
+            metricas.contar('paginas_ocr', len(escaneadas), resultado='indisponivel')
+            logger.warning("%d página(s) sem texto em %s, mas o Tesseract (idioma '%s') não está instalado.",
+                           len(escaneadas), os.path.basename(pdf_path), app.config['OCR_IDIOMA'])
+            return paginas
+        for indice, texto in reconhecer_paginas_escaneadas(pdf_path, escaneadas).items():
+            # Fica com o OCR só se ele leu mais que a camada de texto
+            if ocr.caracteres_uteis(texto) > ocr.caracteres_uteis(paginas[indice][0]):
+                paginas[indice] = (texto, 'ocr')
+    return paginas
+
+# A cada N páginas lidas, esvazia o cache interno do MuPDF (fontes, imagens
+# decodificadas), para a memória não crescer com o tamanho do documento
+PAGINAS_ENTRE_LIMPEZAS = 25
+
+def iterar_paginas_pdf(pdf_path):
+    """
+    Gera (numero_da_pagina, total_de_paginas, texto_limpo_da_pagina, fonte), uma
+    página por vez. O PDF é aberto direto do disco (o MuPDF lê sob demanda) e
+    cada página é liberada logo depois de lida. Um PDF com mais de
+    EXTRACAO_MAX_PAGINAS páginas levanta PDFGrandeDemais antes de ler qualquer uma.
+    """
+    with metricas.medir('extracao.abrir_pdf'):
+        doc = fitz.open(pdf_path, filetype='pdf')
+    with doc:
+        total = doc.page_count
+        max_paginas = app.config['EXTRACAO_MAX_PAGINAS']
+        if max_paginas and total > max_paginas:
+            raise PDFGrandeDemais(f"O PDF tem {total} páginas; o limite é de {max_paginas}.", 'paginas')
+        iniciais = ler_paginas_iniciais(pdf_path, doc) if app.config['OCR_HABILITADO'] else {}
+        for i in range(total):
+            if i in iniciais:
+                texto, fonte = iniciais.pop(i)
+            else:
+                with metricas.medir('extracao.pagina'):
+                    page = doc.load_page(i)
+                    texto, fonte = limpar_texto(page.get_text()), 'texto'
+                    del page
+            if (i + 1) % PAGINAS_ENTRE_LIMPEZAS == 0:
+                fitz.TOOLS.store_shrink(100)
+            metricas.contar('paginas_lidas', fonte=fonte)
+            yield i + 1, total, texto, fonte
+
+def extrair_texto_pdf(pdf_path, ao_progredir=None, parar_quando=None, max_paginas=0, fallback_completo=True):
+    """
+    Lê o PDF página a página e devolve (texto limpo acumulado, trechos), onde
+    'trechos' é [(inicio, fim, numero_da_pagina, fonte)] de cada página no texto.
 
-        print("--- TEXTO LIMPO PARA ANÁLISE REGEX ---")
-        print(texto_limpo)
-        print("-----------------------------------------")
+    Se 'parar_quando(texto_pagina)' for informado, ele recebe cada uma das
+    primeiras 'max_paginas' páginas (só a página nova: quem testa guarda o que
+    já achou) e a leitura termina assim que ele retornar True. Se essas páginas não bastarem, 'fallback_completo' decide
+    se o resto do documento é lido (sem testar de novo a cada página).
+    """
+    paginas = []
+    trechos = []
+    posicao = 0
+    for numero, total, texto_pagina, fonte in iterar_paginas_pdf(pdf_path):
+        if texto_pagina:
+            paginas.append(texto_pagina)
+            trechos.append((posicao, posicao + len(texto_pagina), numero, fonte))
+            posicao += len(texto_pagina) + 1  # o ' ' que separa as páginas
+        if ao_progredir:
+            ao_progredir(numero, total)
+
+        if parar_quando and numero <= max_paginas:
+            if parar_quando(texto_pagina):
+                logger.debug("Streaming: campos encontrados na página %d de %d.", numero, total)
+                metricas.contar('extracao_streaming', resultado='parou_cedo')
+                if ao_progredir:
+                    ao_progredir(total, total)
+                break
+            if numero == max_paginas and not fallback_completo:
+                logger.debug("Streaming: campos incompletos após %d páginas; leitura encerrada.", numero)
+                metricas.contar('extracao_streaming', resultado='incompleto')
+                break
+    else:
+        if parar_quando:
+            metricas.contar('extracao_streaming', resultado='documento_inteiro')
+
+    return ' '.join(paginas), trechos
+
+def anotar_fontes(detalhes, trechos):
+    """Acrescenta a cada campo a página e a fonte ('texto' ou 'ocr') de onde ele saiu."""
+    for detalhe in detalhes.values():
+        cobertos = [t for t in trechos if t[0] < detalhe['fim'] and detalhe['inicio'] < t[1]]
+        if cobertos:
+            detalhe['pagina'] = cobertos[0][2]
+            detalhe['fonte'] = 'ocr' if any(t[3] == 'ocr' for t in cobertos) else 'texto'
+
+def extrair_campos(texto_limpo):
+    """
+    Roda as regras do extrator sobre o texto limpo e devolve os dados do projeto.
+    Em 'DETALHES_EXTRACAO' vão a posição, a regra e a confiança de cada campo.
+    O acerto de cada campo é contado em 'legistech_campos_extraidos_total'.
+    """
+    with metricas.medir('extracao.regex'):
+        resultado = extrator.extrair(texto_limpo)
+
+    for campo in CAMPOS_OBRIGATORIOS:
+        detalhe = resultado.detalhes.get(campo)
+        if detalhe is None:
+            metricas.contar('campos_extraidos', campo=campo, resultado='ausente')
+            logger.debug("Regex: %s não encontrado.", campo)
+        else:
+            # Confiança abaixo de 100% = texto corrigido ou variação de OCR
+            metricas.contar('campos_extraidos', campo=campo,
+                            resultado='encontrado' if detalhe['confianca'] >= 1 else 'encontrado_com_correcao')
+            logger.debug("Regex: %s=%s (regra %s, confiança %.0f%%)", campo, str(detalhe['valor'])[:50],
+                         detalhe['regra'], detalhe['confianca'] * 100)
+
+    dados_do_projeto = dict(resultado.dados)
+    dados_do_projeto["DETALHES_EXTRACAO"] = resultado.detalhes
+    return dados_do_projeto
+
+def teste_de_campos_completos():
+    """'parar_quando' do streaming: True quando todos os CAMPOS_OBRIGATORIOS já apareceram."""
+    varredura = extrator.VarreduraIncremental()
+
+    def campos_completos(texto_pagina):
+        with metricas.medir('extracao.teste_campos'):
+            varredura.acrescentar(texto_pagina)
+            return varredura.completo(CAMPOS_OBRIGATORIOS)
+    return campos_completos
+
+def buscar_cache_extracao(db, sha256):
+    with metricas.medir('db.ler_cache_extracao'):
+        return db.execute('SELECT dados FROM cache_extracao WHERE sha256 = ? AND versao_extrator = ?',
+                          (sha256, versao_extrator())).fetchone()
+
+def gravar_cache_extracao(db, sha256, dados, texto_limpo):
+    # Entradas de versões antigas do extrator nunca mais serão usadas
+    versao = versao_extrator()
+    with metricas.medir('db.gravar_cache_extracao'):
+        db.execute('DELETE FROM cache_extracao WHERE versao_extrator != ?', (versao,))
+        db.execute('INSERT OR REPLACE INTO cache_extracao (sha256, versao_extrator, dados, texto, criado_em) '
+                   'VALUES (?, ?, ?, ?, ?)',
+                   (sha256, versao, json.dumps(dados), texto_limpo,
+                    datetime.now().isoformat(timespec='seconds')))
+        db.commit()
 
-        dados_do_projeto = {}
+def extrair_e_gravar(pdf_path, sha256, ao_progredir=None):
+    """Lê o PDF, extrai os campos e grava o resultado no cache de extração."""
+    max_paginas = app.config['EXTRACAO_PAGINAS_STREAMING']
+    texto_limpo, trechos = extrair_texto_pdf(
+        pdf_path, ao_progredir,
+        parar_quando=teste_de_campos_completos() if max_paginas > 0 else None,
+        max_paginas=max_paginas,
+        fallback_completo=app.config['EXTRACAO_FALLBACK_COMPLETO'])
+    dados_do_projeto = extrair_campos(texto_limpo)
+    anotar_fontes(dados_do_projeto["DETALHES_EXTRACAO"], trechos)
+
+    if app.config['EXTRACAO_DEBUG']:
+        logger.info("Texto limpo para análise regex (%s):\n%s", sha256[:12], texto_limpo,
+                    extra={'sha256': sha256})
+        logger.info("Dados extraídos (%s): %s", sha256[:12], dados_do_projeto, extra={'sha256': sha256})
+
+    gravar_cache_extracao(get_db(), sha256, dados_do_projeto, texto_limpo)
+    return dados_do_projeto
+
+def processar_pdf(pdf_path, ao_progredir=None, sha256=None):
+    """
+    Extrai os dados do projeto de um PDF.
+    O resultado fica em cache pelo sha256 do arquivo (e pela versão do
+    extrator): reenviar o mesmo PDF não abre o PyMuPDF de novo.
+    Com EXTRACAO_ISOLADA=1 a leitura roda num processo filho com limites de
+    recursos. Um PDF acima dos limites levanta PDFGrandeDemais; qualquer outra
+    falha devolve {}.
+    """
+    try:
+        if sha256 is None:
+            sha256 = hash_arquivo(pdf_path)
 
-        # --- Regex Refinadas (v5) - CORRIGIDAS ---
-        
-        # Padrão ÚNICO para TIPO e NÚMERO.
-        # Procura "PROJETO DE LEI..." e DEPOIS "N... 45"
-        padrao_tipo_e_numero = r"(PROJETO DE LEI (ORDIN[ÁA]RIA|COMPLEMENTAR)|PROJETO DE RESOLUÇÃO|PROJETO DE DECRETO LEGISLATIVO|PROPOSTA DE EMENDA [ÁA] LEI ORG[ÂA]NICA MUNICIPAL)\s*(?:N[º'q9]|n[oº9]|ne)\s*(\d+)"
-        
-        padrao_data = r"(\d{1,2}\s+de\s+\w+\s+(?:de|oe)\s+(\d{4}))"
-        padrao_ementa = r"\"\s*(Abre.*?Anual.*?)\s*\""
+        db = get_db()
+        if (em_cache := buscar_cache_extracao(db, sha256)):
+            metricas.contar('cache', cache='extracao', resultado='hit')
+            logger.debug("Cache: extração reaproveitada para %s...", sha256[:12])
+            if ao_progredir:
+                ao_progredir(1, 1)
+            return json.loads(em_cache['dados'])
+        metricas.contar('cache', cache='extracao', resultado='miss')
+
+        with metricas.medir('extracao.total'):
+            if app.config['EXTRACAO_ISOLADA']:
+                return extrair_em_processo_isolado(pdf_path, sha256, ao_progredir)
+            return extrair_e_gravar(pdf_path, sha256, ao_progredir)
+
+    except PDFGrandeDemais as e:
+        metricas.contar('extracao_recusada', motivo=e.motivo)
+        logger.warning("PDF recusado (%s): %s", os.path.basename(pdf_path), e, extra={'sha256': sha256})
+        raise
 
-        print("Iniciando busca por Regex...")
+    except Exception as e:
+        metricas.contar('erros', etapa='extracao')
+        logger.exception("Erro ao processar PDF: %s", e)
+        return {}
 
-        # Variáveis para combinar o número
-        match_numero_val = None
-        match_ano_val = None
+# --- EXTRAÇÃO ISOLADA ---
+# Cada PDF é lido num processo filho (fork), que morre ao terminar: a memória
+# de um PDF enorme volta inteira para o sistema e o worker não cresce. O filho
+# tem limite de tempo de CPU (RLIMIT_CPU) e de espaço de endereçamento
+# (RLIMIT_AS, como rede de segurança); a memória residente própria do filho é
+# vigiada pelo pai, que o mata ao passar de EXTRACAO_MAX_MEMORIA_MB. O filho devolve pelo
+# pipe o progresso, o resultado e as suas métricas.
 
-        if (match := re.search(padrao_tipo_e_numero, texto_limpo, re.IGNORECASE)):
-            dados_do_projeto["TIPO_PROJETO"] = match.group(1).upper().strip()
-            match_numero_val = match.group(3) # Grupo 3 é o (\d+)
-            print(f"SUCESSO (Regex): TIPO_PROJETO={dados_do_projeto['TIPO_PROJETO']}")
-            print(f"SUCESSO (Regex): NÚMERO={match_numero_val}")
-        else:
-            print("FALHA (Regex): Padrão combinado TIPO/NÚMERO não encontrado.")
-            
-        if (match_data := re.search(padrao_data, texto_limpo, re.IGNORECASE)):
-            dados_do_projeto["DATA_PROJETO"] = match_data.group(1).strip()
-            match_ano_val = match_data.group(2) # Ex: "2025"
-            print(f"SUCESSO (Regex): DATA_PROJETO={dados_do_projeto['DATA_PROJETO']}")
-            print(f"SUCESSO (Regex): ANO={match_ano_val}")
-        else:
-            print("FALHA (Regex): DATA_PROJETO (ex: ...OE 2025) não encontrada.")
+# Intervalo (s) entre as leituras da memória residente do processo filho
+INTERVALO_VIGIA_EXTRACAO = 0.1
 
-        # Combina número e ano no formato que o sistema espera
-        if match_numero_val and match_ano_val:
-            dados_do_projeto["NUMERO_PROJETO"] = f"{match_numero_val.zfill(3)}/{match_ano_val}" # Formata para "045/2025"
-            print(f"SUCESSO (Combinado): NUMERO_PROJETO={dados_do_projeto['NUMERO_PROJETO']}")
-        else:
-            print("FALHA (Combinado): Não foi possível criar o NUMERO_PROJETO.")
+def memoria_privada(pid):
+    """
+    Memória residente (bytes) do processo e dos seus descendentes (o pool do
+    OCR), sem as páginas que ainda dividem com o worker depois do fork; 0 se
+    /proc não estiver disponível.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            total = sum(int(linha.split()[1]) * 1024 for linha in f if linha.startswith('Private_'))
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            filhos = [int(filho) for filho in f.read().split()]
+    except (OSError, ValueError, IndexError):
+        return 0
+    return total + sum(memoria_privada(filho) for filho in filhos)
+
+def memoria_virtual():
+    """Espaço de endereçamento (bytes) do processo atual; 0 se não der para ler."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def aplicar_limites_extracao():
+    """Limites do processo filho da extração. O de memória é folgado: quem o aplica de fato é o pai."""
+    cpu = app.config['EXTRACAO_MAX_CPU_S']
+    if cpu > 0:
+        _, maximo = resource.getrlimit(resource.RLIMIT_CPU)
+        if maximo == resource.RLIM_INFINITY or maximo > cpu:
+            # Passando do limite 'soft' o processo recebe SIGXCPU e termina
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 5 if maximo == resource.RLIM_INFINITY
+                                                     else min(cpu + 5, maximo)))
+    memoria = app.config['EXTRACAO_MAX_MEMORIA_MB'] * 1024 * 1024
+    atual = memoria_virtual()
+    if memoria > 0 and atual:
+        # O filho herda o espaço de endereçamento do worker: o limite é o que já existe + folga
+        _, maximo = resource.getrlimit(resource.RLIMIT_AS)
+        limite = atual + 2 * memoria
+        if maximo == resource.RLIM_INFINITY or maximo > limite:
+            resource.setrlimit(resource.RLIMIT_AS, (limite, maximo))
+
+def _processo_extracao(pdf_path, sha256, enviar, com_progresso):
+    """Corpo do processo filho: extrai, grava o cache e manda ('ok' | 'grande' | 'erro', ...) pelo pipe."""
+    try:
+        # Grupo de processos próprio: se o pai matar a extração, o pool do OCR
+        # (criado aqui, depois dos limites, e por isso também limitado) vai junto
+        os.setpgrp()
+        aplicar_limites_extracao()
+        ao_progredir = (lambda feitos, total: enviar.send(('progresso', feitos, total))) if com_progresso else None
+        with app.app_context():
+            dados = extrair_e_gravar(pdf_path, sha256, ao_progredir)
+        enviar.send(('ok', dados, metricas.instantaneo()))
+    except PDFGrandeDemais as e:
+        enviar.send(('grande', str(e), e.motivo, metricas.instantaneo()))
+    except MemoryError:
+        enviar.send(('grande', 'O PDF precisa de mais memória do que o permitido para a extração.', 'memoria', None))
+    except Exception as e:
+        enviar.send(('erro', f"{type(e).__name__}: {e}", metricas.instantaneo()))
+    finally:
+        enviar.close()
+        if _pool_ocr is not None:
+            _pool_ocr.shutdown(cancel_futures=True)
 
-        if (match := re.search(padrao_ementa, texto_limpo, re.IGNORECASE | re.DOTALL)):
-            ementa_limpa = match.group(1).strip().replace("Í", "i").replace("çá", "çã").replace("ôe", "õe")
-            dados_do_projeto["EMENTA"] = f'"{ementa_limpa}"'
-            print(f"SUCESSO (Regex): EMENTA={dados_do_projeto['EMENTA'][:50]}...")
+def extrair_em_processo_isolado(pdf_path, sha256, ao_progredir=None):
+    """
+    Roda 'extrair_e_gravar' num processo filho e devolve os dados extraídos.
+    Levanta PDFGrandeDemais se o filho passar de um limite (memória, CPU,
+    páginas) ou não terminar a tempo (4x o limite de CPU, contando esperas).
+    """
+    contexto = multiprocessing.get_context('fork')
+    receber, enviar = contexto.Pipe(duplex=False)
+    # Não é 'daemon' para poder criar o pool do OCR; quem garante o fim do
+    # filho (e do grupo dele) é o 'finally' abaixo.
+    processo = contexto.Process(target=_processo_extracao, name='extracao',
+                                args=(pdf_path, sha256, enviar, ao_progredir is not None))
+    processo.start()
+    enviar.close()
+
+    max_memoria = app.config['EXTRACAO_MAX_MEMORIA_MB'] * 1024 * 1024
+    max_cpu = app.config['EXTRACAO_MAX_CPU_S']
+    prazo = time.monotonic() + 4 * max_cpu if max_cpu > 0 else None
+    pico = 0
+    mensagem = None
+    try:
+        while mensagem is None:
+            if receber.poll(INTERVALO_VIGIA_EXTRACAO):
+                try:
+                    recebida = receber.recv()
+                except EOFError:
+                    break  # o filho morreu sem responder
+                if recebida[0] == 'progresso':
+                    ao_progredir(*recebida[1:])
+                else:
+                    mensagem = recebida
+                continue
+            rss = memoria_privada(processo.pid)
+            pico = max(pico, rss)
+            if max_memoria > 0 and rss > max_memoria:
+                raise PDFGrandeDemais(f"A extração passou do limite de {max_memoria // (1024 * 1024)} MB de memória.",
+                                      'memoria')
+            if prazo is not None and time.monotonic() > prazo:
+                raise PDFGrandeDemais("A extração passou do tempo limite.", 'tempo')
+    finally:
+        try:
+            # O grupo inteiro: o filho e o pool do OCR que ele tenha criado
+            os.killpg(processo.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if processo.is_alive():
+            processo.kill()  # ainda não tinha criado o grupo
+        processo.join()
+        receber.close()
+        logger.debug("Extração isolada de %s: pico de %.0f MB próprios.", os.path.basename(pdf_path),
+                     pico / (1024 * 1024), extra={'sha256': sha256})
+
+    if mensagem is None:
+        if processo.exitcode == -signal.SIGXCPU:
+            raise PDFGrandeDemais("A extração passou do limite de tempo de CPU.", 'cpu')
+        if processo.exitcode == -signal.SIGKILL:
+            # Fora o pai, só o sistema mata o filho assim (falta de memória)
+            raise PDFGrandeDemais("A extração foi encerrada pelo sistema por falta de memória.", 'memoria')
+        raise RuntimeError(f"O processo de extração terminou sem resultado (código {processo.exitcode}).")
+    tipo, *valores = mensagem
+    if valores[-1]:
+        metricas.mesclar(valores[-1])
+    if tipo == 'ok':
+        return valores[0]
+    if tipo == 'grande':
+        raise PDFGrandeDemais(valores[0], valores[1])
+    raise RuntimeError(valores[0])
+
+# --- GERAÇÃO EM PARALELO ---
+_pool_geracao = None
+
+def get_pool_geracao():
+    """Pool (threads ou processos) compartilhado para renderizar e salvar os pareceres."""
+    global _pool_geracao
+    if _pool_geracao is None:
+        workers = app.config['GERACAO_WORKERS']
+        if app.config['GERACAO_POOL'] == 'process':
+            _pool_geracao = ProcessPoolExecutor(max_workers=workers)
         else:
-            print("FALHA (Regex): EMENTA (ex: 'Abre...Anual') não encontrada.")
+            _pool_geracao = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gerar-docx')
+    return _pool_geracao
 
-        print("--- Dados Extraídos ---")
-        print(dados_do_projeto)
-        print("-----------------------")
-        
-        return dados_do_projeto
+def _reiniciar_apos_fork():
+    # Um processo filho (worker, lote) herda o objeto do pool, mas não as suas
+    # threads/processos: descarta e deixa o filho criar o próprio pool.
+    global _pool_geracao, _pool_ocr
+    _pool_geracao = None
+    _pool_ocr = None
+    cache_templates.reiniciar_lock()
+    metricas.reiniciar_apos_fork()
+
+os.register_at_fork(after_in_child=_reiniciar_apos_fork)
 
+def renderizar_e_salvar(sigla, template_path, contexto, caminho_saida, caminho_pdf=None):
+    """
+    Preenche o template da comissão e salva o .docx (e, se pedido, o PDF do
+    mesmo documento). Roda dentro do pool. Uma falha só no PDF não perde o
+    .docx: devolve (mensagem de erro do PDF ou None, tempos). Os tempos de
+    cada etapa voltam para quem chamou porque, com GERACAO_POOL=process, as
+    métricas registradas aqui ficariam no processo filho.
+    """
+    tempos = []
+    with metricas.medir('geracao.template', coletor=tempos):
+        doc, compilado = cache_templates.obter(sigla, template_path)
+    with metricas.medir('geracao.substituicao', coletor=tempos):
+        compilado.render(doc, contexto)
+    with metricas.medir('geracao.salvar_docx', coletor=tempos):
+        doc.save(caminho_saida)
+    if caminho_pdf:
+        try:
+            with metricas.medir('geracao.salvar_pdf', coletor=tempos):
+                salvar_pdf(doc, caminho_pdf, titulo=os.path.splitext(os.path.basename(caminho_pdf))[0],
+                           autor=contexto.get("{{NOME_DA_COMISSAO}}"))
+        except Exception as e:
+            return f"Falha ao gerar o PDF: {e}", tempos
+    return None, tempos
+
+def converter_docx_em_pdf(caminho_docx, caminho_pdf):
+    """Converte um parecer .docx já gerado (histórico) em PDF. Roda dentro do pool."""
+    salvar_pdf(docx.Document(caminho_docx), caminho_pdf,
+               titulo=os.path.splitext(os.path.basename(caminho_pdf))[0])
+    return caminho_pdf
+
+def nome_pdf_do_parecer(nome_docx):
+    return os.path.splitext(nome_docx)[0] + '.pdf'
+
+def salvar_so_pdf(caminho_docx, caminho_pdf):
+    """Gera só o PDF de um .docx que já está atualizado. Roda dentro do pool; devolve (erro, tempos)."""
+    tempos = []
+    try:
+        with metricas.medir('geracao.salvar_pdf', coletor=tempos):
+            converter_docx_em_pdf(caminho_docx, caminho_pdf)
     except Exception as e:
-        print(f"Erro ao processar PDF: {e}")
-        return {}
+        return f"Falha ao gerar o PDF: {e}", tempos
+    return None, tempos
+
+def contexto_relevante(compilado, contexto):
+    """
+    Só os valores que aparecem no documento: os placeholders do template e o
+    nome da comissão (autor do PDF). Mudar um campo que o template não usa
+    não muda o parecer.
+    """
+    chaves = set(compilado.placeholders) | {"{{NOME_DA_COMISSAO}}"}
+    return {chave: contexto.get(chave) for chave in sorted(chaves)}
 
-def gerar_docx_final(form_data, pdf_filename):
+def chave_de_render(template_path, relevante):
+    """Hash da versão do template + contexto relevante: mesmo hash, mesmo documento."""
+    conteudo = json.dumps({'template': cache_templates.versao(template_path), 'contexto': relevante},
+                          sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+def buscar_parecer_anterior(db, nome_saida):
+    """
+    Geração MAIS RECENTE com esse nome de arquivo, ou None. É a linha que
+    descreve o arquivo em disco (um contexto diferente com o mesmo nome
+    sobrescreve o arquivo).
+    """
+    return db.execute('SELECT id, arquivo_pdf, chave_render, contexto FROM pareceres '
+                      'WHERE docx_name = ? ORDER BY id DESC LIMIT 1', (nome_saida,)).fetchone()
+
+def campos_alterados(anterior, relevante):
+    """Placeholders cujo valor mudou desde a geração anterior (None se ela não guardou o contexto)."""
+    if anterior is None or not anterior['contexto']:
+        return None
+    contexto_anterior = json.loads(anterior['contexto'])
+    return [chave for chave, valor in relevante.items() if contexto_anterior.get(chave) != valor]
+
+def acao_de_render(anterior, nome_saida, chave, com_pdf):
+    """
+    O que falta para o parecer ficar em dia com a geração anterior:
+    'reaproveitar' (nada), 'pdf' (o .docx está certo, falta só o PDF) ou
+    'renderizar'. Apagar o item do histórico ou os arquivos força a renderização.
+    """
+    pasta = app.config['GENERATED_FOLDER']
+    if anterior is None or anterior['chave_render'] != chave or not os.path.isfile(os.path.join(pasta, nome_saida)):
+        return 'renderizar'
+    if com_pdf and not (anterior['arquivo_pdf'] and os.path.isfile(os.path.join(pasta, anterior['arquivo_pdf']))):
+        return 'pdf'
+    return 'reaproveitar'
+
+def gerar_docx_final(form_data, pdf_filename, ao_progredir=None):
+    """
+    Gera os pareceres das comissões selecionadas.
+
+    Os contextos são montados aqui (consultas ao banco), a renderização e o
+    'doc.save' de cada comissão rodam em paralelo no pool, e o histórico é
+    gravado numa única transação no final.
+    Com 'gerar_pdf' no formulário (ou GERAR_PDF=1), o PDF de cada parecer é
+    gerado na mesma tarefa do pool, logo depois do .docx.
+    A geração é incremental: cada linha do histórico guarda o contexto
+    resolvido, e só são renderizadas as comissões em que algum valor usado
+    pelo template mudou (ex: corrigir o relator da CFO não refaz as outras).
+    As demais reaproveitam o arquivo, e a linha do histórico de quem mudou é
+    atualizada no lugar, em vez de ganhar uma nova.
+    Retorna (arquivos_gerados, falhas), onde 'falhas' é uma lista de (sigla, mensagem).
+    'ao_progredir(feitos, total)' é chamado a cada comissão concluída.
+    """
     arquivos_gerados = []
+    falhas = []
     db = get_db()
     comissoes_selecionadas = form_data.getlist('comissao_selecionada')
+    gerar_pdf = app.config['GERAR_PDF'] or 'gerar_pdf' in form_data
 
     ### --- INÍCIO DA LÓGICA DE NOVOS NOMES --- ###
     tipo_projeto = form_data.get("tipo_projeto", "").upper()
@@ -205,84 +1174,1006 @@ def gerar_docx_final(form_data, pdf_filename):
     numero_formatado = f"{numero_sem_zero}_{ano}"
     ### --- FIM DA LÓGICA DE NOVOS NOMES --- ###
 
+    # 1. Monta o contexto de cada comissão (consultas ao banco na thread da requisição)
+    tarefas = []
+    elenco = obter_elenco()
     for sigla in comissoes_selecionadas:
-        template_path = os.path.join(app.config['TEMPLATE_FOLDER'], f"template_{sigla.lower()}.docx")
+        comissao = elenco.por_sigla(sigla)
+        if not comissao:
+            falhas.append((sigla, "Comissão não cadastrada."))
+            continue
 
+        template_path = caminho_template(comissao.sigla, comissao.template)
         if not os.path.exists(template_path): 
-            print(f"AVISO: Template não encontrado para {sigla} em {template_path}. Pulando...")
+            logger.error("Template não encontrado para %s em %s (rode 'flask warmup'). Pulando...",
+                         sigla, template_path)
+            falhas.append((sigla, f"Template não encontrado ({os.path.basename(template_path)})."))
             continue
 
-        doc = docx.Document(template_path)
-        comissao = db.execute('SELECT * FROM comissoes WHERE sigla = ?', (sigla,)).fetchone()
-        membros = db.execute('SELECT * FROM membros WHERE comissao_id = ?', (comissao['id'],)).fetchall()
-
         relator_id = form_data.get(f'relator_{sigla}')
         if not relator_id:
-            print(f"AVISO: Relator não selecionado para {sigla}. Pulando...")
+            logger.warning("Relator não selecionado para %s. Pulando...", sigla)
+            falhas.append((sigla, "Relator não selecionado."))
             continue 
 
-        relator = db.execute('SELECT * FROM membros WHERE id = ?', (relator_id,)).fetchone()
+        relator = elenco.membro(relator_id)
 
         if not relator:
-            print(f"AVISO: Relator ID {relator_id} não encontrado no DB para {sigla}. Pulando...")
+            logger.warning("Relator ID %s não encontrado no DB para %s. Pulando...", relator_id, sigla)
+            falhas.append((sigla, f"Relator ID {relator_id} não encontrado."))
             continue
 
-        signatarios = [m for m in membros if m['id'] != relator['id']]
-        data_parecer = datetime.strptime(form_data.get('data_parecer'), '%Y-%m-%d')
-
-        # (O seu dicionário 'contexto' permanece exatamente o mesmo)
-        contexto = {
-            "{{TIPO_PROJETO}}": form_data.get("tipo_projeto"),
-            "{{NUMERO_PROJETO}}": form_data.get("numero_projeto"),
-            "{{DATA_PROJETO}}": form_data.get("data_projeto", "").upper(),
-            "{{EMENTA}}": form_data.get("ementa"),
-            "{{AUTORIA}}": form_data.get("autoria"),
-            "{{DATA_PROTOCOLO}}": datetime.strptime(form_data.get("data_protocolo"), '%Y-%m-%d').strftime('%d/%m/%Y'),
-            "{{REGIME_URGENCIA}}": ", EM REGIME DE URGÊNCIA" if 'regime_urgencia' in form_data else "",
-            "{{TEXTO_APRESENTACAO}}": f" e apresentada como objeto de deliberação na sessão ordinária do dia {datetime.strptime(form_data.get('data_apresentacao'), '%Y-%m-%d').strftime('%d/%m/%Y')}" if 'incluir_apresentacao' in form_data and form_data.get('data_apresentacao') else ".",
-            "{{NUMERO_PARECER}}": form_data.get(f'num_parecer_{sigla}'),
-            "{{DATA_PARECER_EXTENSO}}": data_parecer.strftime('%d de %B de %Y').lower(),
-            "{{NOME_DA_COMISSAO}}": comissao['nome'].upper(),
-            "{{NOME_RELATOR}}": relator['nome'].upper(),
-            "{{CARGO_RELATOR}}": relator['cargo'],
-            "{{NOME_SIGNATARIO_1}}": signatarios[0]['nome'].upper() if len(signatarios) > 0 else "",
-            "{{CARGO_SIGNATARIO_1}}": signatarios[0]['cargo'] if len(signatarios) > 0 else "",
-            "{{NOME_SIGNATARIO_2}}": signatarios[1]['nome'].upper() if len(signatarios) > 1 else "",
-            "{{CARGO_SIGNATARIO_2}}": signatarios[1]['cargo'] if len(signatarios) > 1 else "",
-        }
-
-        for p in doc.paragraphs:
-            for key, value in contexto.items():
-                replace_text_in_paragraph(p, key, str(value)) 
-
-        for table in doc.tables:
-             for row in table.rows:
-                for cell in row.cells:
-                    for p in cell.paragraphs:
-                        for key, value in contexto.items():
-                            replace_text_in_paragraph(p, key, str(value))
+        signatarios = [m for m in comissao.membros if m.id != relator.id]
+
+        try:
+            data_parecer = datetime.strptime(form_data.get('data_parecer'), '%Y-%m-%d')
+
+            # (O seu dicionário 'contexto' permanece exatamente o mesmo)
+            contexto = {
+                "{{TIPO_PROJETO}}": form_data.get("tipo_projeto"),
+                "{{NUMERO_PROJETO}}": form_data.get("numero_projeto"),
+                "{{DATA_PROJETO}}": form_data.get("data_projeto", "").upper(),
+                "{{EMENTA}}": form_data.get("ementa"),
+                "{{AUTORIA}}": form_data.get("autoria"),
+                "{{DATA_PROTOCOLO}}": datetime.strptime(form_data.get("data_protocolo"), '%Y-%m-%d').strftime('%d/%m/%Y'),
+                "{{REGIME_URGENCIA}}": ", EM REGIME DE URGÊNCIA" if 'regime_urgencia' in form_data else "",
+                "{{TEXTO_APRESENTACAO}}": f" e apresentada como objeto de deliberação na sessão ordinária do dia {datetime.strptime(form_data.get('data_apresentacao'), '%Y-%m-%d').strftime('%d/%m/%Y')}" if 'incluir_apresentacao' in form_data and form_data.get('data_apresentacao') else ".",
+                "{{NUMERO_PARECER}}": form_data.get(f'num_parecer_{sigla}'),
+                "{{DATA_PARECER_EXTENSO}}": data_parecer.strftime('%d de %B de %Y').lower(),
+                "{{NOME_DA_COMISSAO}}": comissao.nome.upper(),
+                "{{NOME_RELATOR}}": relator.nome.upper(),
+                "{{CARGO_RELATOR}}": relator.cargo,
+                "{{NOME_SIGNATARIO_1}}": signatarios[0].nome.upper() if len(signatarios) > 0 else "",
+                "{{CARGO_SIGNATARIO_1}}": signatarios[0].cargo if len(signatarios) > 0 else "",
+                "{{NOME_SIGNATARIO_2}}": signatarios[1].nome.upper() if len(signatarios) > 1 else "",
+                "{{CARGO_SIGNATARIO_2}}": signatarios[1].cargo if len(signatarios) > 1 else "",
+            }
+        except (TypeError, ValueError) as e:
+            falhas.append((sigla, f"Dados do formulário inválidos: {e}"))
+            continue
 
         ### --- ALTERAÇÃO NO NOME DE SAÍDA --- ###
         nome_saida = f"{prefixo} {numero_formatado} {sigla}.docx"
         caminho_saida = os.path.join(app.config['GENERATED_FOLDER'], nome_saida)
-        doc.save(caminho_saida)
+        nome_pdf = nome_pdf_do_parecer(nome_saida) if gerar_pdf else None
+        caminho_pdf = os.path.join(app.config['GENERATED_FOLDER'], nome_pdf) if nome_pdf else None
+        try:
+            relevante = contexto_relevante(cache_templates.compilado(sigla, template_path), contexto)
+        except Exception as e:
+            metricas.contar('erros', etapa='geracao')
+            logger.error("Template de %s não abre: %s", sigla, e, extra={'comissao': sigla})
+            falhas.append((sigla, f"Falha ao gerar o documento: {e}"))
+            continue
+        chave = chave_de_render(template_path, relevante)
+        anterior = buscar_parecer_anterior(db, nome_saida)
+        acao = acao_de_render(anterior, nome_saida, chave, gerar_pdf)
+        if acao == 'reaproveitar':
+            nome_pdf = anterior['arquivo_pdf']
+        elif acao == 'renderizar' and anterior is not None:
+            alterados = campos_alterados(anterior, relevante)
+            if alterados:
+                logger.info("Parecer '%s' renderizado de novo (alterado: %s).", nome_saida, ', '.join(alterados),
+                            extra={'comissao': sigla})
+        tarefas.append((sigla, nome_saida, nome_pdf, template_path, contexto, caminho_saida, caminho_pdf,
+                        chave, anterior, acao))
+
+    # 2. Renderiza e salva em paralelo só o que mudou
+    pool = get_pool_geracao()
+    futuros = []
+    for sigla, nome_saida, nome_pdf, template_path, contexto, caminho_saida, caminho_pdf, chave, anterior, acao in tarefas:
+        if acao == 'renderizar':
+            futuro = pool.submit(renderizar_e_salvar, sigla, template_path, contexto, caminho_saida, caminho_pdf)
+        elif acao == 'pdf':
+            futuro = pool.submit(salvar_so_pdf, caminho_saida, caminho_pdf)
+        else:
+            futuro = None
+        futuros.append((sigla, nome_saida, nome_pdf, contexto, chave, anterior, acao, futuro))
+
+    # 3. Coleta os resultados na ordem em que as comissões foram selecionadas
+    agora = datetime.now()
+    data_geracao = agora.strftime("%d/%m/%Y %H:%M:%S")
+    gerado_em = agora.isoformat(timespec='seconds')
+    linhas_novas = []
+    linhas_atualizadas = []
+    for feitos, (sigla, nome_saida, nome_pdf, contexto, chave, anterior, acao, futuro) in enumerate(futuros, start=1):
+        metricas.contar('cache', cache='render', resultado={'reaproveitar': 'hit', 'pdf': 'parcial'}.get(acao, 'miss'))
+        if futuro is None:
+            if ao_progredir:
+                ao_progredir(feitos, len(futuros))
+            arquivos_gerados.extend(nome for nome in (nome_saida, nome_pdf) if nome)
+            logger.debug("Cache: parecer '%s' reaproveitado (nenhum valor do template mudou).", nome_saida)
+            continue
+        try:
+            erro_pdf, tempos = futuro.result()
+        except Exception as e:
+            metricas.contar('erros', etapa='geracao')
+            logger.error("Falha ao gerar '%s': %s", nome_saida, e, extra={'comissao': sigla})
+            falhas.append((sigla, f"Falha ao gerar o documento: {e}"))
+            continue
+        finally:
+            if ao_progredir:
+                ao_progredir(feitos, len(futuros))
+        metricas.registrar_tempos(tempos)
+        if acao == 'renderizar':
+            metricas.contar('pareceres_gerados', comissao=sigla)
         arquivos_gerados.append(nome_saida)
-        print(f"SUCESSO: Arquivo '{nome_saida}' gerado.")
+        logger.debug("Arquivo '%s' gerado.", nome_saida)
+        if erro_pdf:
+            metricas.contar('erros', etapa='pdf')
+            logger.error("%s ('%s')", erro_pdf, nome_pdf, extra={'comissao': sigla})
+            falhas.append((sigla, erro_pdf))
+            nome_pdf = None
+        elif nome_pdf:
+            arquivos_gerados.append(nome_pdf)
+        if nome_pdf is None and anterior is not None and anterior['arquivo_pdf']:
+            # O PDF da geração anterior não corresponde mais ao .docx
+            try:
+                os.remove(os.path.join(app.config['GENERATED_FOLDER'], anterior['arquivo_pdf']))
+            except FileNotFoundError:
+                pass
+        # A chave descreve o .docx: uma falha só no PDF não a invalida ('pdf' na próxima vez)
+        linha = (pdf_filename, form_data.get('numero_projeto'), data_geracao, gerado_em,
+                 form_data.get('tipo_projeto'), form_data.get('ementa'), sigla, nome_pdf,
+                 form_data.get('pdf_sha256') or None, chave, json.dumps(contexto, ensure_ascii=False))
+        if anterior is None:
+            linhas_novas.append((nome_saida, *linha))
+        else:
+            linhas_atualizadas.append((*linha, anterior['id']))
+
+    # 4. Grava o histórico de uma vez só
+    if linhas_novas or linhas_atualizadas:
+        with metricas.medir('db.gravar_historico'), db:
+            db.executemany(
+                'INSERT INTO pareceres (docx_name, pdf_name, numero_projeto, data_geracao, gerado_em, tipo_projeto, ementa, '
+                'comissao, arquivo_pdf, pdf_sha256, chave_render, contexto) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                linhas_novas)
+            db.executemany(
+                'UPDATE pareceres SET pdf_name = ?, numero_projeto = ?, data_geracao = ?, gerado_em = ?, tipo_projeto = ?, '
+                'ementa = ?, comissao = ?, arquivo_pdf = ?, pdf_sha256 = ?, chave_render = ?, contexto = ? WHERE id = ?',
+                linhas_atualizadas)
+
+    return arquivos_gerados, falhas
+
+# --- AQUECIMENTO (primeira geração de cada worker) ---
+# Relatório do último aquecimento deste processo (ver /status/templates)
+ultimo_aquecimento = None
+
+def nome_template(sigla, template=None):
+    """Arquivo do template da comissão: o cadastrado, ou template_<sigla>.docx."""
+    return template or f"template_{sigla.lower()}.docx"
+
+def caminho_template(sigla, template=None):
+    return os.path.join(app.config['TEMPLATE_FOLDER'], nome_template(sigla, template))
+
+def aquecer():
+    """
+    Deixa o processo pronto para a primeira geração: formata uma data por
+    extenso (carrega o locale), monta o snapshot do elenco e abre, compila e
+    calcula a versão do template de cada comissão cadastrada.
+    Precisa de um contexto da aplicação. Devolve o relatório, com os templates
+    que faltam, os que não abrem e os que não pertencem a nenhuma comissão.
+    """
+    global ultimo_aquecimento
+    inicio = time.perf_counter()
+    relatorio = {'templates': [], 'faltando': [], 'com_erro': [], 'sem_placeholders': [], 'sem_comissao': []}
+    with metricas.medir('aquecimento'):
+        datetime.now().strftime('%d de %B de %Y')
+        elenco = obter_elenco()
+        for comissao in elenco.comissoes:
+            caminho = caminho_template(comissao.sigla, comissao.template)
+            item = {'sigla': comissao.sigla, 'arquivo': os.path.basename(caminho)}
+            if not os.path.isfile(caminho):
+                relatorio['faltando'].append(item)
+                continue
+            try:
+                _, compilado = cache_templates.obter(comissao.sigla, caminho)
+                cache_templates.versao(caminho)
+            except Exception as e:
+                relatorio['com_erro'].append(dict(item, erro=str(e)))
+                continue
+            relatorio['templates'].append(dict(item, placeholders=len(compilado.placeholders)))
+            if not compilado.placeholders:
+                relatorio['sem_placeholders'].append(item)
+
+        usados = {nome_template(c.sigla, c.template).lower() for c in elenco.comissoes}
+        for nome in sorted(os.listdir(app.config['TEMPLATE_FOLDER'])):
+            if nome.lower().endswith('.docx') and nome.lower() not in usados:
+                relatorio['sem_comissao'].append(nome)
+
+    relatorio['pid'] = os.getpid()
+    relatorio['segundos'] = round(time.perf_counter() - inicio, 3)
+    relatorio['concluido_em'] = datetime.now().isoformat(timespec='seconds')
+    for item in relatorio['faltando']:
+        logger.error("Template não encontrado para a comissão %s (%s).", item['sigla'], item['arquivo'])
+    for item in relatorio['com_erro']:
+        logger.error("Template %s não pôde ser aberto: %s", item['arquivo'], item['erro'])
+    for item in relatorio['sem_placeholders']:
+        logger.warning("Template %s não tem nenhum {{PLACEHOLDER}}.", item['arquivo'])
+    logger.info("Aquecimento: %d template(s) prontos em %.2fs.", len(relatorio['templates']), relatorio['segundos'])
+    ultimo_aquecimento = relatorio
+    return relatorio
+
+def iniciar_aquecimento():
+    """Roda o 'aquecer' numa thread, para o worker já ir aceitando requisições."""
+    def executar():
+        try:
+            with app.app_context():
+                aquecer()
+        except Exception:
+            logger.exception("Falha no aquecimento do worker %d.", os.getpid())
+
+    thread = threading.Thread(target=executar, name='aquecimento', daemon=True)
+    thread.start()
+    return thread
+
+# --- FILA DE TAREFAS (extração e geração em segundo plano) ---
+def enfileirar_tarefa(tipo, entrada):
+    """Grava uma nova tarefa pendente e devolve o seu id."""
+    agora = datetime.now().isoformat(timespec='seconds')
+    db = get_db()
+    cur = db.execute(
+        'INSERT INTO tarefas (tipo, entrada, criado_em, atualizado_em) VALUES (?, ?, ?, ?)',
+        (tipo, json.dumps(entrada), agora, agora))
+    db.commit()
+    return cur.lastrowid
+
+def atualizar_tarefa(db, tarefa_id, **campos):
+    campos['atualizado_em'] = datetime.now().isoformat(timespec='seconds')
+    colunas = ', '.join(f'{c} = ?' for c in campos)
+    db.execute(f'UPDATE tarefas SET {colunas} WHERE id = ?', (*campos.values(), tarefa_id))
+    db.commit()
 
-        db.execute('INSERT INTO pareceres (pdf_name, docx_name, numero_projeto, data_geracao) VALUES (?, ?, ?, ?)',
-                   (pdf_filename, nome_saida, form_data.get('numero_projeto'), datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
+def limite_do_lease():
+    """Tarefas 'executando' com 'atualizado_em' anterior a isto foram abandonadas."""
+    return (datetime.now() - timedelta(seconds=app.config['TAREFAS_LEASE_S'])).isoformat(timespec='seconds')
+
+def recuperar_tarefas_abandonadas(db):
+    """Marca como erro as tarefas 'executando' cujo worker parou de renovar o lease."""
+    cur = db.execute(
+        "UPDATE tarefas SET status = 'erro', mensagem = ?, atualizado_em = ? "
+        "WHERE status = 'executando' AND atualizado_em < ?",
+        ('O worker foi interrompido durante a tarefa. Envie de novo.',
+         datetime.now().isoformat(timespec='seconds'), limite_do_lease()))
+    if cur.rowcount:
+        logger.warning("%d tarefa(s) abandonada(s) marcada(s) como erro", cur.rowcount)
+    return cur.rowcount
+
+def apagar_tarefas_antigas(db):
+    """Apaga as tarefas terminadas há mais de TAREFAS_RETENCAO_DIAS dias."""
+    limite = (datetime.now() - timedelta(days=app.config['TAREFAS_RETENCAO_DIAS'])).isoformat(timespec='seconds')
+    # O .zip de um lote só é acessível pela tarefa: sai junto com ela
+    for linha in db.execute("SELECT resultado FROM tarefas WHERE tipo = 'lote' AND status = 'concluida' "
+                            "AND atualizado_em < ?", (limite,)).fetchall():
+        caminho = os.path.join(app.config['GENERATED_FOLDER'], json.loads(linha['resultado'])['zip'])
+        if os.path.exists(caminho):
+            os.remove(caminho)
+    cur = db.execute("DELETE FROM tarefas WHERE status IN ('concluida', 'erro') AND atualizado_em < ?", (limite,))
+    db.commit()
+    if cur.rowcount:
+        logger.info("%d tarefa(s) antiga(s) apagada(s)", cur.rowcount)
+    return cur.rowcount
+
+@contextmanager
+def manter_tarefa_viva(tarefa_id):
+    """Renova o lease da tarefa numa thread enquanto o bloco executa."""
+    parar = threading.Event()
+
+    def renovar():
+        # Conexão própria: a do worker não pode ser usada em outra thread
+        db = conectar_db()
+        try:
+            while not parar.wait(app.config['TAREFAS_LEASE_S'] / 3):
+                db.execute("UPDATE tarefas SET atualizado_em = ? WHERE id = ? AND status = 'executando'",
+                           (datetime.now().isoformat(timespec='seconds'), tarefa_id))
+                db.commit()
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=renovar, name=f'lease-{tarefa_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        parar.set()
+        thread.join()
+
+def reservar_proxima_tarefa(db):
+    """Marca a tarefa pendente mais antiga como 'executando' e a devolve (ou None)."""
+    # BEGIN IMMEDIATE garante que dois workers não peguem a mesma tarefa
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        recuperar_tarefas_abandonadas(db)
+        tarefa = db.execute(
+            "SELECT * FROM tarefas WHERE status = 'pendente' ORDER BY id LIMIT 1").fetchone()
+        if tarefa:
+            db.execute("UPDATE tarefas SET status = 'executando', atualizado_em = ? WHERE id = ?",
+                       (datetime.now().isoformat(timespec='seconds'), tarefa['id']))
         db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return tarefa
+
+def executar_tarefa(db, tarefa):
+    """Roda uma tarefa reservada e grava o resultado (ou o erro) no banco."""
+    entrada = json.loads(tarefa['entrada'])
+
+    ultimo = {'progresso': 0}
+
+    def ao_progredir(feitos, total):
+        # Só grava quando o percentual muda, para não fazer um commit por página
+        progresso = int(100 * feitos / max(total, 1))
+        if progresso != ultimo['progresso']:
+            ultimo['progresso'] = progresso
+            atualizar_tarefa(db, tarefa['id'], progresso=progresso)
+
+    try:
+        if tarefa['tipo'] == 'extracao':
+            dados = processar_pdf(entrada['pdf_path'], ao_progredir=ao_progredir, sha256=entrada.get('sha256'))
+            resultado = {'dados': dados, 'filename': entrada['filename'], 'sha256': entrada.get('sha256')}
+        elif tarefa['tipo'] == 'geracao':
+            form_data = MultiDict(entrada['form'])
+            arquivos, falhas = gerar_docx_final(form_data, entrada['pdf_filename'], ao_progredir=ao_progredir)
+            resultado = {'arquivos': arquivos, 'falhas': falhas}
+        elif tarefa['tipo'] == 'lote':
+            relatorio = executar_lote(entrada['pdfs'], entrada['ajustes'], ao_progredir=ao_progredir)
+            nome_zip = f"lote_{tarefa['id']}.zip"
+            escrever_zip_lote(relatorio, os.path.join(app.config['GENERATED_FOLDER'], nome_zip))
+            resultado = {'zip': nome_zip, 'projetos': len(relatorio),
+                         'sem_falhas': sum(item['sucesso'] for item in relatorio)}
+        else:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tarefa['tipo']}")
+    except PDFGrandeDemais as e:
+        # Já registrado por processar_pdf; não é uma falha do worker
+        metricas.contar('tarefas', tipo=tarefa['tipo'], resultado='recusada')
+        atualizar_tarefa(db, tarefa['id'], status='erro', mensagem=f'PDF grande demais para processar: {e}')
+        return
+    except Exception as e:
+        metricas.contar('tarefas', tipo=tarefa['tipo'], resultado='erro')
+        logger.exception("Tarefa %s falhou: %s", tarefa['id'], e, extra={'tarefa_id': tarefa['id']})
+        atualizar_tarefa(db, tarefa['id'], status='erro', mensagem=str(e))
+        return
+    metricas.contar('tarefas', tipo=tarefa['tipo'], resultado='concluida')
+    atualizar_tarefa(db, tarefa['id'], status='concluida', progresso=100, resultado=json.dumps(resultado))
+
+def executar_em_thread(tarefa_id):
+    """
+    Sem 'flask worker' (TAREFAS_ASSINCRONAS=0), roda a tarefa numa thread do
+    próprio servidor, para que a requisição volte logo para a página de espera.
+    """
+    def executar():
+        with app.app_context():
+            db = get_db()
+            cur = db.execute(
+                "UPDATE tarefas SET status = 'executando', atualizado_em = ? WHERE id = ? AND status = 'pendente'",
+                (datetime.now().isoformat(timespec='seconds'), tarefa_id))
+            db.commit()
+            if not cur.rowcount:
+                return  # um 'flask worker' já pegou a tarefa
+            tarefa = db.execute('SELECT * FROM tarefas WHERE id = ?', (tarefa_id,)).fetchone()
+            with manter_tarefa_viva(tarefa_id), metricas.medir('tarefa', tipo=tarefa['tipo']):
+                executar_tarefa(db, tarefa)
+
+    thread = threading.Thread(target=executar, name=f'tarefa-{tarefa_id}', daemon=True)
+    thread.start()
+    return thread
+
+def loop_worker(intervalo):
+    """Laço de um processo worker: pega tarefas pendentes até ser interrompido."""
+    with app.app_context():
+        db = get_db()
+        logger.info("Worker %d aguardando tarefas...", os.getpid())
+        proxima_limpeza = 0
+        while True:
+            if time.monotonic() >= proxima_limpeza:
+                apagar_tarefas_antigas(db)
+                proxima_limpeza = time.monotonic() + 3600
+            tarefa = reservar_proxima_tarefa(db)
+            if tarefa is None:
+                time.sleep(intervalo)
+                continue
+            logger.info("Worker %d: executando tarefa %s (%s)", os.getpid(), tarefa['id'], tarefa['tipo'],
+                        extra={'tarefa_id': tarefa['id']})
+            # Contexto novo por tarefa: o 'g' do laço vive o processo inteiro e
+            # guardaria o snapshot do elenco (e outros caches por requisição)
+            # da primeira tarefa para sempre.
+            with app.app_context(), manter_tarefa_viva(tarefa['id']), metricas.medir('tarefa', tipo=tarefa['tipo']):
+                executar_tarefa(get_db(), tarefa)
+
+def responder_tarefa(tarefa_id):
+    """Clientes JSON recebem o id da tarefa; o navegador vai para a página de espera."""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'tarefa_id': tarefa_id,
+                        'status_url': url_for('status_tarefa', tarefa_id=tarefa_id)}), 202
+    return redirect(url_for('aguardar_tarefa', tarefa_id=tarefa_id))
+
+def renderizar_revisao(dados_pdf, filename, sha256=None):
+    elenco = obter_elenco()
+    # Comissões sem template ficam desabilitadas na tela (o arquivo precisa ser corrigido antes)
+    sem_template = {c.sigla for c in elenco.comissoes if not os.path.isfile(caminho_template(c.sigla, c.template))}
+    return render_template('revisar.html', dados=dados_pdf, comissoes=elenco.comissoes, membros=elenco.membros,
+                           filename=filename, sha256=sha256, sem_template=sem_template)
+
+# --- PROCESSAMENTO EM LOTE ---
+# Ajustes por projeto (CSV ou JSON): uma linha por PDF, identificada pela coluna
+# 'arquivo'. A linha com arquivo '*' vale como padrão para todos. As demais
+# colunas têm os mesmos nomes dos campos do formulário de revisão
+# (relator_CJR, num_parecer_CJR, data_parecer, data_protocolo, autoria...), mais
+# 'comissoes' (siglas separadas por vírgula) e 'gerar_pdf'. O relator pode ser
+# o id ou o nome.
+CAMPOS_EXTRAIDOS_LOTE = [
+    ("tipo_projeto", "TIPO_PROJETO"),
+    ("numero_projeto", "NUMERO_PROJETO"),
+    ("data_projeto", "DATA_PROJETO"),
+    ("ementa", "EMENTA"),
+]
+VALORES_VERDADEIROS = ('1', 'sim', 's', 'true', 'x')
+
+def ler_ajustes_lote(conteudo, nome_arquivo):
+    """Lê o CSV/JSON de ajustes. Retorna {nome_do_pdf: {campo: valor}}."""
+    if nome_arquivo.lower().endswith('.json'):
+        bruto = json.loads(conteudo)
+        linhas = [dict(v, arquivo=k) for k, v in bruto.items()] if isinstance(bruto, dict) else bruto
+    else:
+        linhas = list(csv.DictReader(io.StringIO(conteudo)))
+    ajustes = {}
+    for linha in linhas:
+        nome = str(linha.get('arquivo', '')).strip()
+        if nome:
+            ajustes[nome] = {k: str(v).strip() for k, v in linha.items()
+                             if k != 'arquivo' and v not in (None, '')}
+    return ajustes
+
+def montar_formulario_lote(ajustes, elenco):
+    """Monta os itens do formulário de geração (como o de revisar.html) para um projeto."""
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    itens = []
+    siglas = [s.strip().upper() for s in ajustes.get('comissoes', '').replace(';', ',').split(',') if s.strip()]
+    for sigla in siglas or [c.sigla for c in elenco.comissoes]:
+        itens.append(('comissao_selecionada', sigla))
+        comissao = elenco.por_sigla(sigla)
+        membros = comissao.membros if comissao else ()
+        relator = ajustes.get(f'relator_{sigla}', '')
+        if relator and not relator.isdigit():
+            por_nome = [m for m in membros if m.nome.casefold() == relator.casefold()]
+            relator = str(por_nome[0].id) if por_nome else ''
+        elif not relator and membros:
+            # Mesmo padrão da tela de revisão: o primeiro membro da lista
+            relator = str(membros[0].id)
+        itens.append((f'relator_{sigla}', relator))
+        itens.append((f'num_parecer_{sigla}', ajustes.get(f'num_parecer_{sigla}', '')))
+
+    itens.append(('autoria', ajustes.get('autoria', 'Chefe do Executivo')))
+    itens.append(('data_protocolo', ajustes.get('data_protocolo', hoje)))
+    itens.append(('data_parecer', ajustes.get('data_parecer', hoje)))
+    if ajustes.get('data_apresentacao'):
+        itens.append(('data_apresentacao', ajustes['data_apresentacao']))
+        itens.append(('incluir_apresentacao', 'true'))
+    if ajustes.get('regime_urgencia', '').lower() in VALORES_VERDADEIROS:
+        itens.append(('regime_urgencia', 'true'))
+    if ajustes.get('gerar_pdf', '').lower() in VALORES_VERDADEIROS:
+        itens.append(('gerar_pdf', 'true'))
+    for campo, _ in CAMPOS_EXTRAIDOS_LOTE:
+        if ajustes.get(campo):
+            itens.append((campo, ajustes[campo]))
+    return itens
+
+def processar_item_lote(pdf_path, pdf_name, sha256, itens_formulario):
+    """Extrai e gera os pareceres de um projeto do lote. Roda num processo do pool."""
+    with app.app_context():
+        dados = processar_pdf(pdf_path, sha256=sha256)
+        form_data = MultiDict(itens_formulario)
+        form_data['pdf_sha256'] = sha256
+        # O que não veio nos ajustes é preenchido com os dados extraídos do PDF
+        for campo, chave in CAMPOS_EXTRAIDOS_LOTE:
+            if not form_data.get(campo):
+                form_data[campo] = dados.get(chave, '')
+        faltando = [chave for campo, chave in CAMPOS_EXTRAIDOS_LOTE if not form_data.get(campo)]
+        arquivos, falhas = gerar_docx_final(form_data, pdf_name)
+    return {
+        'arquivo': pdf_name,
+        'campos_faltando': faltando,
+        'gerados': arquivos,
+        'falhas': [{'comissao': sigla, 'mensagem': mensagem} for sigla, mensagem in falhas],
+    }
+
+def _iniciar_processo_lote():
+    # Dentro do pool de processos, as comissões de cada projeto são geradas em
+    # threads e o OCR roda no próprio processo (o lote já ocupa os núcleos)
+    app.config['GERACAO_POOL'] = 'thread'
+    app.config['OCR_WORKERS'] = 1
+
+def executar_lote(pdfs, ajustes, workers=None, ao_progredir=None):
+    """
+    Processa uma lista de (caminho, nome, sha256) de PDFs num pool de processos.
+    Retorna o relatório (uma entrada por projeto, na ordem recebida).
+    """
+    elenco = obter_elenco()
+    padrao = ajustes.get('*', {})
+    relatorio = []
+    # O lote roda numa thread (lease da tarefa, servidor web) ao lado de outras
+    # que usam o SQLite; um fork nessa hora pode herdar um lock travado. O
+    # forkserver cria os processos a partir de um processo limpo, sem threads.
+    contexto = multiprocessing.get_context('forkserver')
+    contexto.set_forkserver_preload([__name__])
+    with ProcessPoolExecutor(max_workers=workers or app.config['LOTE_WORKERS'], mp_context=contexto,
+                             initializer=_iniciar_processo_lote) as pool:
+        futuros = []
+        for pdf_path, pdf_name, sha256 in pdfs:
+            # Ajustes pelo caminho dentro do .zip ou, se não houver, pelo nome do PDF
+            especificos = ajustes.get(pdf_name, ajustes.get(os.path.basename(pdf_name), {}))
+            ajustes_pdf = {**padrao, **especificos}
+            itens = montar_formulario_lote(ajustes_pdf, elenco)
+            futuros.append((pdf_name, pool.submit(processar_item_lote, pdf_path, pdf_name, sha256, itens)))
+        for pdf_name, futuro in futuros:
+            try:
+                item = futuro.result()
+            except Exception as e:
+                metricas.contar('erros', etapa='lote')
+                logger.error("Falha no lote para '%s': %s", pdf_name, e)
+                item = {'arquivo': pdf_name, 'campos_faltando': [], 'gerados': [],
+                        'falhas': [{'comissao': None, 'mensagem': str(e)}]}
+            item['sucesso'] = bool(item['gerados']) and not item['falhas']
+            relatorio.append(item)
+            if ao_progredir:
+                ao_progredir(len(relatorio), len(futuros))
+    return relatorio
+
+def extrair_pdfs_do_zip(arquivo_zip, limite=None):
+    """
+    Guarda no armazém os PDFs de um .zip e devolve [(caminho, nome, sha256)].
+    O nome é o caminho dentro do .zip ('a/projeto.pdf'), para que PDFs de
+    mesmo nome em pastas diferentes não se confundam no relatório e nos
+    ajustes. Ele só identifica o item: nada é gravado com esse caminho. Cada
+    PDF descompactado é limitado a 'limite' bytes, o que barra "zip bombs".
+    """
+    pdfs = []
+    with zipfile.ZipFile(arquivo_zip) as zf:
+        for info in zf.infolist():
+            nome = '/'.join(parte for parte in info.filename.replace('\\', '/').split('/')
+                            if parte not in ('', '.', '..'))
+            if info.is_dir() or not nome.lower().endswith('.pdf') or nome.startswith('__MACOSX'):
+                continue
+            with zf.open(info) as origem:
+                sha256, caminho = armazem_pdfs.guardar_stream(origem, limite=limite)
+            pdfs.append((caminho, nome, sha256))
+    return pdfs
+
+def listar_pdfs_da_pasta(pasta):
+    """Guarda no armazém (por cópia) os PDFs de uma pasta."""
+    pdfs = []
+    for nome in sorted(os.listdir(pasta)):
+        if nome.lower().endswith('.pdf'):
+            sha256, caminho = armazem_pdfs.guardar_arquivo(os.path.join(pasta, nome))
+            pdfs.append((caminho, nome, sha256))
+    return pdfs
+
+def escrever_zip_lote(relatorio, saida):
+    """Grava em 'saida' (arquivo ou caminho) um .zip com os pareceres e o relatório do lote."""
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zf:
+        incluidos = set()
+        for item in relatorio:
+            for nome in item['gerados']:
+                if nome not in incluidos:
+                    zf.write(os.path.join(app.config['GENERATED_FOLDER'], nome), nome)
+                    incluidos.add(nome)
+        zf.writestr('relatorio.json', json.dumps(relatorio, ensure_ascii=False, indent=2))
+
+        csv_relatorio = io.StringIO()
+        escritor = csv.writer(csv_relatorio)
+        escritor.writerow(['arquivo', 'sucesso', 'gerados', 'falhas', 'campos_faltando'])
+        for item in relatorio:
+            escritor.writerow([
+                item['arquivo'], 'sim' if item['sucesso'] else 'não',
+                '; '.join(item['gerados']),
+                '; '.join(f"{f['comissao'] or '-'}: {f['mensagem']}" for f in item['falhas']),
+                '; '.join(item['campos_faltando']),
+            ])
+        zf.writestr('relatorio.csv', csv_relatorio.getvalue())
+
+# --- IMPORTAÇÃO E EXPORTAÇÃO DO ELENCO ---
+# O elenco (CSV ou JSON) lista, por comissão, o nome, o template e os membros.
+# CSV: uma linha por membro, com as colunas abaixo; uma comissão sem membros
+# tem uma linha com 'nome' vazio. JSON: {"comissoes": [{"sigla", "nome",
+# "template", "membros": [{"nome", "cargo"}]}]} ou uma lista de linhas como no CSV.
+# Cada comissão do arquivo passa a ter EXATAMENTE os membros listados (os
+# membros que continuam mantêm o id); as comissões fora do arquivo só são
+# removidas com 'remover_ausentes'.
+COLUNAS_ELENCO = ('sigla', 'comissao', 'template', 'nome', 'cargo')
+CARGO_PADRAO = 'Membro'
+
+def ler_elenco(conteudo, nome_arquivo):
+    """
+    Lê o arquivo do elenco. Retorna {sigla: {'nome', 'template', 'membros': [(nome, cargo)]}},
+    na ordem do arquivo. Levanta ValueError se o arquivo for inconsistente.
+    """
+    if nome_arquivo.lower().endswith('.json'):
+        bruto = json.loads(conteudo)
+        if isinstance(bruto, dict):
+            comissoes = bruto.get('comissoes', [])
+            if not isinstance(comissoes, list):
+                raise ValueError("'comissoes' deve ser uma lista de objetos.")
+            linhas = []
+            for numero, comissao in enumerate(comissoes, start=1):
+                if not isinstance(comissao, dict):
+                    raise ValueError(f"Comissão {numero}: deve ser um objeto com 'sigla', 'nome' e 'membros'.")
+                base = {'sigla': comissao.get('sigla'), 'comissao': comissao.get('nome'),
+                        'template': comissao.get('template')}
+                membros = comissao.get('membros') or []
+                if not isinstance(membros, list) or not all(isinstance(m, dict) for m in membros):
+                    raise ValueError(f"Comissão {numero} ({base['sigla'] or 'sem sigla'}): "
+                                     "'membros' deve ser uma lista de objetos com 'nome' e 'cargo'.")
+                linhas.append(base)
+                linhas.extend(dict(base, nome=m.get('nome'), cargo=m.get('cargo')) for m in membros)
+        elif isinstance(bruto, list):
+            linhas = bruto
+            for numero, linha in enumerate(linhas, start=1):
+                if not isinstance(linha, dict):
+                    raise ValueError(f"Linha {numero}: deve ser um objeto com as colunas {', '.join(COLUNAS_ELENCO)}.")
+        else:
+            raise ValueError("O JSON deve ser um objeto com 'comissoes' ou uma lista de linhas.")
+    else:
+        linhas = list(csv.DictReader(io.StringIO(conteudo)))
+    return montar_elenco(linhas)
 
-    db.close() 
-    return arquivos_gerados
+def ler_elenco_confirmado(texto):
+    """
+    Relê o elenco que volta da tela de confirmação (o JSON devolvido por
+    'ler_elenco') passando pelas mesmas validações: o formulário pode ter
+    sido alterado no navegador.
+    """
+    bruto = json.loads(texto)
+    if not isinstance(bruto, dict):
+        raise ValueError('Elenco confirmado inválido.')
+    linhas = []
+    for sigla, dados in bruto.items():
+        if not isinstance(dados, dict) or not isinstance(dados.get('membros', []), list):
+            raise ValueError(f'{sigla}: elenco confirmado inválido.')
+        base = {'sigla': sigla, 'comissao': dados.get('nome'), 'template': dados.get('template')}
+        linhas.append(base)
+        for membro in dados.get('membros', []):
+            if not isinstance(membro, list) or len(membro) != 2:
+                raise ValueError(f'{sigla}: elenco confirmado inválido.')
+            linhas.append(dict(base, nome=membro[0], cargo=membro[1]))
+    return montar_elenco(linhas)
+
+def montar_elenco(linhas):
+    """Valida as linhas (dicts com COLUNAS_ELENCO) e agrupa por comissão."""
+    elenco = {}
+    for numero, linha in enumerate(linhas, start=1):
+        valores = {coluna: str(linha.get(coluna) or '').strip() for coluna in COLUNAS_ELENCO}
+        sigla = valores['sigla'].upper()
+        if not sigla:
+            raise ValueError(f"Linha {numero}: 'sigla' vazia.")
+        comissao = elenco.setdefault(sigla, {'nome': '', 'template': '', 'membros': []})
+        for campo, coluna in (('nome', 'comissao'), ('template', 'template')):
+            if valores[coluna]:
+                if comissao[campo] and comissao[campo] != valores[coluna]:
+                    raise ValueError(f"Linha {numero}: '{coluna}' de {sigla} diferente da informada antes.")
+                comissao[campo] = valores[coluna]
+        if valores['nome']:
+            if any(nome.casefold() == valores['nome'].casefold() for nome, _ in comissao['membros']):
+                raise ValueError(f"Linha {numero}: '{valores['nome']}' repetido em {sigla}.")
+            comissao['membros'].append((valores['nome'], valores['cargo'] or CARGO_PADRAO))
+
+    for sigla, comissao in elenco.items():
+        template = comissao['template']
+        if template and (os.path.basename(template) != template or not template.lower().endswith('.docx')):
+            raise ValueError(f"{sigla}: o template deve ser só o nome de um arquivo .docx ('{template}').")
+    return elenco
+
+def exportar_elenco(elenco, formato):
+    """Elenco atual em CSV ou JSON, no mesmo formato aceito por 'ler_elenco'."""
+    if formato == 'json':
+        return json.dumps({'comissoes': [
+            {'sigla': c.sigla, 'nome': c.nome, 'template': c.template or '',
+             'membros': [{'nome': m.nome, 'cargo': m.cargo} for m in c.membros]}
+            for c in elenco.comissoes
+        ]}, ensure_ascii=False, indent=2)
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    escritor.writerow(COLUNAS_ELENCO)
+    for c in elenco.comissoes:
+        for m in c.membros or [Membro(None, c.id, '', '')]:
+            escritor.writerow([c.sigla, c.nome, c.template or '', m.nome, m.cargo])
+    return saida.getvalue()
+
+def planejar_elenco(elenco, novo, remover_ausentes=False):
+    """
+    Compara o elenco atual com o do arquivo e devolve o plano (a "diferença"):
+    listas de comissões e membros novos, alterados e removidos, e os templates
+    que ainda não estão em templates_docx. Nada é gravado aqui.
+    """
+    plano = {'comissoes_novas': [], 'comissoes_alteradas': [], 'comissoes_removidas': [],
+             'membros_novos': [], 'membros_alterados': [], 'membros_removidos': [], 'templates_faltando': []}
+    for sigla, dados in novo.items():
+        atual = elenco.por_sigla(sigla)
+        if atual is None:
+            if not dados['nome']:
+                raise ValueError(f"{sigla}: comissão nova precisa da coluna 'comissao' (nome).")
+            plano['comissoes_novas'].append({'sigla': sigla, 'nome': dados['nome'], 'template': dados['template']})
+            existentes = {}
+        else:
+            nome = dados['nome'] or atual.nome
+            template = dados['template'] or atual.template or ''
+            if (nome, template) != (atual.nome, atual.template or ''):
+                plano['comissoes_alteradas'].append({'sigla': sigla, 'nome': nome, 'template': template,
+                                                     'nome_antes': atual.nome, 'template_antes': atual.template or ''})
+            existentes = {m.nome.casefold(): m for m in atual.membros}
+
+        mantidos = set()
+        for nome, cargo in dados['membros']:
+            membro = existentes.get(nome.casefold())
+            if membro is None:
+                plano['membros_novos'].append({'sigla': sigla, 'nome': nome, 'cargo': cargo})
+                continue
+            mantidos.add(membro.id)
+            if (membro.nome, membro.cargo) != (nome, cargo):
+                plano['membros_alterados'].append({'id': membro.id, 'sigla': sigla, 'nome': nome, 'cargo': cargo,
+                                                   'nome_antes': membro.nome, 'cargo_antes': membro.cargo})
+        plano['membros_removidos'].extend({'id': m.id, 'sigla': sigla, 'nome': m.nome, 'cargo': m.cargo}
+                                          for m in existentes.values() if m.id not in mantidos)
+
+        template = dados['template'] or (atual.template if atual else None)
+        if not os.path.isfile(caminho_template(sigla, template)):
+            plano['templates_faltando'].append({'sigla': sigla, 'arquivo': nome_template(sigla, template)})
+
+    if remover_ausentes:
+        for comissao in elenco.comissoes:
+            if comissao.sigla not in novo:
+                plano['comissoes_removidas'].append({'id': comissao.id, 'sigla': comissao.sigla,
+                                                     'nome': comissao.nome, 'membros': len(comissao.membros)})
+    return plano
+
+def plano_vazio(plano):
+    return not any(itens for chave, itens in plano.items() if chave != 'templates_faltando')
+
+def aplicar_elenco(db, plano):
+    """Grava o plano numa única transação (poucos executemany, não um comando por membro)."""
+    with db:
+        db.executemany('INSERT INTO comissoes (nome, sigla, template) VALUES (?, ?, ?)',
+                       [(c['nome'], c['sigla'], c['template'] or None) for c in plano['comissoes_novas']])
+        db.executemany('UPDATE comissoes SET nome = ?, template = ? WHERE sigla = ?',
+                       [(c['nome'], c['template'] or None, c['sigla']) for c in plano['comissoes_alteradas']])
+        db.executemany('DELETE FROM membros WHERE id = ?', [(m['id'],) for m in plano['membros_removidos']])
+        db.executemany('UPDATE membros SET nome = ?, cargo = ? WHERE id = ?',
+                       [(m['nome'], m['cargo'], m['id']) for m in plano['membros_alterados']])
+        ids = {linha['sigla']: linha['id'] for linha in db.execute('SELECT id, sigla FROM comissoes')}
+        db.executemany('INSERT INTO membros (comissao_id, nome, cargo) VALUES (?, ?, ?)',
+                       [(ids[m['sigla']], m['nome'], m['cargo']) for m in plano['membros_novos']])
+        removidas = [(c['id'],) for c in plano['comissoes_removidas']]
+        db.executemany('DELETE FROM membros WHERE comissao_id = ?', removidas)
+        db.executemany('DELETE FROM comissoes WHERE id = ?', removidas)
+
+def resumo_plano(plano):
+    """Uma linha por mudança, para o terminal e os avisos da tela."""
+    linhas = [f"+ comissão {c['sigla']}: {c['nome']}" for c in plano['comissoes_novas']]
+    linhas += [f"~ comissão {c['sigla']}: {c['nome_antes']} [{c['template_antes'] or 'padrão'}] -> "
+               f"{c['nome']} [{c['template'] or 'padrão'}]" for c in plano['comissoes_alteradas']]
+    linhas += [f"- comissão {c['sigla']}: {c['nome']} ({c['membros']} membro(s))" for c in plano['comissoes_removidas']]
+    linhas += [f"+ {m['sigla']}: {m['nome']} ({m['cargo']})" for m in plano['membros_novos']]
+    linhas += [f"~ {m['sigla']}: {m['nome_antes']} ({m['cargo_antes']}) -> {m['nome']} ({m['cargo']})"
+               for m in plano['membros_alterados']]
+    linhas += [f"- {m['sigla']}: {m['nome']} ({m['cargo']})" for m in plano['membros_removidos']]
+    linhas += [f"! {t['sigla']}: template {t['arquivo']} não encontrado" for t in plano['templates_faltando']]
+    return linhas
+
+# --- HISTÓRICO (paginação e busca) ---
+def converter_historico_em_pdf(ids=None, refazer=False):
+    """
+    Gera o PDF dos pareceres já existentes no histórico (todos, ou só os 'ids').
+    Sem 'refazer', pula os que já têm PDF. As conversões rodam no pool de
+    geração; cada .docx é convertido uma vez, mesmo que apareça em várias linhas.
+    Retorna (convertidos, falhas), com falhas = [(docx_name, mensagem)].
+    """
+    db = get_db()
+    sql = 'SELECT DISTINCT docx_name FROM pareceres'
+    condicoes, parametros = [], []
+    if ids is not None:
+        condicoes.append(f"id IN ({','.join('?' * len(ids))})")
+        parametros.extend(ids)
+    if not refazer:
+        condicoes.append('arquivo_pdf IS NULL')
+    if condicoes:
+        sql += ' WHERE ' + ' AND '.join(condicoes)
+
+    pool = get_pool_geracao()
+    futuros, falhas = [], []
+    for linha in db.execute(sql, parametros).fetchall():
+        caminho_docx = safe_join(app.config['GENERATED_FOLDER'], linha['docx_name'])
+        if not caminho_docx or not os.path.isfile(caminho_docx):
+            falhas.append((linha['docx_name'], 'Arquivo .docx não encontrado.'))
+            continue
+        nome_pdf = nome_pdf_do_parecer(linha['docx_name'])
+        caminho_pdf = os.path.join(app.config['GENERATED_FOLDER'], nome_pdf)
+        futuros.append((linha['docx_name'], nome_pdf, pool.submit(converter_docx_em_pdf, caminho_docx, caminho_pdf)))
+
+    convertidos = []
+    for docx_name, nome_pdf, futuro in futuros:
+        try:
+            futuro.result()
+        except Exception as e:
+            metricas.contar('erros', etapa='pdf')
+            logger.error("Falha ao converter '%s' em PDF: %s", docx_name, e)
+            falhas.append((docx_name, str(e)))
+            continue
+        convertidos.append((nome_pdf, docx_name))
+    if convertidos:
+        with db:
+            db.executemany('UPDATE pareceres SET arquivo_pdf = ? WHERE docx_name = ?', convertidos)
+    return [nome_pdf for nome_pdf, _ in convertidos], falhas
+
+FILTROS_HISTORICO = ('q', 'numero_projeto', 'comissao', 'pdf_name', 'data_inicio', 'data_fim')
+
+def ler_filtros_historico(valores):
+    """Lê e valida os filtros da busca no histórico. Levanta ValueError se alguma data for inválida."""
+    filtros = {nome: valores.get(nome, '').strip() for nome in FILTROS_HISTORICO if valores.get(nome, '').strip()}
+    for nome in ('data_inicio', 'data_fim'):
+        if nome in filtros:
+            try:
+                datetime.strptime(filtros[nome], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Data inválida em '{nome}': use o formato AAAA-MM-DD.") from None
+    return filtros
+
+def buscar_historico(db, filtros, antes_de=None, limite=None):
+    """
+    Uma página do histórico, do mais recente para o mais antigo.
+
+    A paginação é por chave ('antes_de' = id do último item da página
+    anterior), então o custo de cada página não cresce com o histórico.
+    Devolve (itens, cursor da próxima página ou None).
+    """
+    limite = limite or app.config['HISTORICO_POR_PAGINA']
+    condicoes, parametros = [], []
+    if antes_de:
+        condicoes.append('id < ?')
+        parametros.append(antes_de)
+    if filtros.get('numero_projeto'):
+        numero = filtros['numero_projeto']
+        # "45/2025" também encontra "045/2025", que é como o número é gravado
+        if (m := re.fullmatch(r'(\d+)/(\d{4})', numero)):
+            numero = f"{m.group(1).zfill(3)}/{m.group(2)}"
+        condicoes.append('numero_projeto = ?')
+        parametros.append(numero)
+    if filtros.get('comissao'):
+        condicoes.append('comissao = ?')
+        parametros.append(filtros['comissao'].upper())
+    if filtros.get('pdf_name'):
+        condicoes.append('pdf_name = ?')
+        parametros.append(filtros['pdf_name'])
+    if filtros.get('data_inicio'):
+        condicoes.append('gerado_em >= ?')
+        parametros.append(filtros['data_inicio'])
+    if filtros.get('data_fim'):
+        # Inclui o dia inteiro: tudo antes da meia-noite do dia seguinte
+        dia_seguinte = datetime.strptime(filtros['data_fim'], '%Y-%m-%d') + timedelta(days=1)
+        condicoes.append('gerado_em < ?')
+        parametros.append(dia_seguinte.strftime('%Y-%m-%d'))
+    termos = re.findall(r'\w+', filtros.get('q', ''))
+    if termos:
+        if _fts_disponivel:
+            # Cada termo vira um prefixo entre aspas (todos precisam aparecer)
+            condicoes.append('id IN (SELECT rowid FROM pareceres_fts WHERE pareceres_fts MATCH ?)')
+            parametros.append(' '.join(f'"{termo}"*' for termo in termos))
+        else:
+            for termo in termos:
+                condicoes.append("(coalesce(ementa, '') || ' ' || coalesce(tipo_projeto, '')) LIKE ?")
+                parametros.append(f'%{termo}%')
+
+    sql = 'SELECT * FROM pareceres'
+    if condicoes:
+        sql += ' WHERE ' + ' AND '.join(condicoes)
+    # Busca um item a mais só para saber se existe próxima página
+    linhas = db.execute(sql + ' ORDER BY id DESC LIMIT ?', parametros + [limite + 1]).fetchall()
+    proximo = linhas[limite - 1]['id'] if len(linhas) > limite else None
+    return linhas[:limite], proximo
+
+class CacheDoHistorico:
+    """
+    Páginas do histórico já renderizadas (HTML da tabela), por filtros e
+    página, válidas para uma 'versao_historico'. A versão muda (por trigger) a
+    cada alteração em 'pareceres'; a primeira leitura com a versão nova
+    descarta todas as páginas guardadas.
+    """
+
+    def __init__(self, max_itens):
+        self.max_itens = max_itens
+        self.versao = None
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _acompanhar(self, versao):
+        # Chamado com o lock. A versão só cresce: uma mais antiga que a atual não vale mais.
+        if self.versao is None or versao > self.versao:
+            self.versao = versao
+            self._itens.clear()
+        return versao == self.versao
+
+    def obter(self, versao, chave):
+        with self._lock:
+            if not self._acompanhar(versao):
+                return None
+            html = self._itens.get(chave)
+            if html is not None:
+                self._itens.move_to_end(chave)
+            return html
+
+    def guardar(self, versao, chave, html):
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            if not self._acompanhar(versao):
+                return
+            self._itens[chave] = html
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+cache_historico = CacheDoHistorico(app.config['HISTORICO_CACHE_MAX'])
+
+def versao_historico(db):
+    linha = db.execute("SELECT valor FROM meta WHERE chave = 'versao_historico'").fetchone()
+    return linha[0] if linha else 0
+
+def renderizar_tabela_historico(db, filtros, antes_de, paginado):
+    """HTML da tabela do histórico (com a paginação), vindo do cache quando o histórico não mudou."""
+    # A versão é lida ANTES dos dados: se o histórico mudar no meio, a página
+    # fica guardada com a versão antiga e não é mais usada.
+    versao = versao_historico(db)
+    chave = (tuple(sorted(filtros.items())), antes_de, paginado)
+    html = cache_historico.obter(versao, chave)
+    if html is not None:
+        metricas.contar('cache', cache='historico', resultado='hit')
+        return html
+    metricas.contar('cache', cache='historico', resultado='miss')
+    historico, proximo = buscar_historico(db, filtros, antes_de=antes_de)
+    html = render_template('historico_tabela.html', historico=historico, proximo=proximo, filtros=filtros,
+                           paginado=paginado)
+    cache_historico.guardar(versao, chave, html)
+    return html
 
 # --- ROTAS ---
 @app.route('/', methods=['GET'])
 @login_required
 def index():
     db = get_db()
-    historico = db.execute('SELECT * FROM pareceres ORDER BY id DESC').fetchall()
-    return render_template('index.html', historico=historico)
+    try:
+        filtros = ler_filtros_historico(request.args)
+    except ValueError as e:
+        flash(str(e))
+        filtros = {}
+    tabela = renderizar_tabela_historico(db, filtros, request.args.get('antes', type=int), 'antes' in request.args)
+    comissoes = sorted(obter_elenco().comissoes, key=lambda c: c.sigla)
+    return render_template('index.html', tabela_historico=Markup(tabela), filtros=filtros, comissoes=comissoes)
+
+@app.route('/api/historico')
+@login_required
+def api_historico():
+    """Busca no histórico em JSON. Aceita os mesmos filtros da tela inicial, mais 'antes' e 'limite'."""
+    try:
+        filtros = ler_filtros_historico(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    limite = min(request.args.get('limite', app.config['HISTORICO_POR_PAGINA'], type=int),
+                 app.config['HISTORICO_LIMITE_API'])
+    itens, proximo = buscar_historico(get_db(), filtros, antes_de=request.args.get('antes', type=int),
+                                      limite=max(limite, 1))
+    return jsonify({
+        'itens': [dict(item, download_url=url_for('download', filename=item['docx_name']),
+                       pdf_url=url_for('download', filename=item['arquivo_pdf']) if item['arquivo_pdf'] else None)
+                  for item in itens],
+        'proximo': proximo,
+    })
+
+@app.errorhandler(RequestEntityTooLarge)
+def requisicao_grande_demais(e):
+    limite = (request.max_content_length or app.config['MAX_CONTENT_LENGTH']) // (1024 * 1024)
+    mensagem = f'Arquivo grande demais. O limite é de {limite} MB.'
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'erro': mensagem}), 413
+    flash(mensagem)
+    return redirect(url_for('index'))
 
 @app.route('/upload', methods=['POST'])
 @login_required
@@ -292,17 +2183,25 @@ def upload():
         flash('Nenhum arquivo selecionado.')
         return redirect(url_for('index'))
     
-    filename = file.filename
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(pdf_path)
-    
-    dados_pdf = processar_pdf(pdf_path)
+    # O nome enviado pelo cliente só é exibido; o arquivo é gravado pelo hash do conteúdo
+    filename = os.path.basename(file.filename.replace('\\', '/'))
+    try:
+        sha256, pdf_path = armazem_pdfs.guardar_stream(file.stream, limite=app.config['MAX_CONTENT_LENGTH'])
+    except ArquivoGrandeDemais as e:
+        flash(str(e))
+        return redirect(url_for('index'))
+
+    if app.config['TAREFAS_ASSINCRONAS']:
+        tarefa_id = enfileirar_tarefa('extracao', {'pdf_path': pdf_path, 'filename': filename, 'sha256': sha256})
+        return responder_tarefa(tarefa_id)
     
-    db = get_db()
-    comissoes = db.execute('SELECT * FROM comissoes').fetchall()
-    membros = db.execute('SELECT * FROM membros').fetchall()
+    try:
+        dados_pdf = processar_pdf(pdf_path, sha256=sha256)
+    except PDFGrandeDemais as e:
+        flash(f'PDF grande demais para processar: {e}')
+        return redirect(url_for('index'))
     
-    return render_template('revisar.html', dados=dados_pdf, comissoes=comissoes, membros=membros, filename=filename)
+    return renderizar_revisao(dados_pdf, filename, sha256)
 
 @app.route('/gerar', methods=['POST'])
 @login_required
@@ -317,28 +2216,295 @@ def gerar():
     # --- FIM DO NOVO BLOCO ---
 
     pdf_filename = request.form.get('pdf_filename')
+
+    if app.config['TAREFAS_ASSINCRONAS']:
+        tarefa_id = enfileirar_tarefa('geracao', {'form': list(request.form.items(multi=True)),
+                                                  'pdf_filename': pdf_filename})
+        return responder_tarefa(tarefa_id)
     
     try:
-        arquivos_gerados = gerar_docx_final(request.form, pdf_filename)
+        arquivos_gerados, falhas = gerar_docx_final(request.form, pdf_filename)
         
         # Segunda verificação: Se os arquivos gerados estiverem vazios (ex: erro de template)
         if not arquivos_gerados:
+            # Cada comissão que falhou é informada individualmente
+            for sigla, mensagem in falhas:
+                flash(f'{sigla}: {mensagem}')
             flash('Erro ao gerar os arquivos. Verifique os templates e dados do formulário.')
             return redirect(url_for('index'))
             
-        return render_template('resultado.html', arquivos=arquivos_gerados)
+        return render_template('resultado.html', arquivos=arquivos_gerados, falhas=falhas)
 
     except Exception as e:
         # Captura erros na geração (ex: template .docx não encontrado)
-        print(f"ERRO CRÍTICO EM /gerar: {e}")
+        logger.exception("Erro crítico em /gerar: %s", e)
         flash(f'Erro interno ao gerar documentos: {e}')
         return redirect(url_for('index'))
 
+@app.route('/tarefa/<int:tarefa_id>')
+@login_required
+def aguardar_tarefa(tarefa_id):
+    """Página de espera: consulta o status da tarefa até ela terminar."""
+    return render_template('aguardando.html', tarefa_id=tarefa_id,
+                           intervalo_ms=int(app.config['TAREFAS_INTERVALO_POLL'] * 1000))
+
+@app.route('/tarefa/<int:tarefa_id>/status')
+@login_required
+def status_tarefa(tarefa_id):
+    db = get_db()
+    tarefa = db.execute('SELECT id, tipo, status, progresso, mensagem, atualizado_em FROM tarefas WHERE id = ?',
+                        (tarefa_id,)).fetchone()
+    if tarefa is None:
+        return jsonify({'erro': 'Tarefa não encontrada.'}), 404
+    # Se nenhum worker estiver de pé para recuperar a tarefa, a própria consulta recupera
+    if tarefa['status'] == 'executando' and tarefa['atualizado_em'] < limite_do_lease():
+        recuperar_tarefas_abandonadas(db)
+        db.commit()
+        tarefa = db.execute('SELECT id, tipo, status, progresso, mensagem, atualizado_em FROM tarefas WHERE id = ?',
+                            (tarefa_id,)).fetchone()
+    status = dict(tarefa)
+    if tarefa['status'] in ('concluida', 'erro'):
+        status['resultado_url'] = url_for('resultado_tarefa', tarefa_id=tarefa_id)
+    return jsonify(status)
+
+@app.route('/tarefa/<int:tarefa_id>/resultado')
+@login_required
+def resultado_tarefa(tarefa_id):
+    """Mostra a tela de revisão (extração) ou de downloads (geração) da tarefa concluída."""
+    db = get_db()
+    tarefa = db.execute('SELECT * FROM tarefas WHERE id = ?', (tarefa_id,)).fetchone()
+    if tarefa is None:
+        flash('Tarefa não encontrada.')
+        return redirect(url_for('index'))
+    if tarefa['status'] == 'erro':
+        flash(f"Erro ao processar a tarefa: {tarefa['mensagem']}")
+        return redirect(url_for('index'))
+    if tarefa['status'] != 'concluida':
+        return redirect(url_for('aguardar_tarefa', tarefa_id=tarefa_id))
+
+    resultado = json.loads(tarefa['resultado'])
+    if tarefa['tipo'] == 'extracao':
+        return renderizar_revisao(resultado['dados'], resultado['filename'], resultado.get('sha256'))
+    if tarefa['tipo'] == 'lote':
+        return send_file(os.path.join(app.config['GENERATED_FOLDER'], resultado['zip']),
+                         mimetype='application/zip', as_attachment=True,
+                         download_name=f"pareceres_lote_{datetime.fromisoformat(tarefa['criado_em']):%Y%m%d_%H%M%S}.zip")
+
+    if not resultado['arquivos']:
+        for sigla, mensagem in resultado['falhas']:
+            flash(f'{sigla}: {mensagem}')
+        flash('Erro ao gerar os arquivos. Verifique os templates e dados do formulário.')
+        return redirect(url_for('index'))
+    return render_template('resultado.html', arquivos=resultado['arquivos'], falhas=resultado['falhas'])
+
+@app.route('/lote', methods=['POST'])
+@login_required
+def lote():
+    """
+    Recebe um .zip de PDFs (e ajustes opcionais) e enfileira o lote; o .zip com
+    todos os pareceres sai em /tarefa/<id>/resultado quando ele termina.
+    """
+    # O .zip do lote pode ser maior que um upload comum
+    request.max_content_length = app.config['LOTE_MAX_CONTENT_LENGTH']
+    arquivo_zip = request.files.get('arquivo_zip')
+    if not arquivo_zip or arquivo_zip.filename == '':
+        flash('Nenhum arquivo .zip selecionado.')
+        return redirect(url_for('index'))
+
+    ajustes = {}
+    arquivo_ajustes = request.files.get('ajustes')
+    try:
+        if arquivo_ajustes and arquivo_ajustes.filename:
+            ajustes = ler_ajustes_lote(arquivo_ajustes.read().decode('utf-8-sig'), arquivo_ajustes.filename)
+        pdfs = extrair_pdfs_do_zip(arquivo_zip.stream, limite=app.config['MAX_CONTENT_LENGTH'])
+    except (zipfile.BadZipFile, ValueError, KeyError, ArquivoGrandeDemais) as e:
+        flash(f'Erro ao ler os arquivos do lote: {e}')
+        return redirect(url_for('index'))
+
+    if not pdfs:
+        flash('O arquivo .zip não contém nenhum PDF.')
+        return redirect(url_for('index'))
+
+    # Um lote de verdade passa do timeout do gunicorn: sempre roda fora da requisição
+    tarefa_id = enfileirar_tarefa('lote', {'pdfs': pdfs, 'ajustes': ajustes})
+    if not app.config['TAREFAS_ASSINCRONAS']:
+        executar_em_thread(tarefa_id)
+    return responder_tarefa(tarefa_id)
+
+@app.route('/status/templates')
+@login_required
+def status_templates():
+    """Contadores do cache de templates (hits, misses, recargas, descartes) e o último aquecimento."""
+    return jsonify(dict(cache_templates.estatisticas(), aquecimento=ultimo_aquecimento))
+
+# --- MÉTRICAS ---
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_requisicao(resposta):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        # Rótulo pelo endpoint (não pela URL), para não criar uma série por id
+        endpoint = request.endpoint or 'desconhecido'
+        metricas.observar('http', time.perf_counter() - inicio, endpoint=endpoint)
+        metricas.contar('requisicoes', endpoint=endpoint, status=resposta.status_code)
+    return resposta
+
+@metricas.registrar_coletor
+def medidas_do_cache_de_templates():
+    estatisticas = cache_templates.estatisticas()
+    return [(f'templates_cache_{nome}', {}, estatisticas[nome])
+            for nome in ('hits', 'misses', 'recargas', 'descartes', 'bytes')]
+
+@metricas.registrar_coletor
+def medidas_da_fila():
+    linhas = get_db().execute('SELECT status, count(*) AS total FROM tarefas GROUP BY status').fetchall()
+    return [('tarefas_na_fila', {'status': linha['status']}, linha['total']) for linha in linhas]
+
+metricas.descrever('paginas_lidas', 'Páginas de PDF lidas na extração, por fonte (texto ou ocr).')
+metricas.descrever('paginas_ocr', 'Páginas escaneadas: reconhecidas, vindas do cache, com falha ou sem Tesseract.')
+metricas.descrever('campos_extraidos', 'Resultado de cada campo obrigatório na extração por regex.')
+metricas.descrever('extracao_streaming', 'Como terminou a leitura em streaming do PDF.')
+metricas.descrever('cache', 'Consultas aos caches de extração, de renderização, de usuários e do histórico.')
+metricas.descrever('extracao_recusada', 'PDFs recusados por passar de um limite da extração.')
+metricas.descrever('pareceres_gerados', 'Pareceres (.docx) renderizados.')
+metricas.descrever('erros', 'Falhas por etapa.')
+metricas.descrever('tarefas', 'Tarefas da fila executadas pelo worker.')
+metricas.descrever('requisicoes', 'Requisições HTTP atendidas.')
+metricas.descrever('tarefas_na_fila', 'Tarefas no banco, por status.')
+for _nome in ('hits', 'misses', 'recargas', 'descartes', 'bytes'):
+    metricas.descrever(f'templates_cache_{_nome}', f'Cache de templates .docx: {_nome}.')
+
+@app.route('/metrics')
+def exportar_metricas():
+    """Métricas deste processo no formato texto do Prometheus."""
+    token = app.config['METRICAS_TOKEN']
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Não autorizado.\n', status=401, mimetype='text/plain')
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        # Sem token, o endpoint nem aparece para quem vem de fora
+        abort(404)
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # Rotas de download e init-db continuam as mesmas da versão anterior
 @app.route('/download/<filename>')
 @login_required
 def download(filename):
-    return send_from_directory(app.config['GENERATED_FOLDER'], filename, as_attachment=True)
+    """
+    Baixa um parecer gerado. A ETag é o sha256 do conteúdo: o navegador
+    revalida e recebe 304 se o arquivo não mudou, e Range (retomar o
+    download) é atendido. Gerar de novo sobrescreve o arquivo com o mesmo
+    nome, por isso a resposta sempre pede revalidação (no-cache).
+    """
+    caminho = safe_join(app.config['GENERATED_FOLDER'], filename)
+    if caminho is None or not os.path.isfile(caminho):
+        abort(404)
+    resposta = send_file(caminho, as_attachment=True, etag=hashes_gerados.obter(caminho), conditional=True)
+    resposta.cache_control.private = True
+    return resposta
+
+class _BufferDeStreaming(io.RawIOBase):
+    """Destino 'não posicionável' para o zipfile: guarda os bytes até o gerador entregá-los."""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+def gerar_zip_em_streaming(arquivos, tamanho_bloco=256 * 1024):
+    """
+    Gera, em pedaços, um .zip com os arquivos [(nome_no_zip, caminho)].
+    Cada arquivo é lido bloco a bloco; nada do .zip fica inteiro na memória nem no disco.
+    """
+    buffer = _BufferDeStreaming()
+    # Os .docx já são comprimidos: nível 1 só para não gastar CPU à toa
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for nome, caminho in arquivos:
+            info = zipfile.ZipInfo(nome, date_time=time.localtime(os.path.getmtime(caminho))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(caminho, 'rb') as origem, zf.open(info, 'w') as destino:
+                for bloco in iter(lambda: origem.read(tamanho_bloco), b''):
+                    destino.write(bloco)
+                    if (dados := buffer.retirar()):
+                        yield dados
+            if (dados := buffer.retirar()):
+                yield dados
+    yield buffer.retirar()
+
+@app.route('/download_lote', methods=['GET', 'POST'])
+@login_required
+def download_lote():
+    """
+    Baixa vários pareceres num único .zip, montado em streaming.
+    Filtros (combináveis): id (itens do histórico), arquivo (nomes dos .docx),
+    numero_projeto, pdf_name, ou todos=1 para o histórico inteiro.
+    """
+    valores = request.values
+    condicoes, parametros = [], []
+    if (ids := [i for i in valores.getlist('id') if i.isdigit()]):
+        condicoes.append(f"id IN ({','.join('?' * len(ids))})")
+        parametros.extend(ids)
+    if (nomes := valores.getlist('arquivo')):
+        condicoes.append(f"docx_name IN ({','.join('?' * len(nomes))})")
+        parametros.extend(nomes)
+    if valores.get('numero_projeto'):
+        condicoes.append('numero_projeto = ?')
+        parametros.append(valores['numero_projeto'])
+    if valores.get('pdf_name'):
+        condicoes.append('pdf_name = ?')
+        parametros.append(valores['pdf_name'])
+
+    if not condicoes and valores.get('todos') != '1':
+        flash('Selecione ao menos um item do histórico para baixar.')
+        return redirect(url_for('index'))
+
+    sql = 'SELECT DISTINCT docx_name, arquivo_pdf FROM pareceres'
+    if condicoes:
+        sql += ' WHERE ' + ' OR '.join(condicoes)
+    db = get_db()
+    # O PDF (quando existe) vai junto com o .docx do mesmo parecer
+    nomes = sorted({nome for linha in db.execute(sql, parametros)
+                    for nome in (linha['docx_name'], linha['arquivo_pdf']) if nome})
+
+    arquivos = []
+    for nome in nomes:
+        caminho = safe_join(app.config['GENERATED_FOLDER'], nome)
+        if caminho and os.path.isfile(caminho):
+            arquivos.append((nome, caminho))
+    if not arquivos:
+        flash('Nenhum arquivo encontrado para os itens selecionados.')
+        return redirect(url_for('index'))
+
+    nome_zip = f"pareceres_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(stream_with_context(gerar_zip_em_streaming(arquivos)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{nome_zip}"'})
+
+@app.route('/converter_pdf', methods=['POST'])
+@login_required
+def converter_pdf():
+    """Gera o PDF dos itens do histórico selecionados (ou de todos, com todos=1)."""
+    ids = [i for i in request.form.getlist('id') if i.isdigit()]
+    if not ids and request.form.get('todos') != '1':
+        flash('Selecione ao menos um item do histórico para converter.')
+        return redirect(url_for('index'))
+    convertidos, falhas = converter_historico_em_pdf(ids or None, refazer=bool(ids))
+    flash(f'{len(convertidos)} PDF(s) gerado(s).' if convertidos else 'Nenhum PDF novo foi gerado.')
+    for docx_name, mensagem in falhas:
+        flash(f'Não foi possível converter "{docx_name}": {mensagem}')
+    return redirect(url_for('index'))
 
 @app.route('/deletar_historico/<int:item_id>', methods=['POST'])
 @login_required
@@ -347,18 +2513,18 @@ def deletar_historico(item_id):
     try:
         db = get_db()
         # 1. Pega o nome do arquivo no DB ANTES de deletar
-        item = db.execute('SELECT docx_name FROM pareceres WHERE id = ?', (item_id,)).fetchone()
+        item = db.execute('SELECT docx_name, arquivo_pdf FROM pareceres WHERE id = ?', (item_id,)).fetchone()
 
         if item:
-            # 2. Deleta o arquivo físico da pasta 'generated'
-            arquivo_path = os.path.join(app.config['GENERATED_FOLDER'], item['docx_name'])
-            if os.path.exists(arquivo_path):
-                os.remove(arquivo_path)
+            # 2. Deleta o arquivo físico (e o PDF, se houver) da pasta 'generated'
+            for nome in (item['docx_name'], item['arquivo_pdf']):
+                arquivo_path = os.path.join(app.config['GENERATED_FOLDER'], nome) if nome else None
+                if arquivo_path and os.path.exists(arquivo_path):
+                    os.remove(arquivo_path)
 
-        # 3. Deleta o registro do banco de dados
+        # 3. Deleta o registro do banco de dados (o que também tira o parecer do cache de renderização)
         db.execute('DELETE FROM pareceres WHERE id = ?', (item_id,))
         db.commit()
-        db.close()
         flash('Item do histórico removido com sucesso.', 'success')
     except Exception as e:
         flash(f'Erro ao remover item: {e}', 'danger')
@@ -371,18 +2537,18 @@ def limpar_historico():
     try:
         db = get_db()
         # 1. Pega todos os nomes de arquivos no DB
-        items = db.execute('SELECT docx_name FROM pareceres').fetchall()
+        items = db.execute('SELECT docx_name, arquivo_pdf FROM pareceres').fetchall()
 
-        # 2. Deleta todos os arquivos físicos da pasta 'generated'
+        # 2. Deleta todos os arquivos físicos (e PDFs) da pasta 'generated'
         for item in items:
-            arquivo_path = os.path.join(app.config['GENERATED_FOLDER'], item['docx_name'])
-            if os.path.exists(arquivo_path):
-                os.remove(arquivo_path)
+            for nome in (item['docx_name'], item['arquivo_pdf']):
+                arquivo_path = os.path.join(app.config['GENERATED_FOLDER'], nome) if nome else None
+                if arquivo_path and os.path.exists(arquivo_path):
+                    os.remove(arquivo_path)
 
-        # 3. Deleta todos os registros do banco de dados
+        # 3. Deleta todos os registros do banco de dados (e, com eles, o cache de renderização)
         db.execute('DELETE FROM pareceres')
         db.commit()
-        db.close()
         flash('Histórico completo removido com sucesso.', 'success')
     except Exception as e:
         flash(f'Erro ao limpar histórico: {e}', 'danger')
@@ -400,7 +2566,6 @@ def adicionar_membro():
         db.execute('INSERT INTO membros (nome, cargo, comissao_id) VALUES (?, ?, ?)',
                    (nome, cargo, comissao_id))
         db.commit()
-        db.close()
         flash(f'Membro "{nome}" adicionado com sucesso!')
     except Exception as e:
         flash(f'Erro ao adicionar membro: {e}')
@@ -418,7 +2583,6 @@ def deletar_membro():
         
         db.execute('DELETE FROM membros WHERE id = ?', (membro_id,))
         db.commit()
-        db.close()
         flash(f'Membro "{nome_membro}" removido com sucesso!')
     except Exception as e:
         flash(f'Erro ao remover membro: {e}')
@@ -428,10 +2592,9 @@ def deletar_membro():
 @login_required
 def editar_membro(membro_id):
     """Exibe o formulário de edição para um membro específico."""
-    db = get_db()
-    membro = db.execute('SELECT * FROM membros WHERE id = ?', (membro_id,)).fetchone()
-    comissoes = db.execute('SELECT * FROM comissoes ORDER BY nome').fetchall()
-    db.close()
+    elenco = obter_elenco()
+    membro = elenco.membro(membro_id)
+    comissoes = elenco.comissoes_por_nome
     
     if membro is None:
         flash('Membro não encontrado.')
@@ -453,35 +2616,190 @@ def atualizar_membro():
         db.execute('UPDATE membros SET nome = ?, cargo = ?, comissao_id = ? WHERE id = ?',
                    (nome, cargo, comissao_id, membro_id))
         db.commit()
-        db.close()
         flash(f'Dados do membro "{nome}" atualizados com sucesso!')
     except Exception as e:
         flash(f'Erro ao atualizar membro: {e}')
         
     return redirect(url_for('gerenciar'))
 
+@app.route('/elenco/exportar')
+@login_required
+def exportar_elenco_rota():
+    formato = 'json' if request.args.get('formato') == 'json' else 'csv'
+    conteudo = exportar_elenco(obter_elenco(), formato)
+    return Response(conteudo, mimetype='application/json' if formato == 'json' else 'text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=elenco.{formato}'})
+
+@app.route('/elenco/importar', methods=['POST'])
+@login_required
+def importar_elenco():
+    """
+    1º passo: recebe o arquivo e mostra a diferença para o elenco atual.
+    2º passo ('confirmar'): aplica o elenco revisado numa única transação.
+    """
+    remover_ausentes = 'remover_ausentes' in request.form
+    try:
+        if 'confirmar' in request.form:
+            novo = ler_elenco_confirmado(request.form['elenco'])
+        else:
+            arquivo = request.files.get('arquivo')
+            if not arquivo or arquivo.filename == '':
+                flash('Nenhum arquivo de elenco selecionado.')
+                return redirect(url_for('gerenciar'))
+            novo = ler_elenco(arquivo.read().decode('utf-8-sig'), arquivo.filename)
+        plano = planejar_elenco(obter_elenco(), novo, remover_ausentes)
+    except (ValueError, KeyError, TypeError, UnicodeDecodeError) as e:
+        flash(f'Erro ao ler o elenco: {e}')
+        return redirect(url_for('gerenciar'))
+
+    if 'confirmar' not in request.form:
+        return render_template('importar_elenco.html', plano=plano, vazio=plano_vazio(plano),
+                               elenco_json=json.dumps(novo, ensure_ascii=False), remover_ausentes=remover_ausentes)
+
+    aplicar_elenco(get_db(), plano)
+    flash(f"Elenco atualizado: {len(plano['comissoes_novas'])} comissão(ões) nova(s), "
+          f"{len(plano['membros_novos'])} membro(s) incluído(s), {len(plano['membros_alterados'])} alterado(s) e "
+          f"{len(plano['membros_removidos'])} removido(s).")
+    for item in plano['templates_faltando']:
+        flash(f"Atenção: {item['sigla']} usa o template {item['arquivo']}, que ainda não foi enviado.")
+    return redirect(url_for('gerenciar'))
+
+@app.route('/elenco/templates', methods=['POST'])
+@login_required
+def enviar_templates():
+    """Grava (ou substitui) templates .docx em templates_docx, depois de conferir que abrem."""
+    enviados = []
+    for arquivo in request.files.getlist('templates'):
+        nome = secure_filename(arquivo.filename or '')
+        if not nome.lower().endswith('.docx'):
+            flash(f"'{arquivo.filename}' ignorado: o template deve ser um arquivo .docx.")
+            continue
+        destino = os.path.join(app.config['TEMPLATE_FOLDER'], nome)
+        temporario = destino + '.enviando'
+        arquivo.save(temporario)
+        try:
+            compilado = compilar_template(temporario)
+        except Exception as e:
+            os.remove(temporario)
+            flash(f"'{nome}' não é um .docx válido: {e}")
+            continue
+        # Troca atômica; o cache de templates percebe a mudança pelo mtime/hash
+        os.replace(temporario, destino)
+        enviados.append(f"{nome} ({len(compilado.placeholders)} placeholder(s))")
+    if enviados:
+        flash(f"Template(s) gravado(s): {', '.join(enviados)}.")
+    return redirect(url_for('gerenciar'))
+
 @app.route('/gerenciar')
 @login_required
 def gerenciar():
-    db = get_db()
-    comissoes = db.execute('SELECT * FROM comissoes ORDER BY nome').fetchall()
+    elenco = obter_elenco()
+    comissoes = elenco.comissoes_por_nome
     
-    # Vamos buscar os membros e agrupá-los por comissão
-    membros_por_comissao = {}
-    for comissao in comissoes:
-        membros = db.execute(
-            'SELECT * FROM membros WHERE comissao_id = ? ORDER BY nome', 
-            (comissao['id'],)
-        ).fetchall()
-        membros_por_comissao[comissao['id']] = membros
+    # Membros agrupados por comissão, em ordem alfabética (já estão no snapshot)
+    membros_por_comissao = {comissao.id: elenco.membros_por_nome(comissao) for comissao in comissoes}
     
-    db.close()
     return render_template(
         'gerenciar.html', 
         comissoes=comissoes, 
-        membros_por_comissao=membros_por_comissao
+        membros_por_comissao=membros_por_comissao,
+        nome_template=nome_template
     )
 
+@app.cli.command('worker')
+@click.option('--processos', default=1, show_default=True, help='Quantidade de processos worker.')
+def worker_command(processos):
+    """Executa as tarefas de extração e geração enfileiradas."""
+    intervalo = app.config['TAREFAS_INTERVALO_POLL']
+    if processos <= 1:
+        loop_worker(intervalo)
+        return
+    filhos = [multiprocessing.Process(target=loop_worker, args=(intervalo,)) for _ in range(processos)]
+    for p in filhos:
+        p.start()
+    try:
+        for p in filhos:
+            p.join()
+    except KeyboardInterrupt:
+        for p in filhos:
+            p.terminate()
+
+@app.cli.command('batch-generate')
+@click.argument('origem', type=click.Path(exists=True))
+@click.option('--ajustes', type=click.Path(exists=True), help='CSV ou JSON com ajustes por projeto.')
+@click.option('--saida', default='pareceres_lote.zip', show_default=True, help='Arquivo .zip de saída.')
+@click.option('--workers', type=int, default=None, help='Processos em paralelo (padrão: LOTE_WORKERS).')
+def batch_generate_command(origem, ajustes, saida, workers):
+    """Gera os pareceres de uma pasta (ou .zip) de PDFs de uma vez."""
+    ajustes_lote = {}
+    if ajustes:
+        with open(ajustes, encoding='utf-8-sig') as f:
+            ajustes_lote = ler_ajustes_lote(f.read(), ajustes)
+
+    if os.path.isdir(origem):
+        pdfs = listar_pdfs_da_pasta(origem)
+    else:
+        pdfs = extrair_pdfs_do_zip(origem, limite=app.config['MAX_CONTENT_LENGTH'])
+    if not pdfs:
+        print(f"Nenhum PDF encontrado em {origem}.")
+        return
+
+    print(f"Processando {len(pdfs)} projeto(s)...")
+    inicio = time.perf_counter()
+    relatorio = executar_lote(pdfs, ajustes_lote, workers=workers)
+    escrever_zip_lote(relatorio, saida)
+
+    for item in relatorio:
+        situacao = "OK  " if item['sucesso'] else "ERRO"
+        print(f"{situacao} {item['arquivo']}: {len(item['gerados'])} parecer(es) gerado(s)")
+        for falha in item['falhas']:
+            print(f"       {falha['comissao'] or '-'}: {falha['mensagem']}")
+    sucessos = sum(1 for item in relatorio if item['sucesso'])
+    print(f"{sucessos}/{len(relatorio)} projeto(s) sem falhas em {time.perf_counter() - inicio:.1f}s. Saída: {saida}")
+
+@app.cli.command('converter-pdf')
+@click.argument('ids', nargs=-1, type=int)
+@click.option('--refazer', is_flag=True, help='Gera de novo mesmo os que já têm PDF.')
+def converter_pdf_command(ids, refazer):
+    """Gera o PDF dos pareceres do histórico (todos, ou só os IDS informados)."""
+    convertidos, falhas = converter_historico_em_pdf(list(ids) or None, refazer=refazer)
+    for nome in convertidos:
+        print(f"SUCESSO: '{nome}' gerado.")
+    for docx_name, mensagem in falhas:
+        print(f"ERRO: '{docx_name}': {mensagem}")
+    print(f"{len(convertidos)} PDF(s) gerado(s), {len(falhas)} falha(s).")
+
+@app.cli.command('limpar-uploads')
+@click.option('--dias', type=float, default=None, help='Retenção dos PDFs sem referência (padrão: UPLOADS_RETENCAO_DIAS).')
+@click.option('--simular', is_flag=True, help='Só lista o que seria apagado.')
+def limpar_uploads_command(dias, simular):
+    """Apaga os PDFs enviados que nenhum parecer (ou tarefa em aberto) referencia."""
+    dias = app.config['UPLOADS_RETENCAO_DIAS'] if dias is None else dias
+    db = get_db()
+    referenciados = {linha[0] for linha in db.execute(
+        'SELECT DISTINCT pdf_sha256 FROM pareceres WHERE pdf_sha256 IS NOT NULL')}
+    for linha in db.execute("SELECT entrada FROM tarefas WHERE status IN ('pendente', 'executando')"):
+        entrada = json.loads(linha['entrada'])
+        if (sha256 := entrada.get('sha256')):
+            referenciados.add(sha256)
+        # Lotes guardam a lista de (caminho, nome, sha256) dos PDFs
+        referenciados.update(sha256 for _, _, sha256 in entrada.get('pdfs', []))
+
+    removidos = armazem_pdfs.coletar_lixo(referenciados, idade_minima=dias * 86400, simular=simular)
+    # Uploads do formato antigo (gravados pelo nome do cliente, soltos em uploads/)
+    limite = time.time() - dias * 86400
+    for nome in os.listdir(UPLOAD_FOLDER):
+        caminho = os.path.join(UPLOAD_FOLDER, nome)
+        if os.path.isfile(caminho) and os.path.getmtime(caminho) < limite:
+            removidos.append((caminho, os.path.getsize(caminho)))
+            if not simular:
+                os.remove(caminho)
+
+    for caminho, _ in removidos:
+        print(f"{'(simulação) ' if simular else ''}Removido: {os.path.relpath(caminho, UPLOAD_FOLDER)}")
+    total = sum(tamanho for _, tamanho in removidos) / (1024 * 1024)
+    print(f"{len(removidos)} arquivo(s), {total:.1f} MB {'a liberar' if simular else 'liberados'}.")
+
 @app.cli.command('create-admin')
 @click.argument('username')
 @click.argument('password')
@@ -499,21 +2817,103 @@ def create_admin_command(username, password):
         print(f"Erro: Usuário '{username}' já existe.")
     except Exception as e:
         print(f"Erro ao criar administrador: {e}")
-    finally:
-        db.close()
+
+@app.cli.command('alterar-senha')
+@click.argument('username')
+@click.password_option('--password', help='Nova senha (se omitida, é pedida no terminal).')
+def alterar_senha_command(username, password):
+    """Troca a senha de um usuário."""
+    db = get_db()
+    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    cursor = db.execute('UPDATE user SET password_hash = ? WHERE username = ?', (hashed_password, username))
+    db.commit()
+    if cursor.rowcount == 0:
+        print(f"Erro: Usuário '{username}' não encontrado.")
+        return
+    print(f"Senha de '{username}' alterada com sucesso.")
+
+@app.cli.command('warmup')
+def warmup_command():
+    """Carrega e valida os templates das comissões (sai com erro se faltar algum)."""
+    relatorio = aquecer()
+    for item in relatorio['templates']:
+        print(f"OK   {item['arquivo']} ({item['sigla']}): {item['placeholders']} placeholder(s)")
+    for item in relatorio['faltando']:
+        print(f"ERRO {item['arquivo']} ({item['sigla']}): arquivo não encontrado")
+    for item in relatorio['com_erro']:
+        print(f"ERRO {item['arquivo']} ({item['sigla']}): {item['erro']}")
+    for nome in relatorio['sem_comissao']:
+        print(f"AVISO {nome}: nenhuma comissão usa este template")
+    print(f"Aquecimento concluído em {relatorio['segundos']:.2f}s.")
+    if relatorio['faltando'] or relatorio['com_erro']:
+        raise SystemExit(1)
+
+@app.cli.group('roster')
+def roster_cli():
+    """Importa e exporta o elenco das comissões (CSV ou JSON)."""
+
+@roster_cli.command('import')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--remover-ausentes', is_flag=True, help='Remove as comissões que não estão no arquivo.')
+@click.option('--simular', is_flag=True, help='Só mostra a diferença, sem gravar.')
+def roster_import_command(arquivo, remover_ausentes, simular):
+    """Aplica o elenco do ARQUIVO numa única transação."""
+    with open(arquivo, encoding='utf-8-sig') as f:
+        try:
+            plano = planejar_elenco(obter_elenco(), ler_elenco(f.read(), arquivo), remover_ausentes)
+        except ValueError as e:
+            print(f"Erro: {e}")
+            raise SystemExit(1)
+    for linha in resumo_plano(plano):
+        print(linha)
+    if plano_vazio(plano):
+        print("Nenhuma alteração no elenco.")
+    elif simular:
+        print("(simulação) Nada foi gravado.")
+    else:
+        aplicar_elenco(get_db(), plano)
+        print("Elenco atualizado.")
+
+@roster_cli.command('export')
+@click.argument('saida', required=False, type=click.Path(dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'json']), help='Padrão: pela extensão de SAIDA, ou csv.')
+def roster_export_command(saida, formato):
+    """Grava o elenco atual em SAIDA (ou mostra no terminal)."""
+    formato = formato or ('json' if saida and saida.lower().endswith('.json') else 'csv')
+    conteudo = exportar_elenco(obter_elenco(), formato)
+    if saida:
+        with open(saida, 'w', encoding='utf-8', newline='') as f:
+            f.write(conteudo)
+        print(f"Elenco exportado para {saida}.")
+    else:
+        click.echo(conteudo, nl=False)
 
 @app.cli.command('init-db')
-def init_db_command():
+@click.option('--elenco', type=click.Path(exists=True, dir_okay=False),
+              help='Arquivo de elenco (CSV/JSON) usado no lugar das comissões e membros padrão.')
+def init_db_command(elenco):
     """Limpa os dados existentes e cria novas tabelas com dados padrão."""
+    if elenco:
+        # Lê antes de apagar qualquer coisa: um arquivo com erro não deixa o banco vazio
+        with open(elenco, encoding='utf-8-sig') as f:
+            try:
+                plano_inicial = planejar_elenco(ElencoComissoes(0, ()), ler_elenco(f.read(), elenco))
+            except ValueError as e:
+                print(f"Erro no arquivo de elenco: {e}")
+                return
     db = get_db()
     cursor = db.cursor()
     
     # Limpar tabelas existentes
     print("Limpando tabelas antigas (se existiam)...")
+    cursor.execute("DROP TABLE IF EXISTS pareceres_fts;")
     cursor.execute("DROP TABLE IF EXISTS pareceres;")
     cursor.execute("DROP TABLE IF EXISTS membros;")
     cursor.execute("DROP TABLE IF EXISTS comissoes;")
     cursor.execute("DROP TABLE IF EXISTS user;") 
+    cursor.execute("DROP TABLE IF EXISTS tarefas;")
+    cursor.execute("DROP TABLE IF EXISTS cache_extracao;")
+    cursor.execute("DROP TABLE IF EXISTS cache_ocr;")
 
     # Criar tabelas
     print("Criando novas tabelas...")
@@ -521,7 +2921,8 @@ def init_db_command():
     CREATE TABLE comissoes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         nome TEXT NOT NULL,
-        sigla TEXT NOT NULL UNIQUE
+        sigla TEXT NOT NULL UNIQUE,
+        template TEXT
     );
     ''')
     cursor.execute('''
@@ -539,7 +2940,15 @@ def init_db_command():
         pdf_name TEXT NOT NULL,
         docx_name TEXT NOT NULL,
         numero_projeto TEXT,
-        data_geracao TEXT NOT NULL
+        data_geracao TEXT NOT NULL,
+        gerado_em TEXT,
+        tipo_projeto TEXT,
+        ementa TEXT,
+        comissao TEXT,
+        arquivo_pdf TEXT,
+        pdf_sha256 TEXT,
+        chave_render TEXT,
+        contexto TEXT
     );
     ''')
     cursor.execute('''
@@ -549,7 +2958,15 @@ def init_db_command():
         password_hash TEXT NOT NULL
     );
     ''')
-    print("Tabelas (comissoes, membros, pareceres, user) criadas.")
+    migrar_db(db)
+    print("Tabelas (comissoes, membros, pareceres, user, tarefas) criadas.")
+
+    if elenco:
+        aplicar_elenco(db, plano_inicial)
+        print(f"Elenco importado: {len(plano_inicial['comissoes_novas'])} comissão(ões), "
+              f"{len(plano_inicial['membros_novos'])} membro(s).")
+        print("Banco de dados inicializado com sucesso.")
+        return
 
     # Inserir Comissões Padrão
     comissoes = [
@@ -570,7 +2987,6 @@ def init_db_command():
         cesas_id = cursor.execute("SELECT id FROM comissoes WHERE sigla = 'CESAS'").fetchone()['id']
     except TypeError:
         print("ERRO: Falha ao buscar IDs das comissões. Verifique as siglas.")
-        db.close()
         return
 
     # Inserir Membros Padrão (Popule com seus dados reais depois)
@@ -592,7 +3008,6 @@ def init_db_command():
     print("Membros padrão inseridos.")
     
     db.commit()
-    db.close()
     print("Banco de dados inicializado com sucesso.")
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -607,12 +3022,11 @@ def login():
         
         db = get_db()
         user_data = db.execute('SELECT * FROM user WHERE username = ?', (username,)).fetchone()
-        db.close()
         
         # Verifica se o usuário existe e se a senha está correta
         if user_data:
-            user = User(user_data['id'], user_data['username'], user_data['password_hash'])
-            if bcrypt.check_password_hash(user.password_hash, password):
+            if bcrypt.check_password_hash(user_data['password_hash'], password):
+                user = User(user_data['id'], user_data['username'])
                 login_user(user) # <-- A "mágica" do Flask-Login acontece aqui
                 flash('Login realizado com sucesso!', 'success')
                 return redirect(url_for('index'))
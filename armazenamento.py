@@ -0,0 +1,155 @@
+# armazenamento.py - ARMAZENAMENTO DOS PDFs ENVIADOS, ENDEREÇADO PELO CONTEÚDO
+#
+# Cada PDF é gravado uma única vez, com o nome igual ao sha256 do conteúdo
+# (blobs/ab/abcdef...pdf). O upload é lido em blocos, calculando o hash e
+# conferindo o limite de tamanho no caminho; se o mesmo arquivo já existe, a
+# cópia temporária é descartada. O histórico (pareceres.pdf_sha256) guarda a
+# referência, e 'coletar_lixo' apaga os blobs que ninguém mais referencia.
+#
+# 'HashesDeArquivos' faz o caminho inverso para arquivos com nome fixo (os
+# pareceres em generated/): lembra o sha256 de cada um enquanto o mtime e o
+# tamanho não mudam, para servir de ETag sem reler o arquivo a cada download.
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+TAMANHO_BLOCO = 1024 * 1024
+
+
+class ArquivoGrandeDemais(Exception):
+    """O conteúdo passou do limite de bytes permitido."""
+
+    def __init__(self, limite):
+        super().__init__(f"O arquivo passa do limite de {limite // (1024 * 1024)} MB.")
+        self.limite = limite
+
+
+class ArmazemPorConteudo:
+    """Guarda arquivos pelo sha256 do conteúdo, dentro de 'raiz' (blobs/ e tmp/)."""
+
+    def __init__(self, raiz, extensao='.pdf'):
+        self.raiz = raiz
+        self.extensao = extensao
+        self.pasta_blobs = os.path.join(raiz, 'blobs')
+        self.pasta_tmp = os.path.join(raiz, 'tmp')
+        os.makedirs(self.pasta_blobs, exist_ok=True)
+        os.makedirs(self.pasta_tmp, exist_ok=True)
+
+    def caminho(self, sha256):
+        return os.path.join(self.pasta_blobs, sha256[:2], sha256 + self.extensao)
+
+    def existe(self, sha256):
+        return os.path.isfile(self.caminho(sha256))
+
+    def guardar_stream(self, stream, limite=None):
+        """
+        Copia 'stream' em blocos para um temporário, calculando o hash, e o
+        publica no endereço final. Levanta ArquivoGrandeDemais assim que o
+        total lido passa de 'limite' (sem ler o resto). Retorna (sha256, caminho).
+        """
+        h = hashlib.sha256()
+        total = 0
+        fd, temporario = tempfile.mkstemp(dir=self.pasta_tmp, suffix='.parcial')
+        try:
+            with os.fdopen(fd, 'wb') as saida:
+                for bloco in iter(lambda: stream.read(TAMANHO_BLOCO), b''):
+                    total += len(bloco)
+                    if limite is not None and total > limite:
+                        raise ArquivoGrandeDemais(limite)
+                    h.update(bloco)
+                    saida.write(bloco)
+            return self._publicar(temporario, h.hexdigest())
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def guardar_arquivo(self, origem):
+        """
+        Guarda um arquivo que já está no disco (ex: pasta do 'batch-generate').
+        Sempre copia: com um hard link, editar o original mudaria o blob sem
+        mudar o seu nome (o sha256). Retorna (sha256, caminho).
+        """
+        with open(origem, 'rb') as f:
+            return self.guardar_stream(f)
+
+    def _publicar(self, temporario, sha256):
+        destino = self.caminho(sha256)
+        if os.path.exists(destino) and os.stat(destino).st_nlink > 1:
+            # Blob antigo, ainda ligado por hard link ao arquivo de alguém:
+            # a cópia nova (mesmo conteúdo) toma o lugar e desfaz o link
+            os.replace(temporario, destino)
+        elif os.path.exists(destino):
+            # Conteúdo repetido: nada a gravar; renova a data para a retenção
+            os.remove(temporario)
+            os.utime(destino)
+        else:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(temporario, destino)
+        return sha256, destino
+
+    def listar(self):
+        """Gera (sha256, caminho, tamanho, mtime) de todos os blobs."""
+        for pasta, _, arquivos in os.walk(self.pasta_blobs):
+            for nome in arquivos:
+                if nome.endswith(self.extensao):
+                    caminho = os.path.join(pasta, nome)
+                    stat = os.stat(caminho)
+                    yield nome[:-len(self.extensao)], caminho, stat.st_size, stat.st_mtime
+
+    def coletar_lixo(self, referenciados, idade_minima, simular=False):
+        """
+        Apaga os blobs fora de 'referenciados' que não são usados há mais de
+        'idade_minima' segundos (a folga protege uploads ainda em revisão),
+        além de temporários abandonados. Retorna [(caminho, tamanho)].
+        """
+        limite = time.time() - idade_minima
+        removidos = []
+        for sha256, caminho, tamanho, mtime in list(self.listar()):
+            if sha256 not in referenciados and mtime < limite:
+                removidos.append((caminho, tamanho))
+        for nome in os.listdir(self.pasta_tmp):
+            caminho = os.path.join(self.pasta_tmp, nome)
+            stat = os.stat(caminho)
+            if stat.st_mtime < limite:
+                removidos.append((caminho, stat.st_size))
+        if not simular:
+            for caminho, _ in removidos:
+                try:
+                    os.remove(caminho)
+                except FileNotFoundError:
+                    pass
+        return removidos
+
+
+class HashesDeArquivos:
+    """sha256 de arquivos por caminho, recalculado só quando o mtime ou o tamanho mudam (LRU)."""
+
+    def __init__(self, max_itens=4096):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()  # caminho -> (mtime_ns, tamanho, sha256)
+        self._lock = threading.Lock()
+
+    def obter(self, caminho, stat=None):
+        stat = stat or os.stat(caminho)
+        assinatura = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            conhecido = self._itens.get(caminho)
+            if conhecido is not None and conhecido[:2] == assinatura:
+                self._itens.move_to_end(caminho)
+                return conhecido[2]
+        h = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+                h.update(bloco)
+        sha256 = h.hexdigest()
+        with self._lock:
+            self._itens[caminho] = (*assinatura, sha256)
+            self._itens.move_to_end(caminho)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return sha256
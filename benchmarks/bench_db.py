@@ -0,0 +1,145 @@
+# benchmarks/bench_db.py - MICRO-BENCHMARK DA CAMADA DE BANCO
+#
+# Compara a conexão antiga (uma sqlite3.connect por chamada, journal em modo
+# DELETE, sem PRAGMAs) com a atual (uma conexão por requisição, WAL,
+# synchronous=NORMAL, cache de statements) em dois cenários:
+#   - leitura: requisições/segundo das rotas que mais usam o banco;
+#   - escrita: várias threads gravando em 'pareceres' ao mesmo tempo, como
+#     vários workers do gunicorn gerando pareceres (inserts/s e erros de lock).
+#
+# Uso (a partir da raiz do projeto):
+#     python benchmarks/bench_db.py [--requisicoes 500] [--threads 8]
+#
+# O benchmark usa um banco temporário; o database.db do projeto não é tocado.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+PASTA_TMP = tempfile.mkdtemp(prefix='bench_db_')
+os.environ['DATABASE'] = os.path.join(PASTA_TMP, 'bench.db')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as aplicacao  # noqa: E402
+
+ROTAS = ['/', '/gerenciar', '/editar_membro/1']
+
+
+def get_db_antigo():
+    """A versão anterior do get_db: conexão nova a cada chamada, sem PRAGMAs."""
+    conn = sqlite3.connect(aplicacao.DATABASE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def preparar(historico):
+    runner = aplicacao.app.test_cli_runner()
+    runner.invoke(args=['init-db'])
+    runner.invoke(args=['create-admin', 'bench', 'bench'])
+    with aplicacao.app.app_context():
+        db = aplicacao.get_db()
+        db.executemany(
+            'INSERT INTO pareceres (pdf_name, docx_name, numero_projeto, data_geracao) VALUES (?, ?, ?, ?)',
+            [(f'pl{i}.pdf', f'PLOE {i}_2025 CJR.docx', f'{i:03d}/2025', '01/01/2025 10:00:00')
+             for i in range(historico)])
+        db.commit()
+
+
+def usar_modo(modo, get_db_atual):
+    """Troca o get_db do app e o modo de journal do arquivo para o cenário pedido."""
+    conn = sqlite3.connect(aplicacao.DATABASE)
+    conn.execute('PRAGMA journal_mode = ' + ('DELETE' if modo == 'antes' else 'WAL'))
+    conn.close()
+    aplicacao.get_db = get_db_antigo if modo == 'antes' else get_db_atual
+
+
+def medir_leitura(cliente, requisicoes):
+    resultados = {}
+    for rota in ROTAS:
+        cliente.get(rota)  # aquecimento
+        inicio = time.perf_counter()
+        for _ in range(requisicoes):
+            resposta = cliente.get(rota)
+            assert resposta.status_code == 200, (rota, resposta.status_code)
+        duracao = time.perf_counter() - inicio
+        resultados[rota] = round(requisicoes / duracao, 1)
+    return resultados
+
+
+def medir_escrita(threads, inserts):
+    """Cada thread simula um worker: abre o contexto, grava uma linha e faz commit."""
+    erros = []
+
+    def trabalhador(n):
+        for i in range(inserts):
+            with aplicacao.app.app_context():
+                db = aplicacao.get_db()
+                try:
+                    db.execute('INSERT INTO pareceres (pdf_name, docx_name, numero_projeto, data_geracao) '
+                               'VALUES (?, ?, ?, ?)', (f'w{n}.pdf', f'w{n}_{i}.docx', '001/2025', 'agora'))
+                    db.commit()
+                except sqlite3.OperationalError as e:
+                    erros.append(str(e))
+                finally:
+                    if aplicacao.get_db is get_db_antigo:
+                        db.close()
+
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=trabalhador, args=(n,)) for n in range(threads)]
+    for t in lista:
+        t.start()
+    for t in lista:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    return {'inserts_por_segundo': round((threads * inserts - len(erros)) / duracao, 1),
+            'erros_de_lock': len(erros)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requisicoes', type=int, default=500)
+    parser.add_argument('--historico', type=int, default=200,
+                        help='Linhas em pareceres (a página inicial lista todas).')
+    parser.add_argument('--rodadas', type=int, default=3, help='Rodadas alternadas; vale a melhor.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=200, help='Inserts por thread.')
+    args = parser.parse_args()
+
+    preparar(args.historico)
+    cliente = aplicacao.app.test_client()
+    cliente.post('/login', data={'username': 'bench', 'password': 'bench'})
+    get_db_atual = aplicacao.get_db
+
+    leitura = {'antes': {}, 'depois': {}}
+    for _ in range(args.rodadas):
+        # Alterna os modos para que aquecimento/ruído não favoreçam nenhum dos dois
+        for modo in ('antes', 'depois'):
+            usar_modo(modo, get_db_atual)
+            for rota, valor in medir_leitura(cliente, args.requisicoes).items():
+                leitura[modo][rota] = max(valor, leitura[modo].get(rota, 0))
+
+    escrita = {}
+    for modo in ('antes', 'depois'):
+        usar_modo(modo, get_db_atual)
+        escrita[modo] = medir_escrita(args.threads, args.inserts)
+    aplicacao.get_db = get_db_atual
+
+    print(json.dumps({
+        'requisicoes_por_rota': args.requisicoes,
+        'linhas_historico': args.historico,
+        'leitura_req_por_segundo': {
+            rota: {'antes': leitura['antes'][rota], 'depois': leitura['depois'][rota],
+                   'ganho': f"{leitura['depois'][rota] / leitura['antes'][rota]:.2f}x"}
+            for rota in ROTAS
+        },
+        'escrita_concorrente': {'threads': args.threads, 'inserts_por_thread': args.inserts, **escrita},
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
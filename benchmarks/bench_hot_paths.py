@@ -0,0 +1,385 @@
+# benchmarks/bench_hot_paths.py - BENCHMARK DOS CAMINHOS QUENTES
+#
+# Mede, com entradas sintéticas geradas na hora (nada depende de arquivos reais):
+#   - extracao: processar_pdf em PDFs de 1 a 500 páginas, com os campos na
+#     primeira página e sem a ementa (pior caso: lê o PDF inteiro);
+#   - render:   compilação e renderização de um template .docx com os
+#               placeholders quebrados em vários runs, salvando .docx e PDF;
+#   - gerar:    POST /gerar completo (4 comissões) pelo test client do Flask,
+#               com e sem o cache de renderização;
+#   - historico: página inicial e buscas com 10 mil e 100 mil pareceres.
+#
+# O resultado é um JSON com percentis (ms) e pico de memória de cada medida,
+# mais o commit atual, para comparar entre versões:
+#
+#     python benchmarks/bench_hot_paths.py --saida antes.json
+#     (muda o código)
+#     python benchmarks/bench_hot_paths.py --comparar antes.json
+#
+# Use --rapido para uma rodada curta (poucas páginas e histórico menor).
+# O banco e as pastas de saída são temporários; database.db não é tocado.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PASTA_TMP = tempfile.mkdtemp(prefix='bench_hot_')
+os.environ['DATABASE'] = os.path.join(PASTA_TMP, 'bench.db')
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, RAIZ)
+
+import docx  # noqa: E402
+import fitz  # noqa: E402
+
+import app as aplicacao  # noqa: E402
+from docx_pdf import salvar_pdf  # noqa: E402
+from docx_templates import CacheDeTemplates, compilar_template  # noqa: E402
+
+PARAGRAFO_ANEXO = (
+    "Art. {n}. Fica o Poder Executivo autorizado a abrir crédito adicional especial no "
+    "orçamento vigente, destinado ao atendimento das despesas previstas no anexo desta lei, "
+    "observadas as disposições da Lei de Diretrizes Orçamentárias e da Lei Orgânica do Município. "
+)
+
+CONTEXTO = {
+    "{{TIPO_PROJETO}}": "PROJETO DE LEI ORDINÁRIA",
+    "{{NUMERO_PROJETO}}": "045/2025",
+    "{{DATA_PROJETO}}": "10 DE MARÇO DE 2025",
+    "{{EMENTA}}": '"Abre crédito adicional especial no Orçamento Anual"',
+    "{{AUTORIA}}": "Chefe do Executivo",
+    "{{DATA_PROTOCOLO}}": "11/03/2025",
+    "{{REGIME_URGENCIA}}": "",
+    "{{TEXTO_APRESENTACAO}}": ".",
+    "{{NUMERO_PARECER}}": "12",
+    "{{DATA_PARECER_EXTENSO}}": "20 de março de 2025",
+    "{{NOME_DA_COMISSAO}}": "COMISSÃO DE JUSTIÇA E REDAÇÃO",
+    "{{NOME_RELATOR}}": "VEREADOR A",
+    "{{CARGO_RELATOR}}": "Presidente",
+    "{{NOME_SIGNATARIO_1}}": "VEREADOR B",
+    "{{CARGO_SIGNATARIO_1}}": "Vice-Presidente",
+    "{{NOME_SIGNATARIO_2}}": "VEREADOR C",
+    "{{CARGO_SIGNATARIO_2}}": "Membro",
+}
+
+
+# --- MEDIÇÃO ---
+def percentil(valores, p):
+    """Percentil pelo método do posto mais próximo (valores já ordenados)."""
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[indice]
+
+
+def rss_maximo_mb():
+    # ru_maxrss vem em KiB no Linux e em bytes no macOS
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maximo / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def medir(funcao, iteracoes, preparar=None):
+    """
+    Roda 'funcao' 'iteracoes' vezes (mais um aquecimento) e devolve os
+    percentis em ms. O pico de memória Python vem de uma execução extra com
+    tracemalloc ligado, para não distorcer os tempos.
+    """
+    if preparar:
+        preparar()
+    funcao()  # aquecimento
+    tempos = []
+    for _ in range(iteracoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tempos.sort()
+    return {
+        'iteracoes': iteracoes,
+        'p50_ms': round(percentil(tempos, 50), 3),
+        'p90_ms': round(percentil(tempos, 90), 3),
+        'p99_ms': round(percentil(tempos, 99), 3),
+        'min_ms': round(tempos[0], 3),
+        'max_ms': round(tempos[-1], 3),
+        'media_ms': round(sum(tempos) / len(tempos), 3),
+        'pico_memoria_python_mb': round(pico / (1024 * 1024), 2),
+        'rss_maximo_mb': rss_maximo_mb(),
+    }
+
+
+# --- ENTRADAS SINTÉTICAS ---
+def criar_pdf_projeto(caminho, paginas, com_ementa=True):
+    """PDF de um projeto de lei: cabeçalho com os campos na 1ª página e anexos nas demais."""
+    pdf = fitz.open()
+    pagina = pdf.new_page()
+    texto = "CÂMARA MUNICIPAL\nPROJETO DE LEI ORDINÁRIA Nº 45\n10 de março de 2025\n"
+    if com_ementa:
+        texto += '"Abre crédito adicional especial no Orçamento Anual e dá outras providências"\n'
+    texto += ''.join(PARAGRAFO_ANEXO.format(n=n) for n in range(1, 4))
+    pagina.insert_textbox(fitz.Rect(50, 50, 545, 790), texto, fontsize=11)
+    for p in range(1, paginas):
+        pagina = pdf.new_page()
+        corpo = ''.join(PARAGRAFO_ANEXO.format(n=p * 10 + n) for n in range(8))
+        pagina.insert_textbox(fitz.Rect(50, 50, 545, 790), corpo, fontsize=10)
+    pdf.save(caminho, garbage=3, deflate=True)
+    pdf.close()
+    return caminho
+
+
+def criar_template_fragmentado(caminho, paragrafos=200):
+    """
+    Template .docx com os placeholders quebrados em vários runs (como o Word
+    costuma gravar depois de edições), no corpo e no cabeçalho.
+    """
+    documento = docx.Document()
+
+    def escrever_fragmentado(paragrafo, texto):
+        # "{{NOME_RELATOR}}" vira "{", "{NO", "ME_", "REL", "ATOR", "}", "}"
+        for pedaco in [texto[i:i + 3] for i in range(0, len(texto), 3)]:
+            run = paragrafo.add_run(pedaco)
+            run.bold = pedaco.startswith('{')
+
+    chaves = list(CONTEXTO)
+    escrever_fragmentado(documento.sections[0].header.paragraphs[0], "PARECER Nº {{NUMERO_PARECER}}")
+    for i in range(paragrafos):
+        paragrafo = documento.add_paragraph()
+        if i % 5 == 0:
+            chave = chaves[(i // 5) % len(chaves)]
+            escrever_fragmentado(paragrafo, f"Texto fixo antes de {chave} e depois, parágrafo {i}.")
+        else:
+            paragrafo.add_run(PARAGRAFO_ANEXO.format(n=i))
+    documento.save(caminho)
+    return caminho
+
+
+# --- CENÁRIOS ---
+def bench_extracao(paginas, iteracoes):
+    resultados = {}
+    for n in paginas:
+        for variante, com_ementa in (('campos_na_primeira_pagina', True), ('sem_ementa', False)):
+            caminho = criar_pdf_projeto(os.path.join(PASTA_TMP, f'pl_{n}_{variante}.pdf'), n, com_ementa)
+            sha256 = aplicacao.hash_arquivo(caminho)
+
+            def limpar_cache():
+                db = aplicacao.get_db()
+                db.execute('DELETE FROM cache_extracao')
+                db.commit()
+
+            with aplicacao.app.app_context():
+                chave = f'{n}_paginas_{variante}'
+                # Poucas iterações nos PDFs grandes: cada uma pode levar segundos
+                vezes = max(3, iteracoes // max(1, n // 10))
+                resultados[chave] = medir(lambda: aplicacao.processar_pdf(caminho, sha256=sha256), vezes,
+                                          preparar=limpar_cache)
+                if variante == 'campos_na_primeira_pagina':
+                    resultados[f'{n}_paginas_cache'] = medir(
+                        lambda: aplicacao.processar_pdf(caminho, sha256=sha256), iteracoes)
+    return resultados
+
+
+def bench_render(iteracoes):
+    resultados = {}
+    templates = {'fragmentado': criar_template_fragmentado(os.path.join(PASTA_TMP, 'template_fragmentado.docx'))}
+    real = os.path.join(RAIZ, 'templates_docx', 'template_cjr.docx')
+    if os.path.exists(real):
+        templates['cjr'] = real
+
+    for nome, caminho in templates.items():
+        cache = CacheDeTemplates()
+        saida_pdf = os.path.join(PASTA_TMP, f'{nome}.pdf')
+
+        def renderizar_docx():
+            cache.renderizar(nome, caminho, CONTEXTO).save(io.BytesIO())
+
+        def renderizar_pdf():
+            salvar_pdf(cache.renderizar(nome, caminho, CONTEXTO), saida_pdf)
+
+        resultados[nome] = {
+            'compilar_template': medir(lambda: compilar_template(caminho), iteracoes),
+            'renderizar_docx': medir(renderizar_docx, iteracoes),
+            'renderizar_pdf': medir(renderizar_pdf, iteracoes),
+        }
+    return resultados
+
+
+def preparar_app():
+    runner = aplicacao.app.test_cli_runner()
+    runner.invoke(args=['init-db'])
+    runner.invoke(args=['create-admin', 'bench', 'bench'])
+    aplicacao.app.config['GENERATED_FOLDER'] = os.path.join(PASTA_TMP, 'generated')
+    os.makedirs(aplicacao.app.config['GENERATED_FOLDER'], exist_ok=True)
+    cliente = aplicacao.app.test_client()
+    cliente.post('/login', data={'username': 'bench', 'password': 'bench'})
+    return cliente
+
+
+def bench_gerar(cliente, iteracoes):
+    with aplicacao.app.app_context():
+        elenco = aplicacao.obter_elenco()
+        comissoes = [(c.sigla, c.membros[0].id) for c in elenco.comissoes if c.membros]
+    formulario = {
+        'pdf_filename': 'pl.pdf', 'tipo_projeto': 'PROJETO DE LEI ORDINÁRIA', 'numero_projeto': '045/2025',
+        'data_projeto': '10 de março de 2025', 'ementa': CONTEXTO['{{EMENTA}}'], 'autoria': 'Chefe do Executivo',
+        'data_protocolo': '2025-03-11', 'data_parecer': '2025-03-20',
+        'comissao_selecionada': [sigla for sigla, _ in comissoes],
+    }
+    for sigla, relator in comissoes:
+        formulario[f'relator_{sigla}'] = str(relator)
+    contador = iter(range(10 ** 9))
+
+    def gerar(mudar_contexto, com_pdf=False):
+        dados = dict(formulario)
+        numero = str(next(contador)) if mudar_contexto else '1'
+        for sigla, _ in comissoes:
+            dados[f'num_parecer_{sigla}'] = numero
+        if com_pdf:
+            dados['gerar_pdf'] = 'true'
+        resposta = cliente.post('/gerar', data=dados)
+        assert resposta.status_code == 200, resposta.status_code
+
+    return {
+        'comissoes': len(comissoes),
+        'sem_cache': medir(lambda: gerar(True), iteracoes),
+        'sem_cache_com_pdf': medir(lambda: gerar(True, com_pdf=True), iteracoes),
+        'cache_de_render': medir(lambda: gerar(False), iteracoes),
+    }
+
+
+def bench_historico(cliente, tamanhos, iteracoes):
+    resultados = {}
+    inseridos = 0
+    for tamanho in sorted(tamanhos):
+        with aplicacao.app.app_context():
+            db = aplicacao.get_db()
+            siglas = ('CJR', 'CFO', 'COSPAP', 'CESAS')
+            linhas = []
+            for i in range(inseridos, tamanho):
+                dia = 1 + i % 28
+                linhas.append((f'pl{i}.pdf', f'PLOE {i}_2025 {siglas[i % 4]}.docx', f'{i % 999:03d}/2025',
+                               f'{dia:02d}/03/2025 10:00:00', f'2025-03-{dia:02d}T10:00:00',
+                               'PROJETO DE LEI ORDINÁRIA',
+                               '"Abre crédito adicional"' if i % 50 == 0 else '"Dispõe sobre denominação de via"',
+                               siglas[i % 4]))
+            with db:
+                db.executemany('INSERT INTO pareceres (pdf_name, docx_name, numero_projeto, data_geracao, gerado_em, '
+                               'tipo_projeto, ementa, comissao) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', linhas)
+            meio = db.execute('SELECT id FROM pareceres ORDER BY id LIMIT 1 OFFSET ?', (tamanho // 2,)).fetchone()[0]
+        inseridos = tamanho
+
+        def pagina(url):
+            resposta = cliente.get(url)
+            assert resposta.status_code == 200, (url, resposta.status_code)
+
+        resultados[f'{tamanho}_linhas'] = {
+            'primeira_pagina': medir(lambda: pagina('/'), iteracoes),
+            'pagina_do_meio': medir(lambda: pagina(f'/?antes={meio}'), iteracoes),
+            'busca_texto': medir(lambda: pagina('/?q=credito+adicional'), iteracoes),
+            'filtro_comissao_data': medir(
+                lambda: pagina('/?comissao=CFO&data_inicio=2025-03-10&data_fim=2025-03-12'), iteracoes),
+            'api_numero': medir(lambda: pagina('/api/historico?numero_projeto=45/2025'), iteracoes),
+        }
+    return resultados
+
+
+# --- RELATÓRIO ---
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def achatar(resultados, prefixo=''):
+    """{'a': {'b': {'p50_ms': ..}}} -> {'a.b': {...}}, só com as medidas."""
+    planos = {}
+    for chave, valor in resultados.items():
+        if isinstance(valor, dict) and 'p50_ms' in valor:
+            planos[prefixo + chave] = valor
+        elif isinstance(valor, dict):
+            planos.update(achatar(valor, f'{prefixo}{chave}.'))
+    return planos
+
+
+def comparar(atual, anterior):
+    """p50 atual / p50 anterior de cada medida presente nos dois relatórios (>1 = mais lento)."""
+    antes = achatar(anterior['resultados'])
+    depois = achatar(atual['resultados'])
+    return {
+        chave: {'p50_antes_ms': antes[chave]['p50_ms'], 'p50_depois_ms': depois[chave]['p50_ms'],
+                'razao': round(depois[chave]['p50_ms'] / antes[chave]['p50_ms'], 2) if antes[chave]['p50_ms'] else None}
+        for chave in depois if chave in antes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da extração, renderização, /gerar e histórico.')
+    parser.add_argument('--cenarios', default='extracao,render,gerar,historico',
+                        help='Lista separada por vírgulas.')
+    parser.add_argument('--paginas', default='1,10,100,500', help='Tamanhos dos PDFs sintéticos.')
+    parser.add_argument('--historico', default='10000,100000', help='Linhas em pareceres.')
+    parser.add_argument('--iteracoes', type=int, default=20)
+    parser.add_argument('--rapido', action='store_true', help='PDFs de até 50 páginas, histórico de 10 mil, 5 iterações.')
+    parser.add_argument('--saida', help='Grava o JSON neste arquivo (além de imprimir).')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar os p50.')
+    args = parser.parse_args()
+
+    cenarios = {c.strip() for c in args.cenarios.split(',') if c.strip()}
+    paginas = [int(n) for n in args.paginas.split(',')]
+    historico = [int(n) for n in args.historico.split(',')]
+    iteracoes = args.iteracoes
+    if args.rapido:
+        paginas = [n for n in paginas if n <= 50] or [1]
+        historico = [10000]
+        iteracoes = 5
+
+    resultados = {}
+    # As mensagens de progresso do app (prints) não entram no JSON
+    with contextlib.redirect_stdout(io.StringIO()):
+        cliente = preparar_app()
+        if 'extracao' in cenarios:
+            resultados['extracao'] = bench_extracao(paginas, iteracoes)
+        if 'render' in cenarios:
+            resultados['render'] = bench_render(iteracoes)
+        if 'gerar' in cenarios:
+            resultados['gerar'] = bench_gerar(cliente, iteracoes)
+        if 'historico' in cenarios:
+            resultados['historico'] = bench_historico(cliente, historico, iteracoes)
+
+    relatorio = {
+        'commit': commit_atual(),
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pymupdf': fitz.VersionBind,
+        'plataforma': platform.platform(),
+        'iteracoes': iteracoes,
+        'resultados': resultados,
+    }
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            relatorio['comparacao'] = comparar(relatorio, json.load(f))
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+# benchmarks/loadtest.py - TESTE DE CARGA COM VÁRIOS SERVIDORES AO MESMO TEMPO
+#
+# Simula N servidores da Câmara ("escrivães") usando o sistema ao mesmo tempo.
+# Cada um faz login e repete a sessão de trabalho:
+#   1. envia um PDF sintético de projeto de lei (/upload);
+#   2. gera os pareceres (/gerar) de um sorteio das comissões habilitadas,
+#      com relator e número do parecer também sorteados;
+#   3. folheia o histórico (/ e os links "Mais antigos");
+#   4. baixa os arquivos gerados (/download/...).
+#
+# No final, para cada endpoint: vazão (req/s), percentis de latência (ms),
+# erros e a taxa de erros "database is locked" do SQLite, em JSON.
+#
+# Dois modos:
+#   - local (padrão): o app roda neste processo, pelo test client do Flask,
+#     com um banco e pastas temporários (database.db não é tocado). Os
+#     escrivães são threads; o GIL limita a vazão, mas a disputa pelo SQLite
+#     é a real.
+#
+#         python benchmarks/loadtest.py --escrivaes 8 --sessoes 10
+#
+#   - http: contra um servidor já rodando, por exemplo um gunicorn local
+#     apontado para um banco de teste com um usuário criado:
+#
+#         DATABASE=/tmp/carga.db flask init-db
+#         DATABASE=/tmp/carga.db flask create-admin carga carga
+#         DATABASE=/tmp/carga.db gunicorn -w 4 -c gunicorn.conf.py app:app
+#         python benchmarks/loadtest.py --url http://127.0.0.1:8000 \
+#             --usuario carga --senha carga --escrivaes 16 --duracao 60
+#
+# Com TAREFAS_ASSINCRONAS=1 no servidor, /upload e /gerar viram tarefas: o
+# escrivão espera cada uma terminar, e o tempo medido inclui a fila.
+
+import argparse
+import html
+import http.cookiejar
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import fitz
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PARAGRAFO_ANEXO = (
+    "Art. {n}. Fica o Poder Executivo autorizado a abrir crédito adicional especial "
+    "no valor de R$ {n}.000,00 para atender às despesas do programa de trabalho indicado.\n"
+)
+
+# Estado de cada thread: o endpoint em andamento (para atribuir os logs do app)
+atual = threading.local()
+
+
+# --- ENTRADAS SINTÉTICAS ---
+def criar_pdf_projeto(numero, paginas):
+    """Bytes do PDF de um projeto de lei com o número dado (cada sessão tem um PDF diferente)."""
+    pdf = fitz.open()
+    pagina = pdf.new_page()
+    texto = (f"CÂMARA MUNICIPAL\nPROJETO DE LEI ORDINÁRIA Nº {numero}/2025\n10 de março de 2025\n"
+             '"Abre crédito adicional especial no Orçamento Anual e dá outras providências"\n')
+    texto += ''.join(PARAGRAFO_ANEXO.format(n=n) for n in range(1, 4))
+    pagina.insert_textbox(fitz.Rect(50, 50, 545, 790), texto, fontsize=11)
+    for p in range(1, paginas):
+        pagina = pdf.new_page()
+        corpo = ''.join(PARAGRAFO_ANEXO.format(n=p * 10 + n) for n in range(8))
+        pagina.insert_textbox(fitz.Rect(50, 50, 545, 790), corpo, fontsize=10)
+    conteudo = pdf.tobytes(garbage=3, deflate=True)
+    pdf.close()
+    return conteudo
+
+
+# --- CLIENTES ---
+class Resposta:
+    def __init__(self, status, corpo, caminho):
+        self.status = status
+        self.corpo = corpo
+        self.caminho = caminho  # caminho final, depois dos redirecionamentos
+
+    @property
+    def texto(self):
+        return self.corpo.decode('utf-8', errors='replace')
+
+
+class ClienteLocal:
+    """Usa o test client do Flask (um por escrivão, cada um com a sua sessão)."""
+
+    def __init__(self, aplicacao):
+        self.cliente = aplicacao.app.test_client()
+
+    def get(self, caminho):
+        r = self.cliente.get(caminho, follow_redirects=True)
+        return Resposta(r.status_code, r.get_data(), r.request.path)
+
+    def post(self, caminho, dados, arquivo=None):
+        if arquivo:
+            nome, conteudo = arquivo
+            dados = dict(dados, file=(io.BytesIO(conteudo), nome))
+        r = self.cliente.post(caminho, data=dados, follow_redirects=True,
+                              content_type='multipart/form-data' if arquivo else None)
+        return Resposta(r.status_code, r.get_data(), r.request.path)
+
+
+class ClienteHttp:
+    """Fala HTTP de verdade com um servidor (urllib, com cookies próprios por escrivão)."""
+
+    def __init__(self, url_base, timeout=300):
+        self.url_base = url_base.rstrip('/')
+        self.timeout = timeout
+        self.abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def _abrir(self, requisicao):
+        try:
+            with self.abridor.open(requisicao, timeout=self.timeout) as r:
+                return Resposta(r.status, r.read(), urllib.parse.urlsplit(r.geturl()).path)
+        except urllib.error.HTTPError as e:
+            return Resposta(e.code, e.read(), urllib.parse.urlsplit(e.geturl()).path)
+
+    def get(self, caminho):
+        return self._abrir(urllib.request.Request(self.url_base + caminho))
+
+    def post(self, caminho, dados, arquivo=None):
+        itens = [(k, v) for k, valores in dados.items()
+                 for v in (valores if isinstance(valores, list) else [valores])]
+        if arquivo is None:
+            corpo = urllib.parse.urlencode(itens).encode('utf-8')
+            tipo = 'application/x-www-form-urlencoded'
+        else:
+            fronteira = uuid.uuid4().hex
+            partes = []
+            for k, v in itens:
+                partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'
+                              .encode('utf-8'))
+            nome, conteudo = arquivo
+            partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="file"; filename="{nome}"\r\n'
+                          f'Content-Type: application/pdf\r\n\r\n'.encode('utf-8') + conteudo + b'\r\n')
+            partes.append(f'--{fronteira}--\r\n'.encode('utf-8'))
+            corpo = b''.join(partes)
+            tipo = f'multipart/form-data; boundary={fronteira}'
+        return self._abrir(urllib.request.Request(self.url_base + caminho, data=corpo,
+                                                  headers={'Content-Type': tipo}))
+
+
+# --- MEDIÇÃO ---
+def percentil(valores, p):
+    """Percentil pelo método do posto mais próximo (valores já ordenados)."""
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[indice]
+
+
+class Registro:
+    """Latências e erros por endpoint, de todas as threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tempos = {}       # endpoint -> [ms]
+        self.erros = {}        # endpoint -> quantidade
+        self.travados = {}     # endpoint -> respostas/logs com "database is locked"
+        self.exemplos = {}     # endpoint -> primeira mensagem de erro
+
+    def anotar(self, endpoint, ms, erro=None, travado=False):
+        with self._lock:
+            self.tempos.setdefault(endpoint, []).append(ms)
+            if erro:
+                self.erros[endpoint] = self.erros.get(endpoint, 0) + 1
+                self.exemplos.setdefault(endpoint, erro[:300])
+        if travado:
+            self.anotar_travado(endpoint)
+
+    def anotar_travado(self, endpoint):
+        with self._lock:
+            self.travados[endpoint] = self.travados.get(endpoint, 0) + 1
+
+    def relatorio(self, duracao):
+        saida = {}
+        for endpoint, tempos in sorted(self.tempos.items()):
+            tempos = sorted(tempos)
+            total = len(tempos)
+            saida[endpoint] = {
+                'requisicoes': total,
+                'req_por_segundo': round(total / duracao, 2),
+                'p50_ms': round(percentil(tempos, 50), 1),
+                'p90_ms': round(percentil(tempos, 90), 1),
+                'p99_ms': round(percentil(tempos, 99), 1),
+                'max_ms': round(tempos[-1], 1),
+                'erros': self.erros.get(endpoint, 0),
+                'database_is_locked': self.travados.get(endpoint, 0),
+                'taxa_database_is_locked': round(self.travados.get(endpoint, 0) / total, 4),
+            }
+            if endpoint in self.exemplos:
+                saida[endpoint]['exemplo_de_erro'] = self.exemplos[endpoint]
+        return saida
+
+
+class ContadorDeTravamentos(logging.Handler):
+    """
+    Handler de log (modo local): conta os 'database is locked' que o app
+    trata e só registra no log (ex: a extração, que devolve {} numa falha).
+    """
+
+    def __init__(self, registro):
+        super().__init__()
+        self.registro = registro
+
+    def emit(self, record):
+        texto = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            texto += str(record.exc_info[1])
+        if 'database is locked' in texto:
+            self.registro.anotar_travado(getattr(atual, 'endpoint', 'outro'))
+
+
+# --- SESSÃO DE UM ESCRIVÃO ---
+def medir(registro, endpoint, funcao, volta_ao_inicio_e_erro=False):
+    """
+    Roda uma requisição, anota o tempo e devolve a resposta (ou None se falhou).
+    Com 'volta_ao_inicio_e_erro', terminar na página inicial (o app avisa a
+    falha com um flash e redireciona) também conta como erro.
+    """
+    atual.endpoint = endpoint
+    inicio = time.perf_counter()
+    try:
+        resposta = funcao()
+    except Exception as e:
+        registro.anotar(endpoint, (time.perf_counter() - inicio) * 1000, erro=f'{type(e).__name__}: {e}',
+                        travado='database is locked' in str(e))
+        return None
+    ms = (time.perf_counter() - inicio) * 1000
+    travado = b'database is locked' in resposta.corpo
+    erro = None
+    if resposta.status != 200:
+        erro = f'HTTP {resposta.status} em {resposta.caminho}'
+    elif travado:
+        erro = 'database is locked'
+    elif volta_ao_inicio_e_erro and resposta.caminho == '/':
+        aviso = re.search(r'<ul class="flashes">\s*<li>(.*?)</li>', resposta.texto, re.S)
+        erro = html.unescape(aviso.group(1)).strip() if aviso else 'Voltou para a página inicial.'
+    registro.anotar(endpoint, ms, erro=erro, travado=travado)
+    return resposta if erro is None else None
+
+
+def aguardar_tarefa(cliente, resposta, intervalo=0.2, limite=300):
+    """Com tarefas assíncronas, a resposta é a página de espera: acompanha até o resultado."""
+    encontrado = re.fullmatch(r'/tarefa/(\d+)', resposta.caminho)
+    if not encontrado:
+        return resposta
+    tarefa_id = encontrado.group(1)
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        status = json.loads(cliente.get(f'/tarefa/{tarefa_id}/status').corpo)
+        if status.get('status') in ('concluida', 'erro'):
+            return cliente.get(f'/tarefa/{tarefa_id}/resultado')
+        time.sleep(intervalo)
+    raise TimeoutError(f'Tarefa {tarefa_id} não terminou em {limite}s.')
+
+
+def valor_do_campo(pagina, nome):
+    encontrado = re.search(r'<input[^>]*name="%s"[^>]*value="([^"]*)"' % re.escape(nome), pagina)
+    return html.unescape(encontrado.group(1)) if encontrado else ''
+
+
+def ler_formulario_revisao(pagina):
+    """Campos do formulário de revisão e, por comissão habilitada, os ids dos membros (relatores possíveis)."""
+    dados = {nome: valor_do_campo(pagina, nome)
+             for nome in ('pdf_filename', 'pdf_sha256', 'tipo_projeto', 'numero_projeto', 'data_projeto')}
+    ementa = re.search(r'<textarea[^>]*name="ementa"[^>]*>(.*?)</textarea', pagina, re.S)
+    dados['ementa'] = html.unescape(ementa.group(1)).strip() if ementa else ''
+    habilitadas = [re.search(r'value="([^"]+)"', atributos).group(1)
+                   for atributos in re.findall(r'<input([^>]*)>', pagina)
+                   if 'name="comissao_selecionada"' in atributos and 'disabled' not in atributos]
+    relatores = {sigla: re.findall(r'<option value="(\d+)"', opcoes)
+                 for sigla, opcoes in re.findall(r'<select[^>]*name="relator_(\w+)"[^>]*>(.*?)</select>', pagina, re.S)}
+    return dados, {sigla: relatores.get(sigla, []) for sigla in habilitadas if relatores.get(sigla)}
+
+
+def sessao(cliente, registro, sorteio, numero, args):
+    """Uma volta completa de trabalho: upload, geração, histórico e downloads."""
+    pdf = criar_pdf_projeto(numero, args.paginas)
+    resposta = medir(registro, 'upload', lambda: aguardar_tarefa(
+        cliente, cliente.post('/upload', {}, arquivo=(f'pl_{numero}.pdf', pdf))), volta_ao_inicio_e_erro=True)
+    if resposta is None:
+        return
+    dados, comissoes = ler_formulario_revisao(resposta.texto)
+    if not comissoes:
+        registro.anotar('upload', 0, erro='Tela de revisão sem comissões habilitadas.')
+        return
+
+    siglas = sorteio.sample(sorted(comissoes), sorteio.randint(1, len(comissoes)))
+    formulario = dict(dados, autoria='Chefe do Executivo', data_protocolo='2025-03-11',
+                      data_parecer=f'2025-03-{sorteio.randint(12, 28)}', comissao_selecionada=siglas)
+    formulario['numero_projeto'] = formulario['numero_projeto'] or f'{numero:03d}/2025'
+    for sigla in siglas:
+        formulario[f'relator_{sigla}'] = sorteio.choice(comissoes[sigla])
+        formulario[f'num_parecer_{sigla}'] = str(sorteio.randint(1, 999))
+    if sorteio.random() < args.fracao_pdf:
+        formulario['gerar_pdf'] = 'true'
+    resposta = medir(registro, 'gerar', lambda: aguardar_tarefa(cliente, cliente.post('/gerar', formulario)),
+                     volta_ao_inicio_e_erro=True)
+    downloads = re.findall(r'href="(/download/[^"]+)"', resposta.texto) if resposta else []
+
+    caminho = '/'
+    for _ in range(args.paginas_historico):
+        pagina = medir(registro, 'historico', lambda: cliente.get(caminho))
+        mais_antigos = re.search(r'href="([^"]*antes=[^"]*)"[^>]*>Mais antigos', pagina.texto) if pagina else None
+        if not mais_antigos:
+            break
+        caminho = html.unescape(mais_antigos.group(1))
+
+    for link in downloads[:args.downloads]:
+        medir(registro, 'download', lambda: cliente.get(html.unescape(link)))
+
+
+def escrivao(indice, criar_cliente, registro, args, prazo, numeros):
+    sorteio = random.Random(args.semente + indice)
+    cliente = criar_cliente()
+    if medir(registro, 'login', lambda: cliente.post('/login', {'username': args.usuario,
+                                                               'password': args.senha})) is None:
+        return
+    feitas = 0
+    while (feitas < args.sessoes) if prazo is None else (time.monotonic() < prazo):
+        sessao(cliente, registro, sorteio, next(numeros), args)
+        feitas += 1
+
+
+# --- PREPARAÇÃO DO MODO LOCAL ---
+def preparar_local(args):
+    """Importa o app com banco e pastas temporários, cria o usuário e um histórico inicial."""
+    pasta = tempfile.mkdtemp(prefix='loadtest_')
+    os.environ['DATABASE'] = os.path.join(pasta, 'carga.db')
+    sys.path.insert(0, RAIZ)
+    import app as aplicacao
+    from armazenamento import ArmazemPorConteudo
+
+    aplicacao.app.config['GENERATED_FOLDER'] = os.path.join(pasta, 'generated')
+    aplicacao.app.config['UPLOAD_FOLDER'] = os.path.join(pasta, 'uploads')
+    os.makedirs(aplicacao.app.config['GENERATED_FOLDER'], exist_ok=True)
+    aplicacao.armazem_pdfs = ArmazemPorConteudo(aplicacao.app.config['UPLOAD_FOLDER'])
+
+    runner = aplicacao.app.test_cli_runner()
+    runner.invoke(args=['init-db'])
+    runner.invoke(args=['create-admin', args.usuario, args.senha])
+    with aplicacao.app.app_context():
+        db = aplicacao.get_db()
+        with db:
+            db.executemany(
+                'INSERT INTO pareceres (pdf_name, docx_name, numero_projeto, data_geracao, gerado_em, comissao) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(f'pl{i}.pdf', f'PLOE {i}_2024 CJR.docx', f'{i:03d}/2024', '01/01/2024 10:00:00',
+                  '2024-01-01T10:00:00', 'CJR') for i in range(args.historico)])
+    return aplicacao
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga: vários escrivães usando o app ao mesmo tempo.')
+    parser.add_argument('--url', help='Servidor já rodando (ex: http://127.0.0.1:8000). Sem isso, modo local.')
+    parser.add_argument('--usuario', default='carga')
+    parser.add_argument('--senha', default='carga')
+    parser.add_argument('--escrivaes', type=int, default=4, help='Usuários simultâneos (threads).')
+    parser.add_argument('--sessoes', type=int, default=5, help='Sessões por escrivão (ignorado com --duracao).')
+    parser.add_argument('--duracao', type=float, default=0, help='Segundos de carga (0 = usar --sessoes).')
+    parser.add_argument('--paginas', type=int, default=3, help='Páginas de cada PDF sintético.')
+    parser.add_argument('--paginas-historico', type=int, default=3, help='Páginas do histórico folheadas por sessão.')
+    parser.add_argument('--downloads', type=int, default=2, help='Arquivos baixados por sessão.')
+    parser.add_argument('--fracao-pdf', type=float, default=0.0, help='Fração das gerações que pedem PDF.')
+    parser.add_argument('--historico', type=int, default=1000, help='Pareceres pré-existentes (modo local).')
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--saida', help='Grava o JSON neste arquivo (além de imprimir).')
+    args = parser.parse_args()
+
+    registro = Registro()
+    if args.url:
+        def criar_cliente():
+            return ClienteHttp(args.url)
+    else:
+        aplicacao = preparar_local(args)
+        logging.getLogger('legistech').addHandler(ContadorDeTravamentos(registro))
+
+        def criar_cliente():
+            return ClienteLocal(aplicacao)
+
+    # Números de projeto únicos: cada sessão gera pareceres novos (inserts em
+    # 'pareceres'). next() num itertools.count é atômico entre threads.
+    numeros = itertools.count(1)
+    prazo = time.monotonic() + args.duracao if args.duracao > 0 else None
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=escrivao, args=(i, criar_cliente, registro, args, prazo, numeros))
+               for i in range(args.escrivaes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    resultado = {
+        'modo': 'http' if args.url else 'local',
+        'url': args.url,
+        'escrivaes': args.escrivaes,
+        'duracao_s': round(duracao, 2),
+        'paginas_por_pdf': args.paginas,
+        'endpoints': registro.relatorio(duracao),
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+
+
+if __name__ == '__main__':
+    main()
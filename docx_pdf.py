@@ -0,0 +1,250 @@
+# docx_pdf.py - CONVERSÃO DO PARECER (.docx) PARA PDF, SEM PACOTE OFFICE
+#
+# O docx.Document já preenchido é traduzido para um HTML simples (parágrafos,
+# alinhamento, recuo, negrito/itálico/sublinhado, tamanho da fonte, tabelas e
+# imagens) e diagramado pelo PyMuPDF (fitz.Story) no tamanho de página e nas
+# margens da primeira seção do documento. O timbre (imagem de fundo do
+# cabeçalho) é desenhado atrás do texto em todas as páginas.
+
+import html
+import io
+import re
+
+import fitz
+from docx.oxml.ns import qn
+
+W_P = qn('w:p')
+W_TBL = qn('w:tbl')
+W_R = qn('w:r')
+W_T = qn('w:t')
+W_TAB = qn('w:tab')
+W_BR = qn('w:br')
+W_TR = qn('w:tr')
+W_TC = qn('w:tc')
+W_DRAWING = qn('w:drawing')
+A_BLIP = qn('a:blip')
+R_EMBED = qn('r:embed')
+R_ID = qn('r:id')
+WP_EXTENT = qn('wp:extent')
+WP_ANCHOR = qn('wp:anchor')
+V_SHAPE = '{urn:schemas-microsoft-com:vml}shape'
+V_IMAGEDATA = '{urn:schemas-microsoft-com:vml}imagedata'
+
+EMU_POR_PT = 12700
+ALINHAMENTOS = {'center': 'center', 'right': 'right', 'both': 'justify', 'distribute': 'justify'}
+TAMANHO_PADRAO_PT = 12
+
+CSS_BASE = """
+* { font-family: sans-serif; }
+p { margin: 0; }
+table { border-collapse: collapse; width: 100%; }
+td { border: 1px solid black; padding: 2pt; vertical-align: top; }
+"""
+
+
+def _ligado(elemento):
+    """Valor de uma propriedade liga/desliga (<w:b/>, <w:i w:val="0"/>...)."""
+    return elemento is not None and elemento.val
+
+
+def _paragrafo_dono(no):
+    pai = no.getparent()
+    while pai is not None and pai.tag != W_P:
+        pai = pai.getparent()
+    return pai
+
+
+def _familia(nome_fonte):
+    """Só as famílias genéricas vêm embutidas no MuPDF; 'Arial' etc. viram sans-serif."""
+    nome = (nome_fonte or '').lower()
+    if 'times' in nome or 'garamond' in nome or 'georgia' in nome:
+        return 'serif'
+    if 'courier' in nome or 'mono' in nome:
+        return 'monospace'
+    return 'sans-serif'
+
+
+class _ConversorHtml:
+    """Converte o corpo (ou um cabeçalho/rodapé) de um docx em HTML para o fitz.Story."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.archive = fitz.Archive()
+        self._imagens = 0
+        normal = doc.styles['Normal']
+        self.tamanho_padrao = normal.font.size.pt if normal.font.size else TAMANHO_PADRAO_PT
+        self.fonte_padrao = normal.font.name
+
+    def converter(self, elemento, parte):
+        pedacos = []
+        for filho in elemento.iterchildren():
+            if filho.tag == W_P:
+                pedacos.append(self._paragrafo(filho, parte))
+            elif filho.tag == W_TBL:
+                pedacos.append(self._tabela(filho, parte))
+        return ''.join(pedacos)
+
+    def _tabela(self, tbl, parte):
+        linhas = []
+        for tr in tbl.iter(W_TR):
+            celulas = ''.join(f'<td>{self.converter(tc, parte)}</td>' for tc in tr.iterchildren(W_TC))
+            linhas.append(f'<tr>{celulas}</tr>')
+        return f"<table>{''.join(linhas)}</table>"
+
+    def _paragrafo(self, p, parte):
+        estilos = []
+        ppr = p.pPr
+        if ppr is not None:
+            if ppr.jc is not None and ppr.jc.get(qn('w:val')) in ALINHAMENTOS:
+                estilos.append(f"text-align: {ALINHAMENTOS[ppr.jc.get(qn('w:val'))]}")
+            if ppr.first_line_indent is not None:
+                estilos.append(f'text-indent: {ppr.first_line_indent.pt:.1f}pt')
+            if ppr.ind_left is not None:
+                estilos.append(f'margin-left: {ppr.ind_left.pt:.1f}pt')
+            if ppr.spacing_before is not None:
+                estilos.append(f'margin-top: {ppr.spacing_before.pt:.1f}pt')
+            if ppr.spacing_after is not None:
+                estilos.append(f'margin-bottom: {ppr.spacing_after.pt:.1f}pt')
+
+        # Runs deste parágrafo (inclusive dentro de hyperlinks), sem os de caixas de texto aninhadas
+        conteudo = ''.join(self._run(r, parte) for r in p.iter(W_R) if _paragrafo_dono(r) is p)
+        if not conteudo.strip():
+            conteudo = '&#160;'  # parágrafo vazio ainda ocupa uma linha
+        estilo = f' style="{"; ".join(estilos)}"' if estilos else ''
+        return f'<p{estilo}>{conteudo}</p>'
+
+    def _run(self, r, parte):
+        textos = []
+        for filho in r.iterchildren():
+            if filho.tag == W_T:
+                textos.append(html.escape(filho.text or ''))
+            elif filho.tag == W_TAB:
+                textos.append('&#160;' * 8)
+            elif filho.tag == W_BR:
+                textos.append('<br/>')
+            elif filho.tag == W_DRAWING and filho.find('.//' + WP_ANCHOR) is None:
+                textos.append(self._imagem_inline(filho, parte))
+        texto = ''.join(textos)
+        if not texto:
+            return ''
+
+        rpr = r.rPr
+        tamanho = rpr.sz_val.pt if rpr is not None and rpr.sz_val is not None else self.tamanho_padrao
+        fonte = rpr.rFonts_ascii if rpr is not None and rpr.rFonts_ascii else self.fonte_padrao
+        texto = f'<span style="font-size: {tamanho:g}pt; font-family: {_familia(fonte)}">{texto}</span>'
+        if rpr is not None:
+            if _ligado(rpr.b):
+                texto = f'<b>{texto}</b>'
+            if _ligado(rpr.i):
+                texto = f'<i>{texto}</i>'
+            if rpr.u_val not in (None, False) and str(rpr.u_val).lower() not in ('none', 'false'):
+                texto = f'<u>{texto}</u>'
+        return texto
+
+    def _imagem_inline(self, drawing, parte):
+        blip = drawing.find('.//' + A_BLIP)
+        extent = drawing.find('.//' + WP_EXTENT)
+        if blip is None or extent is None or blip.get(R_EMBED) not in parte.rels:
+            return ''
+        self._imagens += 1
+        nome = f'img{self._imagens}'
+        self.archive.add(parte.related_parts[blip.get(R_EMBED)].blob, nome)
+        largura = int(extent.get('cx')) / EMU_POR_PT
+        altura = int(extent.get('cy')) / EMU_POR_PT
+        return f'<img src="{nome}" width="{largura:.0f}" height="{altura:.0f}"/>'
+
+
+def _tamanho_vml(estilo):
+    """Lê 'width' e 'height' (em pt) do atributo style de um v:shape."""
+    medidas = dict(re.findall(r'(width|height):([\d.]+)pt', estilo))
+    if 'width' in medidas and 'height' in medidas:
+        return float(medidas['width']), float(medidas['height'])
+    return None
+
+
+def imagens_de_fundo(secao):
+    """
+    Imagens posicionadas em relação à página dentro do cabeçalho (o timbre).
+    Devolve [(blob, largura_pt, altura_pt)]; são centralizadas na página.
+    """
+    imagens = []
+    if secao.header.is_linked_to_previous:
+        return imagens
+    parte = secao.header.part
+    for shape in parte.element.iter(V_SHAPE):
+        imagedata = shape.find(V_IMAGEDATA)
+        medidas = _tamanho_vml(shape.get('style', ''))
+        if imagedata is None or medidas is None or imagedata.get(R_ID) not in parte.rels:
+            continue
+        imagens.append((parte.related_parts[imagedata.get(R_ID)].blob, *medidas))
+    for anchor in parte.element.iter(WP_ANCHOR):
+        blip = anchor.find('.//' + A_BLIP)
+        extent = anchor.find(WP_EXTENT)
+        if blip is None or extent is None or blip.get(R_EMBED) not in parte.rels:
+            continue
+        imagens.append((parte.related_parts[blip.get(R_EMBED)].blob,
+                        int(extent.get('cx')) / EMU_POR_PT, int(extent.get('cy')) / EMU_POR_PT))
+    return imagens
+
+
+def _texto_da_parte(elemento):
+    return ''.join(t.text or '' for t in elemento.iter(W_T)).strip()
+
+
+def salvar_pdf(doc, caminho_saida, titulo=None, autor=None):
+    """Diagrama o docx.Document (já preenchido) e grava o PDF em 'caminho_saida'."""
+    secao = doc.sections[0]
+    largura, altura = secao.page_width.pt, secao.page_height.pt
+    pagina = fitz.Rect(0, 0, largura, altura)
+    corpo = fitz.Rect(secao.left_margin.pt, secao.top_margin.pt,
+                      largura - secao.right_margin.pt, altura - secao.bottom_margin.pt)
+
+    conversor = _ConversorHtml(doc)
+    html_corpo = conversor.converter(doc.element.body, doc.part)
+
+    # Cabeçalho e rodapé com texto (o timbre é tratado à parte, como fundo)
+    faixas = []
+    for parte_hf, area in (
+        (secao.header, fitz.Rect(corpo.x0, secao.header_distance.pt, corpo.x1, corpo.y0)),
+        (secao.footer, fitz.Rect(corpo.x0, corpo.y1, corpo.x1, altura - secao.footer_distance.pt)),
+    ):
+        if not parte_hf.is_linked_to_previous and _texto_da_parte(parte_hf._element):
+            faixas.append((conversor.converter(parte_hf._element, parte_hf.part), area))
+
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    story = fitz.Story(html=html_corpo, user_css=CSS_BASE, em=conversor.tamanho_padrao,
+                       archive=conversor.archive)
+    mais = True
+    while mais:
+        dispositivo = writer.begin_page(pagina)
+        mais, _ = story.place(corpo)
+        story.draw(dispositivo)
+        for html_faixa, area in faixas:
+            faixa = fitz.Story(html=html_faixa, user_css=CSS_BASE, em=conversor.tamanho_padrao,
+                               archive=conversor.archive)
+            faixa.place(area)
+            faixa.draw(dispositivo)
+        writer.end_page()
+    writer.close()
+
+    pdf = fitz.open('pdf', buffer.getvalue())
+    try:
+        fundos = imagens_de_fundo(secao)
+        xrefs = {}
+        for pagina_pdf in pdf:
+            for i, (blob, largura_img, altura_img) in enumerate(fundos):
+                x0 = (largura - largura_img) / 2
+                y0 = (altura - altura_img) / 2
+                area = fitz.Rect(x0, y0, x0 + largura_img, y0 + altura_img)
+                # A imagem é gravada uma única vez e reaproveitada nas demais páginas
+                if i in xrefs:
+                    pagina_pdf.insert_image(area, xref=xrefs[i], overlay=False)
+                else:
+                    xrefs[i] = pagina_pdf.insert_image(area, stream=blob, overlay=False)
+        pdf.set_metadata({'title': titulo or '', 'author': autor or '', 'creator': 'LegisTech',
+                          'producer': f'PyMuPDF {fitz.VersionBind}'})
+        pdf.save(caminho_saida, garbage=3, deflate=True)
+    finally:
+        pdf.close()
+    return caminho_saida
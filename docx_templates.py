@@ -0,0 +1,288 @@
+# docx_templates.py - COMPILADOR DE TEMPLATES DOCX
+#
+# Em vez de varrer todos os parágrafos procurando cada chave do 'contexto'
+# a cada geração, o template é analisado UMA vez: guardamos quais nós de texto
+# (<w:t>) contêm placeholders {{CHAVE}} e como reescrevê-los. A renderização
+# depois só toca esses nós, numa única passada.
+
+import copy
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import docx
+from docx.oxml.ns import qn
+
+PADRAO_PLACEHOLDER = re.compile(r"\{\{[A-Z0-9_]+\}\}")
+
+# Partes do pacote que podem conter placeholders: corpo, cabeçalhos e rodapés.
+PADRAO_PARTES = re.compile(r"^/word/(document|header\d*|footer\d*)\.xml$")
+
+W_P = qn('w:p')
+W_T = qn('w:t')
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+
+class TemplateCompilado:
+    """
+    Resultado da compilação de um template .docx.
+
+    'slots' é uma lista de (nome_da_parte, indice_do_w:t, pedacos), onde
+    'pedacos' é a sequência de textos literais e chaves ({{CHAVE}}) que
+    formam o novo conteúdo daquele nó. O índice é a posição do <w:t> na
+    ordem de documento da parte, o que permite aplicar os mesmos slots em
+    qualquer cópia do template.
+    """
+
+    def __init__(self, path, slots, placeholders):
+        self.path = path
+        self.slots = slots
+        self.placeholders = placeholders
+
+    def render(self, doc, contexto):
+        """Escreve os valores do 'contexto' nos slots de 'doc' (uma cópia do template)."""
+        partes = _partes_com_texto(doc)
+        nos_por_parte = {}
+        for nome_parte, indice, pedacos in self.slots:
+            nos = nos_por_parte.get(nome_parte)
+            if nos is None:
+                nos = list(partes[nome_parte].element.iter(W_T))
+                nos_por_parte[nome_parte] = nos
+
+            texto = "".join(
+                str(contexto[p]) if p in contexto and p in self.placeholders else p
+                for p in pedacos
+            )
+            no = nos[indice]
+            no.text = texto
+            if texto != texto.strip():
+                no.set(XML_SPACE, 'preserve')
+        return doc
+
+
+def _partes_com_texto(doc):
+    """Mapeia nome da parte -> parte, para corpo, cabeçalhos e rodapés."""
+    return {
+        str(parte.partname): parte
+        for parte in doc.part.package.iter_parts()
+        if PADRAO_PARTES.match(str(parte.partname)) and hasattr(parte, 'element')
+    }
+
+
+def _paragrafo_dono(no_t):
+    """Retorna o <w:p> mais próximo que contém o nó (ignora caixas de texto aninhadas)."""
+    pai = no_t.getparent()
+    while pai is not None and pai.tag != W_P:
+        pai = pai.getparent()
+    return pai
+
+
+def _compilar_parte(elemento):
+    """
+    Encontra os placeholders de uma parte e devolve [(indice, pedacos)].
+    Lida com placeholders quebrados em vários 'runs' (ex: '{{DATA_PROTOCOLO' + '}}').
+    """
+    nos = list(elemento.iter(W_T))
+    indice_de = {id(no): i for i, no in enumerate(nos)}
+
+    # Agrupa os nós de texto por parágrafo dono, preservando a ordem.
+    por_paragrafo = {}
+    for no in nos:
+        p = _paragrafo_dono(no)
+        por_paragrafo.setdefault(id(p), []).append(no)
+
+    slots = []
+    for nos_p in por_paragrafo.values():
+        textos = [no.text or "" for no in nos_p]
+        completo = "".join(textos)
+        if "{{" not in completo:
+            continue
+        matches = list(PADRAO_PLACEHOLDER.finditer(completo))
+        if not matches:
+            continue
+
+        # Posição inicial de cada nó dentro do texto completo do parágrafo
+        inicios = []
+        pos = 0
+        for t in textos:
+            inicios.append(pos)
+            pos += len(t)
+
+        def no_em(posicao):
+            # Último nó cujo início é <= posição (e que não está vazio)
+            for k in range(len(inicios) - 1, -1, -1):
+                if inicios[k] <= posicao and len(textos[k]) > 0:
+                    return k
+            return 0
+
+        # Para cada nó, monta a lista de pedaços (literais e chaves)
+        pedacos = [[] for _ in nos_p]
+        alterados = set()
+        cursor = 0
+        for m in matches:
+            k_ini = no_em(m.start())
+            k_fim = no_em(m.end() - 1)
+            # Texto literal antes do placeholder vai para os nós onde ele está
+            _distribuir_literal(completo, cursor, m.start(), inicios, textos, pedacos)
+            pedacos[k_ini].append(m.group(0))
+            alterados.update(range(k_ini, k_fim + 1))
+            cursor = m.end()
+        _distribuir_literal(completo, cursor, len(completo), inicios, textos, pedacos)
+
+        for k in sorted(alterados):
+            slots.append((indice_de[id(nos_p[k])], tuple(pedacos[k])))
+    return slots
+
+
+def _distribuir_literal(completo, ini, fim, inicios, textos, pedacos):
+    """Reparte o trecho literal [ini, fim) entre os nós de texto a que ele pertence."""
+    for k, inicio in enumerate(inicios):
+        a = max(ini, inicio)
+        b = min(fim, inicio + len(textos[k]))
+        if a < b:
+            pedacos[k].append(completo[a:b])
+
+
+def compilar_template(path, doc=None):
+    """Analisa o .docx em 'path' (ou o 'doc' já aberto) e devolve um TemplateCompilado."""
+    if doc is None:
+        doc = docx.Document(path)
+    slots = []
+    placeholders = set()
+    for nome_parte, parte in _partes_com_texto(doc).items():
+        for indice, pedacos in _compilar_parte(parte.element):
+            slots.append((nome_parte, indice, pedacos))
+            placeholders.update(p for p in pedacos if PADRAO_PLACEHOLDER.fullmatch(p))
+    return TemplateCompilado(path, slots, frozenset(placeholders))
+
+
+class CacheDeTemplates:
+    """
+    Cache em memória dos templates já abertos e compilados, por sigla.
+
+    Guarda uma cópia "mestre" do docx.Document de cada comissão e entrega
+    cópias profundas (deepcopy), que são bem mais baratas que descompactar e
+    reparsear o .docx a cada geração. O template é recarregado quando o mtime
+    (e o hash) do arquivo mudam. Quando o total estimado passa de 'max_bytes',
+    os templates usados há mais tempo são descartados (LRU).
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._versoes = {}  # path -> (mtime, size, sha256)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recargas = 0
+        self.descartes = 0
+
+    def _carregar(self, path, stat, sha256):
+        doc = docx.Document(path)
+        compilado = compilar_template(path, doc=doc)
+        # Estimativa de memória: tamanho do XML descompactado das partes
+        tamanho = sum(len(parte.blob) for parte in doc.part.package.iter_parts())
+        return {
+            'path': path,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': sha256,
+            'doc': doc,
+            'compilado': compilado,
+            'tamanho': tamanho,
+        }
+
+    def _entrada(self, sigla, path):
+        stat = os.stat(path)
+        with self._lock:
+            entrada = self._entradas.get(sigla)
+            if entrada is not None and entrada['path'] == path and (
+                    (entrada['mtime'], entrada['size']) == (stat.st_mtime, stat.st_size)):
+                self.hits += 1
+                self._entradas.move_to_end(sigla)
+                return entrada
+
+        # Hash e leitura do .docx fora do lock: enquanto uma comissão é
+        # (re)carregada, as outras continuam sendo servidas do cache.
+        sha256 = _hash_arquivo(path)
+        mesma = entrada is not None and entrada['path'] == path and entrada['sha256'] == sha256
+        if mesma:
+            # O mtime mudou, mas o conteúdo não: só atualiza a assinatura
+            nova = dict(entrada, mtime=stat.st_mtime, size=stat.st_size)
+        else:
+            nova = self._carregar(path, stat, sha256)
+
+        with self._lock:
+            if mesma:
+                self.hits += 1
+            else:
+                if entrada is not None:
+                    self.recargas += 1
+                self.misses += 1
+            # Duas threads podem ter carregado ao mesmo tempo: fica a última
+            self._entradas[sigla] = nova
+            self._entradas.move_to_end(sigla)
+            self._aplicar_limite()
+        return nova
+
+    def obter(self, sigla, path):
+        """Devolve (cópia do Document, TemplateCompilado) para a sigla."""
+        entrada = self._entrada(sigla, path)
+        # A cópia é feita fora do lock; o mestre nunca é alterado.
+        return copy.deepcopy(entrada['doc']), entrada['compilado']
+
+    def compilado(self, sigla, path):
+        """Só o TemplateCompilado da sigla (ex: para saber os placeholders), sem copiar o documento."""
+        return self._entrada(sigla, path)['compilado']
+
+    def versao(self, path):
+        """sha256 do arquivo do template, recalculado só quando o mtime ou o tamanho mudam."""
+        stat = os.stat(path)
+        with self._lock:
+            conhecida = self._versoes.get(path)
+        if conhecida is not None and conhecida[:2] == (stat.st_mtime, stat.st_size):
+            return conhecida[2]
+        sha256 = _hash_arquivo(path)
+        with self._lock:
+            self._versoes[path] = (stat.st_mtime, stat.st_size, sha256)
+        return sha256
+
+    def _aplicar_limite(self):
+        # Sempre mantém ao menos o template mais recente, mesmo acima do limite
+        while len(self._entradas) > 1 and self.tamanho_total() > self.max_bytes:
+            self._entradas.popitem(last=False)
+            self.descartes += 1
+
+    def tamanho_total(self):
+        return sum(e['tamanho'] for e in self._entradas.values())
+
+    def reiniciar_lock(self):
+        """Usado no processo filho depois de um fork (o lock pode ter sido copiado travado)."""
+        self._lock = threading.Lock()
+
+    def renderizar(self, sigla, path, contexto):
+        """Preenche uma cópia do template da sigla e devolve o docx.Document pronto para salvar."""
+        doc, compilado = self.obter(sigla, path)
+        return compilado.render(doc, contexto)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'recargas': self.recargas,
+                'descartes': self.descartes,
+                'templates': list(self._entradas.keys()),
+                'bytes': self.tamanho_total(),
+                'max_bytes': self.max_bytes,
+            }
+
+
+def _hash_arquivo(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
@@ -0,0 +1,251 @@
+# extrator.py - EXTRAÇÃO DOS CAMPOS DO PROJETO A PARTIR DO TEXTO DO PDF
+#
+# As regras de extração ficam num registro: cada regra tem uma regex já
+# compilada, uma prioridade e normalizadores (correções de OCR). Todas as
+# regras são procuradas numa ÚNICA passada pelo texto, e a varredura termina
+# assim que todas já foram encontradas.
+#
+# Para adicionar um campo novo basta registrar uma regra, por exemplo:
+#
+#     registrar_regra(RegraCampo(
+#         "AUTORIA", r"Autor(?:ia)?:\s*([^.]+)",
+#         extrair=lambda m: {"AUTORIA": m.group(1).strip()}))
+
+import hashlib
+import json
+import re
+
+
+class RegraCampo:
+    """
+    Uma regra de extração.
+
+    'extrair(match)' devolve um dicionário {campo: valor}; campos que começam
+    com '_' são auxiliares (usados pelos combinadores e não aparecem no
+    resultado final). 'confianca(match)' devolve um valor entre 0 e 1.
+    'inicio' (opcional) é uma regex de um caractere com os possíveis primeiros
+    caracteres da regra; com ele a varredura pula direto para posições candidatas.
+    Quando mais de uma regra produz o mesmo campo, vence a de maior
+    'prioridade' (no empate, a que aparece primeiro no texto).
+    """
+
+    def __init__(self, nome, padrao, extrair, prioridade=0, flags=re.IGNORECASE,
+                 normalizadores=(), confianca=None, inicio=None):
+        self.nome = nome
+        self.padrao = re.compile(padrao, flags)
+        if self.padrao.groupindex:
+            raise ValueError(f"Regra '{nome}': use grupos numerados, não nomeados.")
+        self.extrair = extrair
+        self.prioridade = prioridade
+        self.normalizadores = tuple(normalizadores)
+        self.confianca = confianca or (lambda match: 1.0)
+        self.inicio = inicio
+
+    def normalizar(self, valor):
+        """Aplica as correções de OCR; devolve (valor, houve_correcao)."""
+        original = valor
+        for errado, certo in self.normalizadores:
+            valor = valor.replace(errado, certo)
+        return valor, valor != original
+
+    def assinatura(self):
+        return [self.nome, self.padrao.pattern, self.padrao.flags, self.prioridade,
+                list(self.normalizadores), self.inicio]
+
+
+class ResultadoExtracao:
+    """Campos encontrados e, para cada um, a posição no texto, a regra e a confiança."""
+
+    def __init__(self):
+        self.dados = {}
+        self.detalhes = {}
+
+    def completo(self, campos):
+        return all(campo in self.dados for campo in campos)
+
+
+_regras = []
+_combinadores = []
+_padrao_combinado = None
+
+
+def registrar_regra(regra):
+    """Adiciona uma regra ao registro (invalida o padrão combinado)."""
+    global _padrao_combinado
+    _regras.append(regra)
+    _padrao_combinado = None
+    return regra
+
+
+def registrar_combinador(funcao):
+    """
+    Registra uma função 'funcao(detalhes) -> {campo: (valor, fontes)}' que monta
+    campos a partir de outros (ex: NUMERO_PROJETO = número + ano da data).
+    """
+    _combinadores.append(funcao)
+    return funcao
+
+
+def regras():
+    return list(_regras)
+
+
+def versao():
+    """Hash das regras registradas: muda sempre que uma regex, prioridade ou correção muda."""
+    assinatura = [r.assinatura() for r in _regras] + [f.__name__ for f in _combinadores]
+    return hashlib.sha256(json.dumps(assinatura, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def _obter_padrao_combinado():
+    """
+    Junta todas as regras num único padrão de lookaheads, um por regra.
+    Os lookaheads não consomem texto, então uma regra não "esconde" outra
+    que comece dentro do trecho que ela casou (ex: uma data dentro da ementa).
+    """
+    global _padrao_combinado
+    if _padrao_combinado is None:
+        alternativas = []
+        for i, regra in enumerate(_regras):
+            flags = ''.join(letra for flag, letra in ((re.IGNORECASE, 'i'), (re.DOTALL, 's'), (re.MULTILINE, 'm'))
+                            if regra.padrao.flags & flag)
+            corpo = f"(?{flags}:{regra.padrao.pattern})" if flags else f"(?:{regra.padrao.pattern})"
+            alternativas.append(f"(?=(?P<r{i}>{corpo}))")
+        padrao = '|'.join(alternativas)
+        # Se todas as regras dizem por onde começam, o motor de regex só tenta
+        # as alternativas nessas posições (bem mais rápido em textos longos).
+        if all(regra.inicio for regra in _regras):
+            padrao = f"(?={'|'.join(regra.inicio for regra in _regras)})(?:{padrao})"
+        _padrao_combinado = re.compile(padrao)
+    return _padrao_combinado
+
+
+def extrair(texto):
+    """Procura todas as regras numa única passada pelo texto e devolve um ResultadoExtracao."""
+    primeiros = {}  # indice da regra -> match (primeira ocorrência no texto)
+    _varrer(texto, primeiros)
+    return _montar(primeiros)
+
+
+class VarreduraIncremental:
+    """
+    Varredura de um texto que chega aos poucos (página a página): guarda as
+    regras já encontradas e procura as que faltam só na página nova, junto
+    com a anterior (para pegar o que atravessa a quebra de página). Cada
+    página é lida no máximo duas vezes, não o texto inteiro a cada página.
+    Serve para decidir quando parar de ler; os valores finais saem de
+    'extrair' no texto completo.
+    """
+
+    def __init__(self):
+        self._primeiros = {}
+        self._anterior = ''
+
+    def acrescentar(self, texto_pagina):
+        if not texto_pagina:
+            return
+        janela = f"{self._anterior} {texto_pagina}" if self._anterior else texto_pagina
+        _varrer(janela, self._primeiros)
+        self._anterior = texto_pagina
+
+    def completo(self, campos):
+        return _montar(self._primeiros).completo(campos)
+
+
+def _varrer(texto, primeiros):
+    """Acrescenta a 'primeiros' a primeira ocorrência de cada regra que ainda não está lá."""
+    if not _regras or len(primeiros) == len(_regras):
+        return
+    for m in _obter_padrao_combinado().finditer(texto):
+        posicao = m.start()
+        # Várias regras podem casar na mesma posição, mas a alternação só
+        # registra a primeira; por isso as pendentes são testadas aqui.
+        for i, regra in enumerate(_regras):
+            if i not in primeiros and (match := regra.padrao.match(texto, posicao)):
+                primeiros[i] = match
+        if len(primeiros) == len(_regras):
+            break  # todas as regras já apareceram: não precisa ler o resto
+
+
+def _montar(primeiros):
+    """Monta os campos a partir dos matches, respeitando a prioridade das regras."""
+    resultado = ResultadoExtracao()
+    candidatos = {}
+    for i, match in primeiros.items():
+        regra = _regras[i]
+        confianca = regra.confianca(match)
+        for campo, valor in regra.extrair(match).items():
+            corrigido = False
+            if isinstance(valor, str):
+                valor, corrigido = regra.normalizar(valor)
+            detalhe = {
+                'valor': valor,
+                'inicio': match.start(),
+                'fim': match.end(),
+                'regra': regra.nome,
+                'confianca': round(confianca * (0.9 if corrigido else 1.0), 2),
+            }
+            atual = candidatos.get(campo)
+            if atual is None or (regra.prioridade, -match.start()) > (atual[0], -atual[1]['inicio']):
+                candidatos[campo] = (regra.prioridade, detalhe)
+
+    detalhes = {campo: detalhe for campo, (_, detalhe) in candidatos.items()}
+    for combinador in _combinadores:
+        for campo, (valor, fontes) in combinador(detalhes).items():
+            origens = [detalhes[f] for f in fontes]
+            detalhes[campo] = {
+                'valor': valor,
+                'inicio': min(o['inicio'] for o in origens),
+                'fim': max(o['fim'] for o in origens),
+                'regra': '+'.join(o['regra'] for o in origens),
+                'confianca': min(o['confianca'] for o in origens),
+            }
+
+    for campo, detalhe in detalhes.items():
+        if campo.startswith('_'):
+            continue
+        resultado.dados[campo] = detalhe['valor']
+        resultado.detalhes[campo] = detalhe
+    return resultado
+
+
+# --- Regex Refinadas (v6) ---
+# Mesmos padrões de antes, agora pré-compilados e tolerantes às variações de
+# OCR que aparecem nos PDFs escaneados (N[º'q9], 'oe' no lugar de 'de', etc.).
+
+# Padrão ÚNICO para TIPO e NÚMERO.
+# Procura "PROJETO DE LEI..." e DEPOIS "N... 45"
+registrar_regra(RegraCampo(
+    "tipo_e_numero",
+    r"(PROJETO DE LEI (ORDIN[ÁA]RIA|COMPLEMENTAR)|PROJETO DE RESOLUÇÃO|PROJETO DE DECRETO LEGISLATIVO|PROPOSTA DE EMENDA [ÁA] LEI ORG[ÂA]NICA MUNICIPAL)\s*(N[º'q9]|n[oº9]|ne)\s*(\d+)",
+    extrair=lambda m: {"TIPO_PROJETO": m.group(1).upper().strip(), "_NUMERO": m.group(4)},
+    # 'Nº'/'nº'/'no' é o texto correto; as demais formas são ruído de OCR
+    confianca=lambda m: 1.0 if m.group(3) in ("Nº", "nº", "no", "No", "NO") else 0.8,
+    inicio=r"[Pp]",
+))
+
+registrar_regra(RegraCampo(
+    "data",
+    r"(\d{1,2}\s+de\s+\w+\s+(de|oe)\s+(\d{4}))",
+    extrair=lambda m: {"DATA_PROJETO": m.group(1).strip(), "_ANO": m.group(3)},
+    confianca=lambda m: 1.0 if m.group(2).lower() == "de" else 0.8,
+    inicio=r"\d",
+))
+
+# A ementa vai de uma aspa até a próxima: '[^"]' no lugar do '.*?' com DOTALL
+# evita que cada aspa do documento dispare uma varredura até o fim do texto.
+registrar_regra(RegraCampo(
+    "ementa",
+    r"\"\s*(Abre[^\"]*?Anual[^\"]*?)\s*\"",
+    extrair=lambda m: {"EMENTA": f'"{m.group(1).strip()}"'},
+    normalizadores=[("Í", "i"), ("çá", "çã"), ("ôe", "õe")],
+    inicio=r"\"",
+))
+
+
+@registrar_combinador
+def combinar_numero_projeto(detalhes):
+    """Combina número e ano no formato que o sistema espera (ex: "045/2025")."""
+    if "_NUMERO" in detalhes and "_ANO" in detalhes:
+        valor = f"{detalhes['_NUMERO']['valor'].zfill(3)}/{detalhes['_ANO']['valor']}"
+        return {"NUMERO_PROJETO": (valor, ["_NUMERO", "_ANO"])}
+    return {}
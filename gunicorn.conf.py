@@ -0,0 +1,16 @@
+# gunicorn.conf.py - GANCHOS DO GUNICORN
+#
+# O gunicorn lê este arquivo sozinho quando é iniciado nesta pasta
+# (gunicorn app:app). Bind, número de workers etc. continuam vindo da linha
+# de comando ou da variável GUNICORN_CMD_ARGS.
+
+
+def post_worker_init(worker):
+    """
+    Roda em cada worker, logo depois do fork e da carga do app: aquece os
+    templates, o elenco e o locale numa thread, para que a primeira geração
+    depois de um deploy não pague por isso. Desligue com AQUECER_NA_INICIALIZACAO=0.
+    """
+    from app import app, iniciar_aquecimento
+    if app.config['AQUECER_NA_INICIALIZACAO']:
+        iniciar_aquecimento()
@@ -0,0 +1,215 @@
+# metricas.py - INSTRUMENTAÇÃO: TEMPOS, CONTADORES E LOGS ESTRUTURADOS
+#
+# Substitui os prints de depuração dos caminhos quentes. Cada trecho medido
+# ("span") vira uma observação no histograma 'legistech_span_segundos' e os
+# eventos (campo encontrado, cache aproveitado...) viram contadores. Tudo é
+# exposto em /metrics no formato texto do Prometheus, sem dependências extras.
+#
+#     with metricas.medir('extracao.abrir_pdf'):
+#         doc = fitz.open(caminho)
+#     metricas.contar('campos_extraidos', campo='EMENTA', resultado='encontrado')
+#
+# Os números são por processo: com vários workers do gunicorn, cada scrape
+# vê o worker que atendeu. Trechos que rodam em outro processo (pool de
+# processos) devem usar 'coletor=' e devolver os tempos para o processo pai,
+# que os registra com 'registrar_tempos'. Um processo filho inteiro (ex: a
+# extração isolada) manda o seu 'instantaneo()' e o pai faz 'mesclar'.
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (em segundos) dos buckets do histograma: de 1 ms a 1 min
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger('legistech.metricas')
+
+
+def _rotulos_chave(rotulos):
+    return tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+
+def _formatar_rotulos(chave, extra=()):
+    pares = list(chave) + list(extra)
+    if not pares:
+        return ''
+    escapados = []
+    for k, v in pares:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escapados.append(f'{k}="{v}"')
+    return '{' + ','.join(escapados) + '}'
+
+
+class Metricas:
+    """Registro de contadores, medidores e histogramas de tempo (thread-safe)."""
+
+    def __init__(self, prefixo='legistech'):
+        self.prefixo = prefixo
+        self._lock = threading.Lock()
+        self._contadores = {}   # (nome, rotulos) -> valor
+        self._histogramas = {}  # rotulos do span -> [contagens por bucket, soma, total]
+        self._coletores = []    # funções que devolvem [(nome, rotulos, valor)] na hora do scrape
+        self._descricoes = {}
+
+    def descrever(self, nome, descricao):
+        self._descricoes[nome] = descricao
+
+    def contar(self, nome, valor=1, **rotulos):
+        """Soma 'valor' ao contador 'nome' com os rótulos dados."""
+        chave = (nome, _rotulos_chave(rotulos))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, span, segundos, **rotulos):
+        """Registra a duração de um trecho no histograma de spans."""
+        chave = _rotulos_chave(dict(rotulos, span=span))
+        with self._lock:
+            entrada = self._histogramas.get(chave)
+            if entrada is None:
+                entrada = self._histogramas[chave] = [[0] * len(BUCKETS_SEGUNDOS), 0.0, 0]
+            for i, limite in enumerate(BUCKETS_SEGUNDOS):
+                if segundos <= limite:
+                    entrada[0][i] += 1
+            entrada[1] += segundos
+            entrada[2] += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('span %s: %.1f ms', span, segundos * 1000,
+                         extra={'span': span, 'duracao_ms': round(segundos * 1000, 3), **rotulos})
+
+    @contextmanager
+    def medir(self, span, coletor=None, **rotulos):
+        """
+        Mede o bloco 'with'. Com 'coletor' (uma lista), o tempo é só anotado
+        nela como (span, segundos, rotulos), para ser registrado depois.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            if coletor is not None:
+                coletor.append((span, segundos, rotulos))
+            else:
+                self.observar(span, segundos, **rotulos)
+
+    def registrar_tempos(self, tempos):
+        """Registra os tempos anotados por 'medir(..., coletor=...)' (ex: num processo filho)."""
+        for span, segundos, rotulos in tempos or ():
+            self.observar(span, segundos, **rotulos)
+
+    def instantaneo(self):
+        """Cópia dos contadores e histogramas (pode ser enviada a outro processo, ver 'mesclar')."""
+        with self._lock:
+            return {
+                'contadores': dict(self._contadores),
+                'histogramas': {k: [list(v[0]), v[1], v[2]] for k, v in self._histogramas.items()},
+            }
+
+    def mesclar(self, instantaneo):
+        """Soma a este registro o 'instantaneo()' de outro processo."""
+        with self._lock:
+            for chave, valor in instantaneo['contadores'].items():
+                self._contadores[chave] = self._contadores.get(chave, 0) + valor
+            for chave, (buckets, soma, total) in instantaneo['histogramas'].items():
+                entrada = self._histogramas.get(chave)
+                if entrada is None:
+                    entrada = self._histogramas[chave] = [[0] * len(BUCKETS_SEGUNDOS), 0.0, 0]
+                entrada[0] = [a + b for a, b in zip(entrada[0], buckets)]
+                entrada[1] += soma
+                entrada[2] += total
+
+    def registrar_coletor(self, funcao):
+        """'funcao()' devolve [(nome, rotulos, valor)] de medidores lidos na hora do scrape."""
+        self._coletores.append(funcao)
+        return funcao
+
+    def limpar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    def reiniciar_apos_fork(self):
+        """No processo filho: lock novo (o copiado pode estar travado) e registro vazio."""
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._histogramas.items())
+
+        linhas = []
+        vistos = set()
+        for (nome, rotulos), valor in contadores:
+            completo = f'{self.prefixo}_{nome}_total'
+            if completo not in vistos:
+                vistos.add(completo)
+                linhas.append(f'# HELP {completo} {self._descricoes.get(nome, nome)}')
+                linhas.append(f'# TYPE {completo} counter')
+            linhas.append(f'{completo}{_formatar_rotulos(rotulos)} {valor}')
+
+        if histogramas:
+            nome = f'{self.prefixo}_span_segundos'
+            linhas.append(f'# HELP {nome} Duração dos trechos instrumentados.')
+            linhas.append(f'# TYPE {nome} histogram')
+            for rotulos, (buckets, soma, total) in histogramas:
+                for limite, quantidade in zip(BUCKETS_SEGUNDOS, buckets):
+                    linhas.append(f'{nome}_bucket{_formatar_rotulos(rotulos, [("le", f"{limite:g}")])} {quantidade}')
+                linhas.append(f'{nome}_bucket{_formatar_rotulos(rotulos, [("le", "+Inf")])} {total}')
+                linhas.append(f'{nome}_sum{_formatar_rotulos(rotulos)} {soma:.6f}')
+                linhas.append(f'{nome}_count{_formatar_rotulos(rotulos)} {total}')
+
+        for funcao in self._coletores:
+            try:
+                medidas = list(funcao())
+            except Exception as e:  # um coletor com problema não derruba o scrape
+                logger.warning('Coletor de métricas %s falhou: %s', funcao.__name__, e)
+                continue
+            for nome, rotulos, valor in medidas:
+                completo = f'{self.prefixo}_{nome}'
+                if completo not in vistos:
+                    vistos.add(completo)
+                    linhas.append(f'# HELP {completo} {self._descricoes.get(nome, nome)}')
+                    linhas.append(f'# TYPE {completo} gauge')
+                linhas.append(f'{completo}{_formatar_rotulos(_rotulos_chave(rotulos))} {valor}')
+        return '\n'.join(linhas) + '\n'
+
+
+class FormatoJson(logging.Formatter):
+    """Uma linha JSON por registro de log, com os campos passados em 'extra='."""
+
+    CAMPOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, registro):
+        saida = {
+            'ts': self.formatTime(registro, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': registro.levelname,
+            'logger': registro.name,
+            'msg': registro.getMessage(),
+        }
+        for chave, valor in vars(registro).items():
+            if chave not in self.CAMPOS_PADRAO and not chave.startswith('_'):
+                saida[chave] = valor
+        if registro.exc_info:
+            saida['excecao'] = self.formatException(registro.exc_info)
+        return json.dumps(saida, ensure_ascii=False, default=str)
+
+
+def configurar_logs(nivel='INFO', formato_json=False):
+    """Configura o logger 'legistech' (texto simples ou JSON, uma linha por evento)."""
+    raiz = logging.getLogger('legistech')
+    raiz.setLevel(nivel)
+    if not raiz.handlers:
+        raiz.addHandler(logging.StreamHandler())
+    raiz.propagate = False
+    for handler in raiz.handlers:
+        handler.setFormatter(FormatoJson() if formato_json else
+                             logging.Formatter('%(asctime)s %(levelname)s [%(process)d] %(message)s'))
+    return raiz
+
+
+# Registro global do processo
+metricas = Metricas()
@@ -0,0 +1,64 @@
+# ocr.py - OCR DAS PÁGINAS ESCANEADAS (PyMuPDF + Tesseract)
+#
+# Muitos projetos chegam escaneados: a página é só uma imagem e o
+# page.get_text() devolve pouco ou nada. Essas páginas são renderizadas e
+# passadas pelo Tesseract (via page.get_textpage_ocr do PyMuPDF). O OCR é
+# caro, então:
+#   - só entram as páginas com imagem e pouca camada de texto ('precisa_ocr');
+#   - cada página é identificada pelo hash do seu conteúdo ('hash_pagina'),
+#     e quem chama guarda o texto reconhecido por esse hash;
+#   - 'reconhecer_pagina' abre o PDF sozinha, para poder rodar num processo
+#     separado (uma página por núcleo).
+#
+# Sem o Tesseract instalado (ou sem o idioma em TESSDATA_PREFIX),
+# 'tesseract_disponivel' devolve False e a extração segue só com o texto.
+
+import functools
+import hashlib
+import os
+
+import fitz
+
+
+@functools.lru_cache(maxsize=None)
+def tesseract_disponivel(idioma='por'):
+    """True se o PyMuPDF encontra o tessdata com o idioma pedido."""
+    try:
+        pasta = fitz.get_tessdata()
+    except RuntimeError:
+        return False
+    return all(os.path.isfile(os.path.join(pasta, f'{parte}.traineddata')) for parte in idioma.split('+'))
+
+
+def caracteres_uteis(texto):
+    return sum(1 for c in texto if c.isalnum())
+
+
+def precisa_ocr(page, texto, minimo_caracteres):
+    """
+    A página tem imagens e menos que 'minimo_caracteres' letras/dígitos na
+    camada de texto? Páginas em branco (sem imagem) não passam pelo OCR.
+    """
+    return caracteres_uteis(texto) < minimo_caracteres and bool(page.get_images())
+
+
+def hash_pagina(doc, page):
+    """
+    sha256 do que aparece na página: o stream de conteúdo, as imagens (bytes
+    ainda comprimidos, sem decodificar) e a geometria. A mesma página
+    escaneada em outro PDF tem o mesmo hash.
+    """
+    h = hashlib.sha256()
+    h.update(f'{tuple(page.rect)}|{page.rotation}'.encode('ascii'))
+    h.update(page.read_contents())
+    for imagem in page.get_images(full=True):
+        h.update(doc.xref_stream_raw(imagem[0]) or b'')
+    return h.hexdigest()
+
+
+def reconhecer_pagina(pdf_path, indice, idioma='por', dpi=300):
+    """Texto reconhecido pelo OCR na página 'indice' (base 0). Pode rodar num processo do pool."""
+    with fitz.open(pdf_path) as doc:
+        page = doc[indice]
+        textpage = page.get_textpage_ocr(language=idioma, dpi=dpi, full=True)
+        return page.get_text(textpage=textpage)